@@ -1,25 +1,59 @@
 import base64
 import json
 import logging
-import requests
+import os
+import time
 from flask import Flask, request, Response
+from requests import RequestException
+from sqlalchemy.exc import IntegrityError, OperationalError
 
-from auth.frejaeid import urls
+from auth.frejaeid import batching, transport, urls
 from auth.frejaeid.payload import FrejaEID
 from auth.frejaeid.models import db, User
+from common import profiling, resilience
 
 
 logging.basicConfig(level=logging.INFO, filemode="a", filename="local_demo.log", format="%(asctime)s;%(levelname)s;%(name)s;%(message)s")
 
 logger = logging.getLogger('id_service')
 
+# Seconds a voter has to approve a signature request in the Freja app
+SIGN_TTL = int(os.getenv('FREJA_SIGN_TTL', 2 * 24 * 60 * 60))
+# Seconds a call to Freja may take at most, the deadline of the request may leave less
+FREJA_TIMEOUT = float(os.getenv('FREJA_TIMEOUT', 10))
+# Seconds between two looks at the signature results for `/sign_events`
+SIGN_EVENTS_INTERVAL = float(os.getenv('FREJA_SIGN_EVENTS_INTERVAL', 1))
+# Seconds a `/sign_events` stream stays open before the subscriber has to reconnect
+SIGN_EVENTS_DURATION = float(os.getenv('FREJA_SIGN_EVENTS_DURATION', 300))
+
+# Seconds an authentication stays usable for voting, older ones are deleted
+AUTH_TTL = int(os.getenv('FREJA_AUTH_TTL', 24 * 60 * 60))
+# Seconds the final outcome of an authentication is answered from the database instead of asking Freja again
+VALIDITY_CACHE_TTL = int(os.getenv('FREJA_VALIDITY_CACHE_TTL', 5 * 60))
+# Minimum seconds between two deletions of expired authentications, per worker
+SWEEP_INTERVAL = 60
+
+# Statuses after which a signature request does not change anymore
+FINAL_SIGN_STATUSES = ('APPROVED', 'CANCELED', 'RP_CANCELED', 'EXPIRED', 'REJECTED')
+# Same for authentications
+FINAL_AUTH_STATUSES = ('APPROVED', 'CANCELED', 'RP_CANCELED', 'EXPIRED', 'REJECTED')
+
 app = Flask(__name__, static_url_path='/static')
 
-# Create an in-memory database
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+# File database shared by all workers and kept across restarts
+app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath(os.getenv('AUTH_DB', 'auth.db'))}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
-db.create_all(app=app)
+try:
+  db.create_all(app=app)
+except OperationalError:
+  # Another worker created the tables in the meantime
+  db.create_all(app=app)
+
+profiling.init_app(app)
+resilience.init_app(app)
+
+FREJA_BREAKER = resilience.breaker('freja')
 
 
 def _validate_auth_body(content):
@@ -53,11 +87,9 @@ def initiate_authentication():
   
   user_email = request.get_json().get('email')
 
-  r = requests.post(
+  r = _freja_post(
     urls.initiate_authentication(),
     data=FrejaEID.get_body_for_init_auth(user_email),
-    cert=_get_client_ssl_certificate(),
-    verify=_get_server_certificate()
   )
   if r.status_code == 422 and r.json()['code'] == 2000:
     return Response(json.dumps({'message': 'Why are you doing it again? See your phone!'}), status=400)
@@ -106,21 +138,52 @@ def _register_vote(auth_ref):
 
 
 def _check_validity(auth_ref) -> Response:
-  user = User.query.filter_by(freja_auth_ref=auth_ref).first()
+  response = _stored_validity(auth_ref)
+  if response is not None:
+    return response
+
+  status_code, response_body = _auth_result(auth_ref)
+  return _validity_from_freja(auth_ref, status_code, response_body)
+
+
+def _find_user(auth_ref):
+  return User.query.filter(
+    User.freja_auth_ref == auth_ref,
+    User.created_at > time.time() - AUTH_TTL,
+  ).first()
+
+
+def _stored_validity(auth_ref):
+  """
+  Validity of an authentication as far as it is known without asking Freja, None if Freja has to be asked.
+  """
+  user = _find_user(auth_ref)
 
   if user is None:
     return Response(json.dumps({'message': f'You are not authenticated.'}), status=401)
-  
-  request_to_check_validity = requests.post(
-    urls.get_one_result(),
-    data=FrejaEID.get_body_for_checking_validity_of_user_session(user.freja_auth_ref),
-    cert=_get_client_ssl_certificate(),
-    verify=_get_server_certificate(),
-  )
 
-  response_body = request_to_check_validity.json()
+  if user.validated_at is not None and user.validated_at > time.time() - VALIDITY_CACHE_TTL:
+    return Response(user.validity_body, status=user.validity_status)
+
+  return None
 
-  if request_to_check_validity.status_code == 200:
+
+def _validity_from_freja(auth_ref, status_code, response_body) -> Response:
+  response = _validity_response(status_code, response_body)
+
+  if status_code == 200 and response_body['status'] in FINAL_AUTH_STATUSES:
+    User.query.filter_by(freja_auth_ref=auth_ref).update({
+      'validated_at': time.time(),
+      'validity_status': response.status_code,
+      'validity_body': response.get_data(as_text=True),
+    })
+    db.session.commit()
+
+  return response
+
+
+def _validity_response(status_code, response_body) -> Response:
+  if status_code == 200:
     if response_body['status'] == 'CANCELED':
       return Response(json.dumps({'message': 'You denied the authentication on the mobile and hence cannot vote. चित भी मेरी पट भी मेरी'}), status=403)
 
@@ -147,16 +210,14 @@ def cancel_authentication():
   
   auth_ref = request.get_json().get('authRef')
 
-  user = User.query.filter_by(freja_auth_ref=auth_ref).first()
+  user = _find_user(auth_ref)
 
   if user is None:
     return Response(json.dumps({'message': 'User does not exist.'}), status=401)
   
-  r = requests.post(
+  r = _freja_post(
     urls.cancel_autentication(),
     data=FrejaEID.get_body_for_cancel_auth(user.freja_auth_ref),
-    cert=_get_client_ssl_certificate(),
-    verify=_get_server_certificate()
   )
 
   if r.status_code == 200:
@@ -172,7 +233,8 @@ def cancel_authentication():
 
 
 def _save_auth_ref(auth_ref: str) -> None:
-  user = User.query.filter_by(freja_auth_ref=auth_ref).first()
+  _sweep_expired()
+  user = _find_user(auth_ref)
 
   if user:
     return (user, False)
@@ -182,11 +244,32 @@ def _save_auth_ref(auth_ref: str) -> None:
 
     # add the new user to the database
     db.session.add(new_user)
-    db.session.commit()
+    try:
+      db.session.commit()
+    except IntegrityError:
+      # Saved by another worker at the same time
+      db.session.rollback()
+      return (_find_user(auth_ref), False)
 
     return (new_user, True)
 
 
+_last_sweep = 0.0
+
+
+def _sweep_expired():
+  global _last_sweep
+  now = time.time()
+  if now - _last_sweep < SWEEP_INTERVAL:
+    return
+  _last_sweep = now
+
+  expired = User.query.filter(User.created_at <= now - AUTH_TTL).delete()
+  db.session.commit()
+  if expired:
+    logger.info(f'Deleted {expired} expired authentications')
+
+
 def _validate_sign_body(content):
   if content is None:
     return Response(json.dumps({'message': '`Content-Type` header must be `application/json`.'}), status=400)
@@ -216,11 +299,10 @@ def initiate_signing():
   b64encode_bytes_vote = base64.b64encode(hash_bytes)
   b64encode_bytes_string = b64encode_bytes_vote.decode('utf-8')
 
-  r = requests.post(
+  expiry = int((time.time() + SIGN_TTL) * 1000)
+  r = _freja_post(
     urls.initiate_signing(),
-    data=FrejaEID.get_body_for_init_sign(user_email, b64encode_bytes_string),
-    cert=_get_client_ssl_certificate(),
-    verify=_get_server_certificate()
+    data=FrejaEID.get_body_for_init_sign(user_email, b64encode_bytes_string, expiry),
   )
 
   logger.info(f'11 -> (receive) forwarded request by web_server {user_email},{b64encode_bytes_string}')
@@ -229,7 +311,8 @@ def initiate_signing():
     freja_sign_ref = r.json()['signRef']
     return Response(json.dumps({
       'message': 'Here is the signature reference',
-      'signRef': freja_sign_ref
+      'signRef': freja_sign_ref,
+      'expiry': expiry,
     }))
     
   ## Adding this for the sake of defensive programming and debugging in future.
@@ -244,30 +327,122 @@ def confirm_if_user_has_signed():
   if sign_ref is None:
     return Response(json.dumps({'message': '\'signRef\' atttribute missing in payload'}), status=400)
 
-  r = requests.post(
-    urls.confirm_signing(),
-    data=FrejaEID.get_body_for_confirming_signature(sign_ref),
-    cert=_get_client_ssl_certificate(),
-    verify=_get_server_certificate()
-  )
+  status_code, response_body = _sign_result(sign_ref)
 
-  if r.status_code == 200:
-    status = r.json()['status']
+  if status_code == 200:
+    status = response_body['status']
     if status == 'APPROVED':
-      user_email = _get_email_from_jws_payload(r.json()['details'])
+      user_email = _get_email_from_jws_payload(response_body['details'])
       logger.info(f'14 -> (send) successful vote signing: {user_email},{sign_ref}')
       return Response(json.dumps({
         'message': 'Signing successful',
-        'signature': r.json()['details']
+        'signature': response_body['details']
       }))
     else:
       return Response(json.dumps({
-        'message': 'Signing unsuccessful'
+        'message': 'Signing unsuccessful',
+        'status': status,
       }), status=400)
   
   return Response(json.dumps({'message': 'Connection with Freja failed'}), status=500)
 
 
+def _auth_result(auth_ref):
+  """
+  Status of an authentication as the HTTP status and body of `getOneResult`. Taken from a batch when possible.
+  """
+  result = AUTH_RESULTS.get(auth_ref)
+  if result is not None:
+    return 200, result
+
+  r = _freja_post(
+    urls.get_one_result(),
+    data=FrejaEID.get_body_for_checking_validity_of_user_session(auth_ref),
+  )
+  return r.status_code, r.json()
+
+
+def _sign_result(sign_ref):
+  """
+  Status of a signature as the HTTP status and body of `getOneResult`. Taken from a batch when possible.
+  """
+  result = SIGN_RESULTS.get(sign_ref)
+  if result is not None:
+    return 200, result
+
+  r = _freja_post(
+    urls.confirm_signing(),
+    data=FrejaEID.get_body_for_confirming_signature(sign_ref),
+  )
+  return r.status_code, r.json()
+
+
+def _fetch_auth_results():
+  r = _freja_post(urls.get_results(), data=FrejaEID.get_body_for_auth_results())
+  if r.status_code != 200:
+    # Every caller falls back to `getOneResult`
+    logger.warning(f'Could not fetch authentication results: {r.text}')
+    return {}
+  return {result['authRef']: result for result in r.json()['authenticationResults']}
+
+
+def _fetch_sign_results():
+  r = _freja_post(urls.get_sign_results(), data=FrejaEID.get_body_for_sign_results())
+  if r.status_code != 200:
+    logger.warning(f'Could not fetch signature results: {r.text}')
+    return {}
+  return {result['signRef']: result for result in r.json()['signatureResults']}
+
+
+# Concurrent status checks of a worker share their `getResults` calls
+AUTH_RESULTS = batching.ResultBatcher(_fetch_auth_results)
+SIGN_RESULTS = batching.ResultBatcher(_fetch_sign_results)
+
+
+@app.route('/sign_events', methods=['GET'])
+def sign_events():
+  """
+  Server-sent events for the signature requests that ended, as soon as they show up in the results of Freja.
+
+  Freja reports the requests that ended in the last ten minutes, all of them are sent once when a subscriber connects.
+  The results are fetched through `SIGN_RESULTS`, so subscribers and status checks share the calls to Freja.
+
+  Every open stream holds a thread of the worker, so the server has to run with threads (`--threads`) or as ASGI.
+  The stream ends after `SIGN_EVENTS_DURATION` seconds and the subscriber reconnects, so that no thread is held forever.
+  """
+  def stream():
+    sent = set()
+    end = time.monotonic() + SIGN_EVENTS_DURATION
+    while time.monotonic() < end:
+      try:
+        results = SIGN_RESULTS.results()
+      except (RequestException, resilience.CircuitOpen) as e:
+        logger.warning(f'Could not fetch signature results for the subscribers: {e}')
+      else:
+        for event in _new_sign_events(results, sent):
+          yield event
+      # Also lets the subscriber notice a dead connection
+      yield ': keep-alive\n\n'
+      time.sleep(SIGN_EVENTS_INTERVAL)
+
+  return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def _new_sign_events(results, sent):
+  # Forget what Freja does not report anymore
+  sent.intersection_update(results)
+  for sign_ref, result in results.items():
+    if sign_ref in sent or result['status'] not in FINAL_SIGN_STATUSES:
+      continue
+    sent.add(sign_ref)
+
+    event = {'signRef': sign_ref, 'status': result['status']}
+    if result['status'] == 'APPROVED':
+      event['signature'] = result['details']
+      logger.info(f'14 -> (send) successful vote signing: {_get_email_from_jws_payload(result["details"])},{sign_ref}')
+    yield f'data: {json.dumps(event)}\n\n'
+
+
 def _get_email_from_jws_payload(jws_payload):
   _, payload, _ = jws_payload.split('.')
   # Needed to prevent incorrect padding error
@@ -275,6 +450,26 @@ def _get_email_from_jws_payload(jws_payload):
   payload_decoded = json.loads(base64.b64decode(payload).decode('utf-8'))
   return payload_decoded['userInfo']
 
+# Shared by all requests of the process, so that connections and TLS sessions to Freja are reused
+def _freja():
+  return transport.session(_get_client_ssl_certificate(), _get_server_certificate())
+
+
+def _freja_post(url, data):
+  # The deadline header is only for our own services
+  timeout = resilience.outbound(FREJA_TIMEOUT)['timeout']
+  return FREJA_BREAKER.call(_freja().post, url, data=data, timeout=timeout)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+  return Response(json.dumps({
+    'freja': transport.stats(_freja()),
+    'batches': {'auth': AUTH_RESULTS.stats(), 'sign': SIGN_RESULTS.stats()},
+    'breakers': resilience.states(),
+  }))
+
+
 # FrejaEid uses it to identify who is making API requests
 def _get_client_ssl_certificate():
   return (
@@ -0,0 +1,339 @@
+"""
+ASGI variant of the auth service.
+
+Serves the same routes as `auth.frejaeid.app`, but calls Freja with `AsyncFrejaClient` on an event loop, so one worker
+can hold thousands of outstanding auth and sign sessions. When the outbound budget is exhausted, requests fail fast
+with `503 Service Unavailable` and a `Retry-After` header; calls that exceed their deadline fail with
+`504 Gateway Timeout`.
+
+Authentications are kept in the same database as `auth.frejaeid.app`, through its functions.
+
+Run with e.g. `hypercorn auth.frejaeid.asgi:app -b 127.0.0.1:8001`.
+"""
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+from quart import Quart, Response, g, request
+
+from auth.frejaeid import transport, urls
+from auth.frejaeid.app import (
+  SIGN_EVENTS_DURATION,
+  SIGN_EVENTS_INTERVAL,
+  SIGN_TTL,
+  _find_user,
+  _get_client_ssl_certificate,
+  _get_email_from_jws_payload,
+  _get_server_certificate,
+  _new_sign_events,
+  _save_auth_ref,
+  _stored_validity,
+  _validate_auth_body,
+  _validate_body_with_auth_ref,
+  _validate_sign_body,
+  _validity_from_freja,
+  logger,
+)
+from auth.frejaeid.app import app as flask_app
+from auth.frejaeid.batching import AsyncResultBatcher
+from auth.frejaeid.client import AsyncFrejaClient, DeadlineExceeded, Overloaded
+from auth.frejaeid.payload import FrejaEID
+from common import resilience
+
+
+app = Quart(__name__, static_url_path='/static')
+
+
+async def _with_db(func, *args):
+  """
+  Run `func` of `auth.frejaeid.app` in a thread, within the Flask application context its database needs.
+  """
+  def call():
+    with flask_app.app_context():
+      return func(*args)
+
+  return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+def _from_flask(response):
+  return Response(response.get_data(), status=response.status_code)
+
+
+def _is_authenticated(auth_ref):
+  return _find_user(auth_ref) is not None
+
+
+def _save_auth_ref_created(auth_ref):
+  _, created = _save_auth_ref(auth_ref)
+  return created
+
+
+@app.before_serving
+async def _open_client():
+  # The certificates are loaded once here, and connections and TLS sessions are reused by all requests
+  app.freja = AsyncFrejaClient(transport.ssl_context(_get_client_ssl_certificate(), _get_server_certificate()))
+
+
+@app.after_serving
+async def _close_client():
+  await app.freja.aclose()
+
+
+@app.errorhandler(Overloaded)
+async def _overloaded(e):
+  response = Response(json.dumps({'message': 'Too many requests to Freja in progress, try again later.'}), status=503)
+  response.headers['Retry-After'] = str(e.retry_after)
+  return response
+
+
+@app.errorhandler(DeadlineExceeded)
+async def _deadline_exceeded(e):
+  logger.warning(str(e))
+  return Response(json.dumps({'message': 'Freja did not answer in time.'}), status=504)
+
+
+@app.errorhandler(resilience.CircuitOpen)
+async def _circuit_open(e):
+  return resilience.circuit_open_response(e, Response)
+
+
+@app.errorhandler(httpx.TransportError)
+async def _freja_unreachable(e):
+  logger.warning(f'Could not reach Freja: {e!r}')
+  return resilience.unreachable_response(e, Response)
+
+
+@app.before_request
+async def _start_deadline():
+  g.deadline = resilience.deadline_from(request.headers)
+
+
+async def _freja_post(url, data):
+  return await app.freja.post(url, data, g.deadline)
+
+
+async def _validate(validator):
+  # The validators of `auth.frejaeid.app` build Flask responses, only their status and body are reused
+  result = validator(await request.get_json())
+  if result.status_code == 400:
+    return _from_flask(result)
+  return None
+
+
+@app.route('/init_auth', methods=['POST'])
+async def initiate_authentication():
+  error = await _validate(_validate_auth_body)
+  if error is not None:
+    return error
+
+  user_email = (await request.get_json()).get('email')
+
+  r = await _freja_post(urls.initiate_authentication(), FrejaEID.get_body_for_init_auth(user_email))
+  if r.status_code == 422 and r.json()['code'] == 2000:
+    return Response(json.dumps({'message': 'Why are you doing it again? See your phone!'}), status=400)
+
+  if r.status_code == 200:
+    freja_auth_ref = r.json()['authRef']
+    if await _with_db(_save_auth_ref_created, freja_auth_ref):
+      return Response(json.dumps(
+        {
+          'message': 'You have been logged in. Check your phone :)',
+          'authRef': freja_auth_ref,
+        }
+      ), status=200)
+    else:
+      return Response(json.dumps(
+        {
+          'message': 'You have already been authenticated with Freja. Please proceed to vote.',
+          'authRef': freja_auth_ref,
+        }
+      ), status=403)
+
+  return Response(json.dumps({'message': f'Could not process {r.json()}'}), status=500)
+
+
+@app.route('/authentication_validity', methods=['POST'])
+async def authentication_validity():
+  error = await _validate(_validate_body_with_auth_ref)
+  if error is not None:
+    return error
+
+  auth_ref = (await request.get_json()).get('authRef')
+
+  return await _check_validity(auth_ref)
+
+
+async def _check_validity(auth_ref) -> Response:
+  response = await _with_db(_stored_validity, auth_ref)
+  if response is None:
+    status_code, response_body = await _auth_result(auth_ref)
+    response = await _with_db(_validity_from_freja, auth_ref, status_code, response_body)
+
+  return _from_flask(response)
+
+
+@app.route('/cancel', methods=['POST'])
+async def cancel_authentication():
+  error = await _validate(_validate_body_with_auth_ref)
+  if error is not None:
+    return error
+
+  auth_ref = (await request.get_json()).get('authRef')
+
+  if not await _with_db(_is_authenticated, auth_ref):
+    return Response(json.dumps({'message': 'User does not exist.'}), status=401)
+
+  r = await _freja_post(urls.cancel_autentication(), FrejaEID.get_body_for_cancel_auth(auth_ref))
+
+  if r.status_code == 200:
+    return Response(json.dumps({'message': 'Authentication cancelled for the given authentication reference.'}))
+
+  if r.json()['code'] == 1100:
+    return Response(json.dumps({'message': 'You are not in the middle of authentication process.'}), status=400)
+
+  if r.json()['code'] == 1004:
+    return Response(json.dumps({'message': 'You are not allowed to call this method.'}), status=403)
+
+  return Response(json.dumps({'message': f'Could not process {r.json()}'}), status=500)
+
+
+@app.route('/init_sign', methods=['POST'])
+async def initiate_signing():
+  error = await _validate(_validate_sign_body)
+  if error is not None:
+    return error
+
+  content = await request.get_json()
+  user_email = content.get('email')
+  vote = content.get('vote')
+
+  b64encode_bytes_string = base64.b64encode(bytes(vote, 'utf-8')).decode('utf-8')
+
+  expiry = int((time.time() + SIGN_TTL) * 1000)
+  r = await _freja_post(
+    urls.initiate_signing(),
+    FrejaEID.get_body_for_init_sign(user_email, b64encode_bytes_string, expiry),
+  )
+
+  logger.info(f'11 -> (receive) forwarded request by web_server {user_email},{b64encode_bytes_string}')
+
+  if r.status_code == 200:
+    freja_sign_ref = r.json()['signRef']
+    return Response(json.dumps({
+      'message': 'Here is the signature reference',
+      'signRef': freja_sign_ref,
+      'expiry': expiry,
+    }))
+
+  return Response(json.dumps({'message': f'Could not process {r.json()}'}), status=500)
+
+
+@app.route('/confirm_sign', methods=['POST'])
+async def confirm_if_user_has_signed():
+  logger.info('13 -> (receiver) has user signed yet?')
+  sign_ref = (await request.get_json()).get('signRef')
+
+  if sign_ref is None:
+    return Response(json.dumps({'message': '\'signRef\' atttribute missing in payload'}), status=400)
+
+  status_code, response_body = await _sign_result(sign_ref)
+
+  if status_code == 200:
+    status = response_body['status']
+    if status == 'APPROVED':
+      user_email = _get_email_from_jws_payload(response_body['details'])
+      logger.info(f'14 -> (send) successful vote signing: {user_email},{sign_ref}')
+      return Response(json.dumps({
+        'message': 'Signing successful',
+        'signature': response_body['details']
+      }))
+    else:
+      return Response(json.dumps({
+        'message': 'Signing unsuccessful',
+        'status': status,
+      }), status=400)
+
+  return Response(json.dumps({'message': 'Connection with Freja failed'}), status=500)
+
+
+async def _auth_result(auth_ref):
+  result = await AUTH_RESULTS.get(auth_ref)
+  if result is not None:
+    return 200, result
+
+  r = await _freja_post(urls.get_one_result(), FrejaEID.get_body_for_checking_validity_of_user_session(auth_ref))
+  return r.status_code, r.json()
+
+
+async def _sign_result(sign_ref):
+  result = await SIGN_RESULTS.get(sign_ref)
+  if result is not None:
+    return 200, result
+
+  r = await _freja_post(urls.confirm_signing(), FrejaEID.get_body_for_confirming_signature(sign_ref))
+  return r.status_code, r.json()
+
+
+async def _fetch_auth_results():
+  r = await app.freja.post(urls.get_results(), FrejaEID.get_body_for_auth_results())
+  if r.status_code != 200:
+    logger.warning(f'Could not fetch authentication results: {r.text}')
+    return {}
+  return {result['authRef']: result for result in r.json()['authenticationResults']}
+
+
+async def _fetch_sign_results():
+  r = await app.freja.post(urls.get_sign_results(), FrejaEID.get_body_for_sign_results())
+  if r.status_code != 200:
+    logger.warning(f'Could not fetch signature results: {r.text}')
+    return {}
+  return {result['signRef']: result for result in r.json()['signatureResults']}
+
+
+# The status checks of a worker share their `getResults` calls, however many voters are waiting
+AUTH_RESULTS = AsyncResultBatcher(_fetch_auth_results)
+SIGN_RESULTS = AsyncResultBatcher(_fetch_sign_results)
+
+
+@app.route('/sign_events', methods=['GET'])
+async def sign_events():
+  """
+  See `auth.frejaeid.app.sign_events`.
+  """
+  async def stream():
+    sent = set()
+    end = time.monotonic() + SIGN_EVENTS_DURATION
+    while time.monotonic() < end:
+      try:
+        results = await SIGN_RESULTS.results()
+      except (httpx.HTTPError, resilience.CircuitOpen, DeadlineExceeded, Overloaded) as e:
+        logger.warning(f'Could not fetch signature results for the subscribers: {e}')
+      else:
+        for event in _new_sign_events(results, sent):
+          yield event.encode()
+      yield b': keep-alive\n\n'
+      await asyncio.sleep(SIGN_EVENTS_INTERVAL)
+
+  response = Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+  # The stream ends by itself after `SIGN_EVENTS_DURATION`
+  response.timeout = None
+  return response
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+  freja = app.freja
+  return Response(json.dumps({
+    'freja': {
+      'requests': freja.requests,
+      **freja.ssl_context.stats(),
+      'in_flight': freja.in_flight,
+      'max_concurrency': freja.max_concurrency,
+      'rejected': freja.rejected,
+      'timed_out': freja.timed_out,
+    },
+    'batches': {'auth': AUTH_RESULTS.stats(), 'sign': SIGN_RESULTS.stats()},
+    'breakers': resilience.states(),
+  }))
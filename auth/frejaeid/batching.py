@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, wait
+
+
+logger = logging.getLogger('id_service')
+
+
+class ResultBatcher:
+  """
+  Coalesces concurrent status checks from threads into a single call to one of Freja's `getResults` endpoints.
+
+  A check that finds no call in flight calls `fetch` right away, so a lone check waits for one round trip only. Checks
+  that arrive while a call is in flight wait for it to end and then share the next call: the first of them becomes its
+  leader, calls `fetch` once and hands the results (a dict keyed by reference) to all of them. Upstream calls thus
+  grow with the time spent waiting on Freja, not with the number of voters.
+
+  `get` returns None for a reference that is not in the batch, e.g. because it completed too long ago for
+  `getResults` to report it, or if the batch failed; the caller then has to ask for it on its own.
+  """
+
+  def __init__(self, fetch):
+    self.fetch = fetch
+    self.batches = 0
+    self.callers = 0
+    self._lock = threading.Lock()
+    # The call in flight and the one the checks that arrived during it wait for
+    self._running = None
+    self._next = None
+
+  def get(self, ref):
+    try:
+      return self.results().get(ref)
+    except Exception as e:
+      # Every caller of the batch gets the exception, each of them falls back on its own
+      logger.warning(f'Could not fetch the batch of results, asking for {ref} alone: {e!r}')
+      return None
+
+  def results(self):
+    """
+    All results of a call started after this one, keyed by reference.
+    """
+    with self._lock:
+      self.callers += 1
+      previous = None
+      if self._running is None:
+        leader = True
+        future = self._running = Future()
+      elif self._next is None:
+        leader, previous = True, self._running
+        future = self._next = Future()
+      else:
+        leader = False
+        future = self._next
+
+    if leader:
+      if previous is not None:
+        # Results fetched before this check arrived could be older than what it asks about
+        wait([previous])
+        with self._lock:
+          self._running, self._next = future, None
+      self._run(future)
+
+    return future.result()
+
+  def _run(self, future):
+    with self._lock:
+      self.batches += 1
+    try:
+      result, error = self.fetch(), None
+    except Exception as e:
+      result, error = None, e
+
+    with self._lock:
+      # Otherwise the leader of the next batch takes over once it is woken up below
+      if self._next is None:
+        self._running = None
+    if error is None:
+      future.set_result(result)
+    else:
+      future.set_exception(error)
+
+  def stats(self):
+    return {'batches': self.batches, 'callers': self.callers}
+
+
+class AsyncResultBatcher:
+  """
+  `ResultBatcher` for coroutines, `fetch` is a coroutine function.
+  """
+
+  def __init__(self, fetch):
+    self.fetch = fetch
+    self.batches = 0
+    self.callers = 0
+    self._running = None
+    self._next = None
+
+  async def get(self, ref):
+    try:
+      return (await self.results()).get(ref)
+    except Exception as e:
+      logger.warning(f'Could not fetch the batch of results, asking for {ref} alone: {e!r}')
+      return None
+
+  async def results(self):
+    self.callers += 1
+    if self._running is None:
+      self._running = asyncio.ensure_future(self._batch(None))
+      batch = self._running
+    elif self._next is None:
+      self._next = asyncio.ensure_future(self._batch(self._running))
+      batch = self._next
+    else:
+      batch = self._next
+    # Shielded, so that a caller giving up does not cancel the batch of the others
+    return await asyncio.shield(batch)
+
+  async def _batch(self, previous):
+    if previous is not None:
+      await asyncio.wait([previous])
+      self._running, self._next = self._next, None
+
+    self.batches += 1
+    try:
+      return await self.fetch()
+    finally:
+      if self._next is None:
+        self._running = None
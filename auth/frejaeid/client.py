@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+import httpx
+
+from common import resilience
+from common.resilience import DeadlineExceeded
+
+
+# Maximum number of calls to Freja in flight at once, per worker
+MAX_CONCURRENCY = int(os.getenv('FREJA_MAX_CONCURRENCY', 200))
+# Seconds a single call to Freja may take, connecting included
+TIMEOUT = float(os.getenv('FREJA_TIMEOUT', 10))
+# Seconds a call may wait for a free slot before it is rejected. 0 rejects as soon as the budget is exhausted
+QUEUE_TIMEOUT = float(os.getenv('FREJA_QUEUE_TIMEOUT', 0))
+# Seconds clients are told to wait before retrying a rejected call
+RETRY_AFTER = int(os.getenv('FREJA_RETRY_AFTER', 1))
+
+
+class Overloaded(Exception):
+  """
+  All outbound slots are taken, the call was not made.
+  """
+
+  def __init__(self, retry_after):
+    super().__init__('Too many calls to Freja in flight')
+    self.retry_after = retry_after
+
+
+class AsyncFrejaClient:
+  """
+  Calls the Freja eID REST API on the event loop.
+
+  The number of calls in flight is bounded, so that a slow Freja cannot make the service pile up connections and
+  memory: once the budget is exhausted, further calls raise `Overloaded` right away instead of queueing. Every call
+  is bounded in time as a whole and raises `DeadlineExceeded` when it runs late. Calls go through the circuit
+  breaker of Freja, which raises `CircuitOpen` while Freja keeps failing.
+
+  `ssl_context` holds the client certificate and the trusted CA, see `transport.ssl_context`.
+  """
+
+  def __init__(self, ssl_context, max_concurrency=MAX_CONCURRENCY, timeout=TIMEOUT, queue_timeout=QUEUE_TIMEOUT):
+    self.max_concurrency = max_concurrency
+    self.timeout = timeout
+    self.queue_timeout = queue_timeout
+    self.ssl_context = ssl_context
+    self.breaker = resilience.breaker('freja')
+    self.requests = 0
+    self.in_flight = 0
+    self.rejected = 0
+    self.timed_out = 0
+
+    self._budget = asyncio.Semaphore(max_concurrency)
+    self._client = httpx.AsyncClient(
+      verify=ssl_context,
+      timeout=timeout,
+      limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+    )
+
+  async def post(self, url, data, deadline=None):
+    """
+    POST `data` to `url`, within `deadline` (see `common.resilience`) if given.
+    """
+    timeout = resilience.outbound(self.timeout, deadline)['timeout']
+    await self._acquire()
+    self.requests += 1
+    self.in_flight += 1
+    try:
+      return await self.breaker.acall(self._post, url, data, timeout)
+    finally:
+      self.in_flight -= 1
+      self._budget.release()
+
+  async def _post(self, url, data, timeout):
+    try:
+      # The httpx timeout applies per read/write, this bounds the call as a whole
+      return await asyncio.wait_for(self._client.post(url, content=data, timeout=timeout), timeout)
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+      self.timed_out += 1
+      raise DeadlineExceeded(f'{url} did not answer within {timeout:.3g}s')
+
+  async def _acquire(self):
+    if not self._budget.locked():
+      await self._budget.acquire()
+      return
+
+    try:
+      if self.queue_timeout <= 0:
+        raise asyncio.TimeoutError
+      await asyncio.wait_for(self._budget.acquire(), self.queue_timeout)
+    except asyncio.TimeoutError:
+      self.rejected += 1
+      raise Overloaded(RETRY_AFTER)
+
+  async def aclose(self):
+    await self._client.aclose()
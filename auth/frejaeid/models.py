@@ -1,9 +1,30 @@
+import sqlite3
+import time
+
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
 
 class User(UserMixin, db.Model):
     __tablename__ = "user"
     id = db.Column(db.Integer, primary_key=True)
-    freja_auth_ref = db.Column(db.String(255), unique=True)
+    freja_auth_ref = db.Column(db.String(255), unique=True, index=True)
+    created_at = db.Column(db.Float, nullable=False, default=time.time, index=True)
+    # Outcome of the last check with Freja, only kept once the authentication cannot change anymore
+    validated_at = db.Column(db.Float)
+    validity_status = db.Column(db.Integer)
+    validity_body = db.Column(db.Text)
+
+
+@event.listens_for(Engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # Readers do not block the writer, so that several workers can share the file
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
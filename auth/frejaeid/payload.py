@@ -27,6 +27,16 @@ class FrejaEID:
     frejaeid_body = f'getOneAuthResultRequest={b64_encoded}'
     return frejaeid_body
 
+  @classmethod
+  def get_body_for_auth_results(cls) -> str:
+    # Also report requests completed in the last ten minutes, not only pending ones
+    human_readable_body = {
+      "includePrevious": "ALL",
+    }
+    b64_encoded = cls._base64encoder(human_readable_body)
+    frejaeid_body = f'getAuthResultsRequest={b64_encoded}'
+    return frejaeid_body
+
   @classmethod
   def get_body_for_cancel_auth(cls, auth_ref: str) -> str:
     human_readable_body = {
@@ -37,7 +47,7 @@ class FrejaEID:
     return frejaeid_body
 
   @classmethod
-  def get_body_for_init_sign(cls, email: str, vote: str) -> str:
+  def get_body_for_init_sign(cls, email: str, vote: str, expiry: int = None) -> str:
     human_readable_body = {
       "userInfoType": "EMAIL",
       "userInfo": email,
@@ -51,6 +61,9 @@ class FrejaEID:
       "dataToSign": {"text": vote},
       "signatureType": "SIMPLE"
     }
+    if expiry is not None:
+      # Milliseconds since epoch, Freja defaults to two days from now
+      human_readable_body["expiry"] = expiry
     b64_encoded = cls._base64encoder(human_readable_body)
     frejaedi_body = f'initSignRequest={b64_encoded}'
     return frejaedi_body
@@ -64,6 +77,15 @@ class FrejaEID:
     frejaeid_body = f'getOneSignResultRequest={b64_encoded}'
     return frejaeid_body
 
+  @classmethod
+  def get_body_for_sign_results(cls) -> str:
+    human_readable_body = {
+      "includePrevious": "ALL",
+    }
+    b64_encoded = cls._base64encoder(human_readable_body)
+    frejaeid_body = f'getSignResultsRequest={b64_encoded}'
+    return frejaeid_body
+
   @staticmethod
   def _base64encoder(body: dict):
     return base64.urlsafe_b64encode(
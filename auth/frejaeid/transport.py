@@ -0,0 +1,158 @@
+import ssl
+import threading
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Connections kept open to Freja per process. All calls go to a single host, so this bounds concurrent calls too
+POOL_SIZE = 32
+
+
+def _hostname(server_hostname):
+  # anyio passes the host name as bytes, `SSLSocket.server_hostname` is always a string
+  if isinstance(server_hostname, bytes):
+    return server_hostname.decode('idna')
+  return server_hostname
+
+
+class _CountingSSLSocket(ssl.SSLSocket):
+
+  def do_handshake(self, *args, **kwargs):
+    super().do_handshake(*args, **kwargs)
+    self.context._handshake_done(self)
+
+  def read(self, *args, **kwargs):
+    data = super().read(*args, **kwargs)
+    self.context._save_session(self)
+    return data
+
+
+class _CountingSSLObject(ssl.SSLObject):
+
+  def do_handshake(self):
+    super().do_handshake()
+    self.context._handshake_done(self)
+
+  def read(self, *args, **kwargs):
+    data = super().read(*args, **kwargs)
+    self.context._save_session(self)
+    return data
+
+
+class ResumingSSLContext(ssl.SSLContext):
+  """
+  Client SSL context which offers the last TLS session of a host when connecting to it again, so that a new connection
+  to Freja skips the certificate exchange. Handshakes and resumed handshakes are counted.
+
+  Works both for blocking sockets (requests) and memory BIOs (asyncio, httpx).
+  """
+
+  sslsocket_class = _CountingSSLSocket
+  sslobject_class = _CountingSSLObject
+
+  def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+    return super().__new__(cls, protocol, *args, **kwargs)
+
+  def __init__(self, *args, **kwargs):
+    # The arguments are taken by `__new__`
+    super().__init__()
+    self.handshakes = 0
+    self.resumed = 0
+    self._sessions = {}
+    self._lock = threading.Lock()
+
+  def wrap_socket(
+    self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True, server_hostname=None,
+    session=None,
+  ):
+    if session is None and not server_side:
+      session = self._sessions.get(_hostname(server_hostname))
+    return super().wrap_socket(
+      sock, server_side, do_handshake_on_connect, suppress_ragged_eofs, server_hostname, session,
+    )
+
+  def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+    if session is None and not server_side:
+      session = self._sessions.get(_hostname(server_hostname))
+    return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+  def _handshake_done(self, sock):
+    with self._lock:
+      self.handshakes += 1
+      if sock.session_reused:
+        self.resumed += 1
+
+  def _save_session(self, sock):
+    # With TLS 1.3 the session tickets arrive after the handshake, together with the first response
+    if getattr(sock, '_session_saved', False) or sock.server_hostname is None:
+      return
+    sock._session_saved = True
+    session = sock.session
+    if session is not None:
+      self._sessions[sock.server_hostname] = session
+
+  def stats(self):
+    return {'handshakes': self.handshakes, 'resumed': self.resumed}
+
+
+@lru_cache(maxsize=None)
+def ssl_context(cert, verify) -> ResumingSSLContext:
+  """
+  SSL context holding the client certificate `cert` (a `(certificate, key)` pair of paths) and trusting only the CA
+  bundle at `verify`. The files are read once per process.
+  """
+  context = ResumingSSLContext()
+  context.load_verify_locations(cafile=verify)
+  context.load_cert_chain(*cert)
+  return context
+
+
+class _ContextAdapter(HTTPAdapter):
+  """
+  Adapter whose connections all use the same preloaded SSL context.
+  """
+
+  def __init__(self, context, **kwargs):
+    self.context = context
+    super().__init__(**kwargs)
+
+  def init_poolmanager(self, *args, **kwargs):
+    kwargs['ssl_context'] = self.context
+    super().init_poolmanager(*args, **kwargs)
+
+  def cert_verify(self, conn, url, verify, cert):
+    # The certificates are in the context already, requests would otherwise have them reloaded for every connection
+    conn.cert_reqs = 'CERT_REQUIRED'
+    conn.ca_certs = None
+    conn.ca_cert_dir = None
+    conn.cert_file = None
+    conn.key_file = None
+
+  def stats(self):
+    pools = [self.poolmanager.pools[key] for key in self.poolmanager.pools.keys()]
+    return {
+      'connections': sum(pool.num_connections for pool in pools),
+      'requests': sum(pool.num_requests for pool in pools),
+      # The pool queue is padded with None up to its size
+      'idle': sum(conn is not None for pool in pools if pool.pool is not None for conn in list(pool.pool.queue)),
+    }
+
+
+@lru_cache(maxsize=None)
+def session(cert, verify) -> requests.Session:
+  """
+  Keep-alive session to Freja shared by all threads of the process, see `ssl_context`.
+  """
+  s = requests.Session()
+  s.mount('https://', _ContextAdapter(ssl_context(cert, verify), pool_connections=1, pool_maxsize=POOL_SIZE))
+  return s
+
+
+def stats(s: requests.Session):
+  """
+  Connection reuse of session `s`: connections opened, requests sent, idle connections and TLS handshakes.
+  """
+  adapter = s.get_adapter('https://')
+  return {**adapter.stats(), **adapter.context.stats()}
@@ -30,3 +30,12 @@ def initiate_signing():
 
 def confirm_signing():
   return f'{_sign()}/getOneResult'
+
+
+# Results of all pending and recently completed requests of the relying party, in a single call
+def get_results():
+  return f'{_auth()}/getResults'
+
+
+def get_sign_results():
+  return f'{_sign()}/getResults'
@@ -0,0 +1,131 @@
+"""
+On-demand profiling of individual requests.
+
+An admin arms the profiler for the next N requests to a given route, e.g.:
+
+    curl -X POST -H "X-Admin-Token: $PROFILING_TOKEN" -H "Content-Type: application/json" \
+        -d '{"route": "/ciphertexts", "count": 3}' <root URL>/_profile
+
+Every matching request is then run under `cProfile` and its statistics are dumped as a `.pstats` file into
+`PROFILING_DIR` (default: `profiles/`). The files can be browsed with `python -m pstats <file>` or converted into
+flamegraphs with tools such as `flameprof` or `snakeviz`.
+
+The `/_profile` endpoint only exists when the `PROFILING_TOKEN` environment variable is set. While nothing is armed,
+the per-request cost is a single dictionary lookup.
+
+Counters are kept per process: with several gunicorn workers, each worker profiles the next N requests it serves.
+"""
+import cProfile
+import hmac
+import os
+import re
+import threading
+import time
+from itertools import count
+
+from flask import current_app, g, jsonify, request
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+MAX_COUNT = 1000
+
+_lock = threading.Lock()
+# URL rule (e.g. "/ciphertexts") -> amount of requests left to profile
+_armed = {}
+_sequence = count()
+
+
+def init_app(app, csrf=None):
+    """
+    Install the profiling hooks and the admin endpoint on a Flask app.
+
+    `csrf` is the app's `CSRFProtect` instance, if any, so that the admin endpoint can be exempted from it.
+    """
+    if not PROFILING_TOKEN:
+        return
+
+    app.before_request(_start_profiler)
+    app.teardown_request(_stop_profiler)
+    app.add_url_rule("/_profile", "profile", profile, methods=("GET", "POST", "DELETE"))
+    if csrf is not None:
+        csrf.exempt(profile)
+
+
+def profile():
+    """
+    Admin endpoint for the request profiler.
+
+    GET: List the armed routes and the profiles written so far.
+    POST: Arm the profiler. Expects a JSON body `{"route": <URL rule>, "count": <int>}`.
+    DELETE: Disarm all routes.
+
+    All methods require the `X-Admin-Token` header to match `PROFILING_TOKEN`.
+    """
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode()):
+        return jsonify({"message": "Invalid admin token"}), 403
+
+    if request.method == "POST":
+        content = request.get_json(silent=True) or {}
+        route = content.get("route")
+        amount = content.get("count", 1)
+
+        if route not in {rule.rule for rule in current_app.url_map.iter_rules()}:
+            return jsonify({"message": f"Unknown route {route!r}"}), 400
+        if not isinstance(amount, int) or not 0 < amount <= MAX_COUNT:
+            return jsonify({"message": f"'count' should be an integer between 1 and {MAX_COUNT}"}), 400
+
+        with _lock:
+            _armed[route] = _armed.get(route, 0) + amount
+
+    elif request.method == "DELETE":
+        with _lock:
+            _armed.clear()
+
+    with _lock:
+        armed = dict(_armed)
+    profiles = sorted(os.listdir(PROFILING_DIR)) if os.path.isdir(PROFILING_DIR) else []
+    return jsonify({"armed": armed, "directory": os.path.abspath(PROFILING_DIR), "profiles": profiles})
+
+
+def _start_profiler():
+    if not _armed or request.url_rule is None:
+        return
+
+    rule = request.url_rule.rule
+    with _lock:
+        left = _armed.get(rule, 0)
+        if left <= 0:
+            return
+        if left == 1:
+            del _armed[rule]
+        else:
+            _armed[rule] = left - 1
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this interpreter; try again with the next request
+        with _lock:
+            _armed[rule] = _armed.get(rule, 0) + 1
+        return
+    g.profiler = (rule, profiler)
+
+
+def _stop_profiler(exc=None):
+    active = g.pop("profiler", None)
+    if active is None:
+        return
+
+    rule, profiler = active
+    profiler.disable()
+
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    fname = "{}-{}-{}-{}.pstats".format(
+        re.sub(r"[^A-Za-z0-9]+", "_", rule).strip("_") or "root",
+        time.strftime("%Y%m%dT%H%M%S"),
+        os.getpid(),
+        next(_sequence),
+    )
+    profiler.dump_stats(os.path.join(PROFILING_DIR, fname))
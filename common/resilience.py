@@ -0,0 +1,226 @@
+"""
+Circuit breakers and deadlines for the calls a server makes to the services it depends on.
+
+Every inbound request gets a deadline, taken from the `X-Request-Timeout` header (seconds left) when the caller sent
+one, `REQUEST_DEADLINE` seconds otherwise. Outbound calls made while serving it are given the time that is left, capped
+per dependency, and pass it on in the same header, so that no service keeps working on a request its caller has given
+up on. A request whose deadline has passed fails with `504 Gateway Timeout`.
+
+Each dependency has a `CircuitBreaker`. After `failure_threshold` consecutive failures (connection errors, timeouts or
+5xx answers) it opens and calls fail right away with `503 Service Unavailable` and a `Retry-After` header, instead of
+tying up a worker each. After `reset_timeout` seconds a single trial call is let through (half-open); it closes the
+breaker again if it succeeds. Other errors, e.g. from a request the dependency turned down, are not counted.
+A call that could not connect or timed out fails with `503` or `504` as well.
+
+Used by both the vote collecting server and the auth server.
+"""
+import json
+import os
+import threading
+import time
+
+import requests
+from flask import Response, g, has_request_context, request
+
+try:
+    import httpx
+except ImportError:
+    # Only used by the ASGI variants
+    httpx = None
+
+DEADLINE_HEADER = "X-Request-Timeout"
+DEFAULT_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 30))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit to {name} is open")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Exceptions of a call that mean the dependency could not be reached or did not answer in time. The exceptions of
+# `requests` are OSErrors
+TRANSPORT_ERRORS = (OSError, DeadlineExceeded) + ((httpx.TransportError,) if httpx else ())
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, failure_statuses=range(500, 600)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_statuses = failure_statuses
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return CLOSED
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def _acquire(self):
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+
+            self.rejected += 1
+            retry_after = 1 if state == HALF_OPEN else self._opened_at + self.reset_timeout - time.monotonic()
+            raise CircuitOpen(self.name, max(1, round(retry_after)))
+
+    def _record(self, success):
+        """
+        Count the outcome of a call, None if it says nothing about the dependency.
+        """
+        with self._lock:
+            self._probing = False
+            if success is None:
+                return
+            if success:
+                self.failures = 0
+                self._opened_at = None
+                return
+
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self._opened_at is not None:
+                # A failed trial opens the breaker for another `reset_timeout`
+                self._opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call `func` through the breaker. It fails if it raises one of `TRANSPORT_ERRORS` or its result has a
+        `status_code` in `failure_statuses`.
+        """
+        self._acquire()
+        try:
+            result = func(*args, **kwargs)
+        except TRANSPORT_ERRORS:
+            self._record(False)
+            raise
+        except Exception:
+            self._record(None)
+            raise
+        self._record(getattr(result, "status_code", 200) not in self.failure_statuses)
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        """
+        Same as `call` for a coroutine function.
+        """
+        self._acquire()
+        try:
+            result = await func(*args, **kwargs)
+        except TRANSPORT_ERRORS:
+            self._record(False)
+            raise
+        except Exception:
+            self._record(None)
+            raise
+        self._record(getattr(result, "status_code", 200) not in self.failure_statuses)
+        return result
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+_breakers = {}
+
+
+def breaker(name, **kwargs):
+    """
+    The breaker of dependency `name`, created on first use.
+    """
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name, **kwargs)
+    return _breakers[name]
+
+
+def states():
+    return {name: b.stats() for name, b in _breakers.items()}
+
+
+def deadline_from(headers, default=DEFAULT_DEADLINE):
+    """
+    Deadline of an inbound request with `headers`, on the `time.monotonic` clock.
+    """
+    try:
+        budget = float(headers.get(DEADLINE_HEADER, default))
+    except ValueError:
+        budget = default
+    return time.monotonic() + min(budget, default)
+
+
+def outbound(cap, deadline=None):
+    """
+    `timeout` and `headers` arguments for a call which may take up to `cap` seconds, within `deadline`. Defaults to
+    the deadline of the current Flask request, if any.
+    """
+    if deadline is None and has_request_context():
+        deadline = g.get("deadline")
+    if deadline is None:
+        return {"timeout": cap, "headers": {}}
+
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("The deadline of the request has passed")
+    timeout = min(cap, left)
+    return {"timeout": timeout, "headers": {DEADLINE_HEADER: f"{timeout:.3f}"}}
+
+
+def init_app(app):
+    """
+    Give the requests of Flask `app` a deadline and answer with a 503 or 504 when a dependency is unavailable.
+    """
+    app.before_request(_start_deadline)
+    app.register_error_handler(CircuitOpen, circuit_open_response)
+    app.register_error_handler(DeadlineExceeded, deadline_exceeded_response)
+    app.register_error_handler(requests.Timeout, timed_out_response)
+    app.register_error_handler(requests.ConnectionError, unreachable_response)
+
+
+def _start_deadline():
+    g.deadline = deadline_from(request.headers)
+
+
+def circuit_open_response(e, response_class=Response):
+    response = response_class(
+        json.dumps({"message": f"{e}, try again later."}), status=503, mimetype="application/json"
+    )
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+def deadline_exceeded_response(e, response_class=Response):
+    return response_class(json.dumps({"message": str(e)}), status=504, mimetype="application/json")
+
+
+def timed_out_response(e, response_class=Response):
+    return response_class(
+        json.dumps({"message": "A service this server depends on did not answer in time."}),
+        status=504,
+        mimetype="application/json",
+    )
+
+
+def unreachable_response(e, response_class=Response):
+    return response_class(
+        json.dumps({"message": "A service this server depends on is unreachable, try again later."}),
+        status=503,
+        mimetype="application/json",
+    )
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Audit the signatures of the recorded votes before tallying.
+
+The vote collecting server appends every accepted vote to `data.txt` and the JWS it got from Freja for it to
+`signatures.txt`, one per line. This checks that
+
+- every JWS is signed (RS256) by one of Freja's signing certificates in `--cert`, looked up by the `x5t` of its header,
+- its signature request was APPROVED,
+- the text the voter signed is the hash of a recorded vote, as shown in the Freja app (see `vote_hash`), and every
+  recorded vote has such a signature. Votes stored as their two ciphertext components are hashed as the single byte
+  tree that holds both.
+
+Signatures and votes are paired by that hash rather than by line number, so the check does not depend on the two
+files being written in the same order. They are checked in parallel on all cores. Every worker parses the
+certificates once and reuses their public keys for all of its signatures. Problems are reported one per line, with
+the file and line they are on, and the exit status is 1 if there are any.
+
+Needs `cryptography`, listed in requirements.txt. Run from the working directory of the vote collecting server:
+
+    python scripts/audit_signatures.py --cert freja_signing.pem
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from itertools import chain, islice
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from webdemo.bytetree import ByteTree, decode_vote, vote_hash  # noqa: E402
+
+# Signatures sent to a worker at once, large enough that pickling does not dominate
+CHUNK_SIZE = 2000
+
+_PADDING = padding.PKCS1v15()
+_HASH = hashes.SHA256()
+# Public keys of the signing certificates by `x5t`, set once per worker process
+_keys = None
+
+
+def load_keys(path):
+    """
+    Public keys of the PEM certificates in `path`, keyed by their SHA-1 thumbprint as in the `x5t` of a JWS header.
+    """
+    with open(path, "rb") as f:
+        certificates = x509.load_pem_x509_certificates(f.read())
+    return {_b64encode(c.fingerprint(hashes.SHA1())): c.public_key() for c in certificates}
+
+
+def _init_worker(cert):
+    global _keys
+    _keys = load_keys(cert)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def serialized_vote(vote):
+    """
+    The single byte tree of a vote as returned by `decode_vote`, which is what the voter signs the hash of. Votes stored
+    as a list of their two serialized components, as /offline_vote and /ciphertexts accept them, are joined into it.
+    """
+    if isinstance(vote, bytes):
+        return vote
+    left, right = vote
+    return ByteTree([ByteTree.from_byte_array(left), ByteTree.from_byte_array(right)]).to_byte_array()
+
+
+def check_signature(signature, keys):
+    """
+    The text the voter signed in `signature`, and the problem with the signature, if any.
+    """
+    try:
+        header, payload, sig = signature.split(".")
+        key = keys.get(json.loads(_b64decode(header)).get("x5t"))
+        if key is None:
+            return None, "not signed with a known certificate"
+        key.verify(_b64decode(sig), f"{header}.{payload}".encode(), _PADDING, _HASH)
+
+        claims = json.loads(_b64decode(payload))
+        # The text the voter signed, itself a JWS signed with the key of the voter's app
+        signed_text = _b64decode(claims["signatureData"]["userSignature"].split(".")[1]).decode()
+    except InvalidSignature:
+        return None, "invalid signature"
+    except (ValueError, KeyError, TypeError, AttributeError, IndexError, binascii.Error) as e:
+        return None, f"malformed signature: {e!r}"
+
+    if claims.get("status") != "APPROVED":
+        return None, f"signature request not approved: {claims.get('status')}"
+    return signed_text, None
+
+
+def check_vote(vote):
+    """
+    The hash the voter of `vote` signed, and the problem with the vote, if any.
+    """
+    try:
+        return vote_hash(serialized_vote(decode_vote(vote))), None
+    except (ValueError, TypeError, AssertionError, IndexError) as e:
+        return None, f"malformed vote: {e!r}"
+
+
+def _check_signature(signature):
+    return check_signature(signature, _keys)
+
+
+def _check_chunk(chunk):
+    kind, start, lines = chunk
+    check = _check_signature if kind == "signatures" else check_vote
+    return kind, [(i, *check(line)) for i, line in enumerate(lines, start)]
+
+
+def _chunks(kind, f):
+    lines = (line.rstrip("\n") for line in f)
+    start = 1
+    while True:
+        chunk = list(islice(lines, CHUNK_SIZE))
+        if not chunk:
+            return
+        yield kind, start, chunk
+        start += len(chunk)
+
+
+def match(signed, hashed):
+    """
+    Pair the signatures with the votes they are for, by hash, whatever the order of the lines. `signed` and `hashed`
+    are the `(line, hash)` of the valid signatures and votes. Returns the `(file, line, problem)` of every signature
+    without a vote and every vote without a signature.
+    """
+    votes = defaultdict(list)
+    for line, expected in hashed:
+        votes[expected].append(line)
+
+    problems = []
+    for line, signed_text in signed:
+        if votes.get(signed_text):
+            votes[signed_text].pop(0)
+        else:
+            problems.append(("signatures", line, f"signed hash {signed_text!r} is not the hash of any recorded vote"))
+    problems.extend(
+        ("votes", line, "no signature recorded for this vote") for lines in votes.values() for line in lines
+    )
+    return problems
+
+
+def audit(signatures, votes, cert, workers=None):
+    """
+    Check all signatures in file `signatures` against the votes in file `votes`. Returns the number of votes and the
+    `(file, line, problem)` of every problem, where `file` is "signatures" or "votes".
+    """
+    checked = {"signatures": [], "votes": []}
+    with open(signatures) as s, open(votes) as v:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cert,)) as pool:
+            for kind, results in pool.map(_check_chunk, chain(_chunks("signatures", s), _chunks("votes", v))):
+                checked[kind].extend(results)
+
+    problems = [(kind, line, problem) for kind, results in checked.items() for line, _, problem in results if problem]
+    problems.extend(
+        match(
+            [(line, text) for line, text, problem in checked["signatures"] if not problem],
+            [(line, text) for line, text, problem in checked["votes"] if not problem],
+        )
+    )
+    problems.sort()
+    return len(checked["votes"]), problems
+
+
+def main(args):
+    start = time.perf_counter()
+    total, problems = audit(args.signatures, args.votes, args.cert, args.workers)
+    elapsed = time.perf_counter() - start
+    files = {"signatures": args.signatures, "votes": args.votes}
+
+    if args.json:
+        json.dump(
+            {
+                "votes": total,
+                "mismatches": [
+                    {"file": files[kind], "line": line, "problem": problem} for kind, line, problem in problems
+                ],
+                "seconds": round(elapsed, 3),
+            },
+            sys.stdout,
+            indent=2,
+        )
+        print()
+    else:
+        for kind, line, problem in problems:
+            print(f"{files[kind]}:{line}: {problem}")
+        print(f"{total} votes checked in {elapsed:.1f}s, {len(problems)} mismatches", file=sys.stderr)
+    return 1 if problems else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cert", required=True, help="PEM file with Freja's JWS signing certificates")
+    parser.add_argument("--signatures", default="signatures.txt", help="signatures of the votes, one JWS per line")
+    parser.add_argument("--votes", default="data.txt", help="recorded votes, one per line")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of cores")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
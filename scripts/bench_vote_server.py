@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Benchmark the concurrent-voter capacity of the vote collecting server.
+
+Starts the Flask app under gunicorn (sync workers) and the ASGI variant under hypercorn with the same amount of
+workers, both talking to a simulated auth server that answers every call after `--latency` seconds, as the real one
+does while it waits on Freja. For every concurrency level, that many simulated voters each load the poll page and cast
+`--votes` votes at the same time. Throughput and latency percentiles are reported per server.
+
+Needs gunicorn, hypercorn and httpx, all listed in requirements.txt. Run from anywhere:
+
+    python scripts/bench_vote_server.py --latency 0.5 --concurrency 10 50 200
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from statistics import quantiles
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SAMPLE_VOTE = os.path.join(ROOT, "webdemo", "static", "sample-signed-vote.json")
+
+SERVERS = {
+    "flask": lambda port, workers: [
+        "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "webdemo.app:app",
+    ],
+    "asgi": lambda port, workers: [
+        "hypercorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "webdemo.asgi:app",
+    ],
+}
+
+# All simulated voters connect from 127.0.0.1, so the admission limits of `webdemo.admission` are lifted to measure
+# the servers themselves. Set them in the environment to benchmark with limits
+NO_LIMITS = {
+    "RATE_LIMIT_IP_RATE": "1e9",
+    "RATE_LIMIT_IP_BURST": "1000000000",
+    "RATE_LIMIT_EMAIL_RATE": "1e9",
+    "RATE_LIMIT_EMAIL_BURST": "1000000000",
+    "SIGN_RATE": "1e9",
+    "SIGN_BURST": "1000000000",
+    "SIGN_CONCURRENCY": "1000000",
+}
+
+
+def main(args):
+    auth = start_fake_auth(args.latency)
+    auth_url = f"http://127.0.0.1:{auth.server_port}"
+    print(f"Simulated auth server at {auth_url} with {args.latency}s latency", file=sys.stderr)
+
+    results = []
+    for name in args.servers:
+        for concurrency in args.concurrency:
+            with running_server(name, args.workers, auth_url) as url:
+                result = asyncio.run(run_voters(url, concurrency, args.votes, args.timeout))
+            result.update(server=name, concurrency=concurrency)
+            results.append(result)
+            print_result(result)
+
+    auth.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+class FakeAuthHandler(BaseHTTPRequestHandler):
+    """
+    Answers like `auth.frejaeid.app` after a fixed delay. Signature requests are approved on the first poll.
+    """
+
+    latency = 0.0
+    # signRef -> email
+    sign_refs = {}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+
+        if self.path == "/init_sign":
+            sign_ref = uuid.uuid4().hex
+            self.sign_refs[sign_ref] = body.get("email")
+            self._reply(200, {"signRef": sign_ref, "expiry": int((time.time() + 600) * 1000)})
+        elif self.path == "/confirm_sign":
+            email = self.sign_refs.pop(body.get("signRef"), None)
+            if email is None:
+                self._reply(400, {"message": "Signing unsuccessful", "status": "EXPIRED"})
+            else:
+                self._reply(200, {"message": "Signing successful", "signature": _fake_jws(email)})
+        elif self.path == "/init_auth":
+            self._reply(200, {"authRef": uuid.uuid4().hex})
+        elif self.path == "/authentication_validity":
+            self._reply(200, {"message": "Your authentication is valid."})
+        else:
+            self._reply(404, {"message": "Not found"})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def _fake_jws(email):
+    def b64(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+
+    return ".".join((b64({"alg": "none"}), b64({"userInfo": email, "status": "APPROVED"}), "c2ln"))
+
+
+def start_fake_auth(latency):
+    FakeAuthHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAuthHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class running_server:
+    """
+    Start one of SERVERS in a fresh working directory, so that every run begins with an empty election.
+    """
+
+    def __init__(self, name, workers, auth_url):
+        self.name = name
+        self.workers = workers
+        self.auth_url = auth_url
+
+    def __enter__(self):
+        self.cwd = tempfile.mkdtemp(prefix=f"bench-{self.name}-")
+        public_key = os.path.join(self.cwd, "publicKey")
+        with open(public_key, "wb") as f:
+            f.write(os.urandom(128))
+
+        port = _free_port()
+        env = dict(
+            {**NO_LIMITS, **os.environ},
+            AUTH_SERVER_URL=self.auth_url,
+            PUBLIC_KEY=public_key,
+            PYTHONPATH=ROOT,
+            SECRET_KEY=os.urandom(16).hex(),
+        )
+        self.process = subprocess.Popen(
+            SERVERS[self.name](port, self.workers),
+            cwd=self.cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                if httpx.get(f"{url}/metrics").status_code == 200:
+                    return url
+            except httpx.TransportError:
+                pass
+            if self.process.poll() is not None:
+                break
+            time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f"{self.name} server did not start")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self.cwd, ignore_errors=True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _vote_field():
+    # As poll.html submits it: base64 of the byte tree node holding both ciphertext components
+    with open(SAMPLE_VOTE) as f:
+        left, right = json.load(f)["vote"]
+    return base64.b64encode(bytes([0, 0, 0, 0, 2] + left + right)).decode("ascii")
+
+
+async def run_voters(url, concurrency, votes, timeout):
+    field = _vote_field()
+    latencies = []
+    errors = 0
+
+    async def voter(idx):
+        nonlocal errors
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as client:
+            for vote in range(votes):
+                start = time.perf_counter()
+                try:
+                    page = await client.get("/")
+                    token = re.search(r'name="csrf_token" value="([^"]+)"', page.text).group(1)
+                    r = await client.post(
+                        "/",
+                        data={
+                            "csrf_token": token,
+                            "field": field,
+                            "email-for-signing": f"voter{idx}-{vote}@example.com",
+                        },
+                    )
+                    r.raise_for_status()
+                except (httpx.HTTPError, AttributeError):
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(voter(idx) for idx in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99 or [float("nan")] * 99
+    return {
+        "votes": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": percentiles[49],
+        "p95": percentiles[94],
+    }
+
+
+def print_result(r):
+    print(
+        f"{r['server']:>6} concurrency={r['concurrency']:<5} votes={r['votes']:<6} errors={r['errors']:<5}"
+        f" throughput={r['throughput']:8.2f}/s p50={r['p50']:7.3f}s p95={r['p95']:7.3f}s"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", default=0.5, type=float, help="Seconds the simulated auth server takes per call")
+    parser.add_argument("--workers", default=2, type=int, help="Worker processes per server")
+    parser.add_argument(
+        "--concurrency", default=[10, 50, 100], type=int, nargs="+", help="Amounts of simultaneous voters to try"
+    )
+    parser.add_argument("--votes", default=3, type=int, help="Votes cast by every voter, one after the other")
+    parser.add_argument("--timeout", default=60, type=float, help="Client timeout per request, in seconds")
+    parser.add_argument("--servers", default=list(SERVERS), nargs="+", choices=list(SERVERS))
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON to PATH")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
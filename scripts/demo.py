@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import argparse
+import gzip
+import hashlib
 import json
 import os
 import shlex
@@ -7,14 +9,20 @@ import shutil
 import string
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import time
-from collections import Counter
+from collections import Counter, defaultdict
 from collections.abc import Sequence
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from functools import wraps
 from itertools import count
 from multiprocessing import Pool
 from urllib.parse import urljoin
 
+import phase_report
+
 
 def error(*args, **kwargs):
     print_color("\033[91m", *args, **kwargs)  # Red
@@ -41,22 +49,23 @@ except ImportError:
     )
 
 BYTETREE_PATH = "../webdemo/"
+# The protocol info files of all servers and their merge, sent to every server at once
+PROT_INFO_BUNDLE = "protInfo.tar"
 
+# Time, CPU and memory used by the phases of this run, written to --report-dir on exit
+REPORT = phase_report.Report(None)
 
-class VirtualMachine:
-    def __init__(self, vm_id, args):
-        d = json.loads(
-            azure_call(
-                ["az", "vm", "show", "--show-details", "--ids", vm_id],
-                args.container,
-            )
-        )
 
-        self.name = d["name"]
-        self.ip = d["publicIps"]
+class VirtualMachine:
+    def __init__(self, name, ip, args, backend, port_offset=0):
+        self.name = name
+        self.ip = ip
         self.idx = None
         self._last_p = None
         self.args = args
+        self.backend = backend
+        # Servers sharing an IP need ports of their own
+        self.port_offset = port_offset
 
     def party(self, idx=None):
         if idx is None:
@@ -67,14 +76,14 @@ class VirtualMachine:
             raise ValueError("idx is not set")
 
         hostname = "0.0.0.0"
-        http = self.args.port_http
+        http = self.args.port_http + self.port_offset
         protocol = "http"
-        udp = self.args.port_udp
+        udp = self.args.port_udp + self.port_offset
         return f"vmni -party -name party{idx} -http {protocol}://{self.ip}:{http} -httpl {protocol}://{hostname}:{http} -hint {self.ip}:{udp} -hintl {hostname}:{udp} stub.xml -dir ./dir privInfo.xml {idx}-protInfo.xml"
 
     def ssh_call(self, cmds, **kwargs):
         self.communicate()
-        self._last_p = p = ssh_call(self.ip, cmds, self.args, **kwargs)
+        self._last_p = p = self.backend.run(self, cmds, **kwargs)
         return p
 
     def communicate(self):
@@ -85,6 +94,15 @@ class VirtualMachine:
             return p.returncode, *ret
         return None
 
+    def run(self, cmds, **kwargs):
+        """
+        Run `cmds` and wait for them to finish. Raises CalledProcessError if they fail.
+        """
+        self.ssh_call(cmds, **kwargs)
+        code, _, _ = self.communicate()
+        if code != 0:
+            raise subprocess.CalledProcessError(code, cmds)
+
     def get_prot_info(self):
         if self.idx is None:
             raise ValueError("No idx")
@@ -92,37 +110,58 @@ class VirtualMachine:
         self.communicate()
 
         file = f"{self.idx}-protInfo.xml"
-        scp(
-            f"{self.args.username}@{self.ip}:~/election/{file}",
-            file,
-            self.args,
-            override=True,
-        )
+        self.backend.download(self, f"election/{file}", file)
 
-    def send_prot_info(self, n):
+    def merge_prot_info(self, n, mark=()):
+        """
+        Merge the protocol info files of all `n` servers on this one, and bundle them with the result in
+        PROT_INFO_BUNDLE for the others. Returns the SHA-256 of the bundle, see `pack`. `mark` is run after the merge.
+        """
         if self.idx is None:
             raise ValueError("No idx")
 
         self.communicate()
 
-        for idx in range(n):
-            if idx == self.idx:
-                continue
-
-            fname = f"{idx}-protInfo.xml"
+        files = [f"{idx}-protInfo.xml" for idx in range(n)]
+        for idx, fname in enumerate(files):
             if not os.path.exists(fname):
                 raise RuntimeError(f"{fname} not found")
+            if idx != self.idx:
+                self.backend.upload(self, fname, f"election/{fname}")
 
-            scp(
-                fname,
-                f"{self.args.username}@{self.ip}:~/election/{fname}",
-                self.args,
-            )
+        self.run(["cd ~/election", f"vmni -merge {' '.join(files)} merged.xml", *mark])
+        self.backend.download(self, "election/merged.xml", "merged.xml")
+
+        with tarfile.open(PROT_INFO_BUNDLE, "w") as tar:
+            for fname in files + ["merged.xml"]:
+                tar.add(fname)
+        return pack(PROT_INFO_BUNDLE)
+
+    def receive_prot_info(self, digest, mark=()):
+        """
+        Install the bundle of `merge_prot_info` on this server, then run `mark`.
+        """
+        self.communicate()
+
+        send_checked(self, PROT_INFO_BUNDLE, f"election/{PROT_INFO_BUNDLE}", digest)
+        self.run(["cd ~/election", f"tar xf {PROT_INFO_BUNDLE}", f"rm {PROT_INFO_BUNDLE}", *mark])
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     # Globals
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="azure",
+        help="Where the servers run: Azure VMs, or directories and processes on this machine",
+    )
+    parser.add_argument(
+        "--local-root",
+        default="local-election",
+        help="Directory holding the servers of the local backend",
+        metavar="PATH",
+    )
     parser.add_argument(
         "--container",
         default="azure-cli",
@@ -149,6 +188,19 @@ def parse_args():
         default="vmn",
         help="Username used to ssh / scp to servers",
     )
+    parser.add_argument(
+        "--inventory-ttl",
+        default=300,
+        help="Seconds the list of servers is cached for, 0 to always ask Azure",
+        metavar="SECONDS",
+        type=float,
+    )
+    parser.add_argument(
+        "--report-dir",
+        default="reports",
+        help="Directory of the JSON reports of the time, CPU and memory used by every phase, one per run",
+        metavar="DIR",
+    )
     parser.add_argument(
         "-i",
         "--identity-file",
@@ -175,6 +227,10 @@ def parse_args():
         "stop",
         help="Deallocate Azure servers",
     )
+    compare_parser = subparsers.add_parser(
+        "compare",
+        help="Compare the reports of two runs",
+    )
 
     # Deploy
     deploy_parser.add_argument(
@@ -213,6 +269,15 @@ def parse_args():
         metavar="CODE",
     )
 
+    # Start
+    start_election_parser.add_argument(
+        "--parallelism",
+        default=None,
+        help="Maximum amount of servers running the same setup step at once, defaults to all of them",
+        metavar="N",
+        type=int,
+    )
+
     # Deploy / Start
     multi_add_argument(
         (deploy_parser, start_election_parser),
@@ -232,6 +297,12 @@ def parse_args():
     )
 
     # Start / Tally
+    multi_add_argument(
+        (start_election_parser, tally_election_parser),
+        "--fresh",
+        action="store_true",
+        help="Run every phase again, even those that are already done with the same inputs",
+    )
     multi_add_argument(
         (start_election_parser, tally_election_parser),
         "--vote-collecting-server",
@@ -266,6 +337,10 @@ def parse_args():
         help="Delete the most recent session, allows to re-tally without starting a new election",
     )
 
+    # Compare
+    compare_parser.add_argument("old", help="Report of the first run", metavar="OLD")
+    compare_parser.add_argument("new", help="Report of the second run", metavar="NEW")
+
     # Stop
     stop_parser.add_argument(
         "--delete",
@@ -284,16 +359,220 @@ def multi_add_argument(parsers, *args, **kwargs):
 
 
 def main(args):
-    start_docker(args)
+    if args.subparser_name == "compare":
+        return compare_main(args)
+
+    backend = BACKENDS[args.backend](args)
+    backend.prepare()
+
+    REPORT.command = args.subparser_name
+    REPORT.params["backend"] = args.backend
+    start = time.monotonic()
+    try:
+        return globals()[f"{args.subparser_name}_main"](args, backend)
+    finally:
+        collect_measurements(backend)
+        SSH.close()
+        info(
+            f"{args.subparser_name} took {time.monotonic() - start:.1f}s",
+            f"and {backend.transfers.count} file transfers",
+        )
+        REPORT.params["transfers"] = backend.transfers.count
+        path = os.path.join(
+            args.report_dir, f"{args.subparser_name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        )
+        REPORT.save(path)
+        info(f"Report written to {path}")
+
+
+def collect_measurements(backend):
+    """
+    Add the measurements of the commands run on the servers to REPORT, see `phase_report.Report.wrap`.
+    """
+    names = REPORT.nodes()
+    if not names:
+        return
 
-    return globals()[f"{args.subparser_name}_main"](args)
+    def collect(vm):
+        p = backend.run(vm, REPORT.collect_commands(), stdout=subprocess.PIPE, text=True)
+        out, _ = p.communicate()
+        REPORT.collect(out)
+
+    try:
+        vms = [vm for vm in backend.vms(start=False) if vm.name in names]
+        with ThreadPoolExecutor(max_workers=len(vms) or 1) as pool:
+            list(pool.map(collect, vms))
+    except Exception as e:
+        error("Could not collect the measurements of the servers:", e)
 
 
-def deploy_main(args):
+def compare_main(args):
+    for line in phase_report.compare(phase_report.load(args.old), phase_report.load(args.new)):
+        print(line)
+    return 0
+
+
+def deploy_main(args, backend):
+    return backend.deploy()
+
+
+def stop_main(args, backend):
+    return backend.stop()
+
+
+class AzureBackend:
+    """
+    The servers are Azure VMs with the tag of the election, reached with ssh and scp. Paths on the servers are relative
+    to the home directory.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.transfers = TransferCounter()
+
+    def prepare(self):
+        start_docker(self.args)
+
+    def deploy(self):
+        return azure_deploy(self.args, self)
+
+    def vms(self, start=True):
+        return azure_get_vms(self.args, self, start)
+
+    def stop(self):
+        return azure_stop(self.args)
+
+    def run(self, vm, cmds, **kwargs):
+        return ssh_call(vm.ip, cmds, self.args, node=vm.name, **kwargs)
+
+    def reset(self, vm):
+        vm.run(["killall java || true", "rm -rf ~/election", "mkdir -p ~/election"])
+
+    def upload(self, vm, src, dest):
+        self.transfers.add()
+        scp(src, f"{self.args.username}@{vm.ip}:~/{dest}", self.args)
+
+    def download(self, vm, src, dest):
+        self.transfers.add()
+        scp(f"{self.args.username}@{vm.ip}:~/{src}", dest, self.args, override=True)
+
+
+class LocalBackend:
+    """
+    Stand-in for Azure on this machine, like `scripts/local_demo.py`: every server is a directory under `--local-root`,
+    which is the home directory of the commands run on it, and listens on ports of its own. Needs verificatum installed
+    locally.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.root = os.path.abspath(args.local_root)
+        self.transfers = TransferCounter()
+        self._processes = defaultdict(list)
+
+    def prepare(self):
+        missing = [cmd for cmd in ("vmni", "vmn", "vmnv") if not shutil.which(cmd)]
+        if missing:
+            error(f"{', '.join(missing)} not found in $PATH, install verificatum to run elections locally")
+
+    def home(self, vm):
+        return os.path.join(self.root, vm.name)
+
+    def deploy(self):
+        if self.args.delete:
+            shutil.rmtree(self.root, ignore_errors=True)
+        for idx in range(1, 1 + self.args.count):
+            os.makedirs(os.path.join(self.root, self.args.name + str(idx)), exist_ok=True)
+        info(f"{self.args.count} local servers in {self.root}")
+
+    def vms(self, start=True):
+        prefix = self.args.name
+        names = []
+        if os.path.isdir(self.root):
+            names = [
+                name
+                for name in os.listdir(self.root)
+                if name.startswith(prefix) and name[len(prefix) :].isdigit()
+            ]
+        if not names:
+            raise RuntimeError(f"No servers found in {self.root}, did you forget to deploy?")
+        names.sort(key=lambda name: int(name[len(prefix) :]))
+        return [
+            VirtualMachine(name, "127.0.0.1", self.args, self, port_offset=idx)
+            for idx, name in enumerate(names)
+        ]
+
+    def stop(self):
+        # Processes only live as long as the command that started them
+        if self.args.delete:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def run(self, vm, cmds, **kwargs):
+        if isinstance(cmds, str):
+            cmds = [cmds]
+        info(f"Running commands on {vm.name}", cmds)
+        cmds = REPORT.wrap(vm.name, cmds)
+
+        home = self.home(vm)
+        p = subprocess.Popen(
+            ["bash", "-c", " && ".join(cmds)],
+            cwd=home,
+            env=dict(os.environ, HOME=home),
+            **kwargs,
+        )
+        self._processes[vm.name].append(p)
+        return p
+
+    def reset(self, vm):
+        # Only the processes of this server, the others run on the same machine
+        for p in self._processes.pop(vm.name, []):
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+        election = os.path.join(self.home(vm), "election")
+        shutil.rmtree(election, ignore_errors=True)
+        os.makedirs(election)
+
+    def upload(self, vm, src, dest):
+        self.transfers.add()
+        shutil.copyfile(src, os.path.join(self.home(vm), dest))
+
+    def download(self, vm, src, dest):
+        self.transfers.add()
+        shutil.copyfile(os.path.join(self.home(vm), src), dest)
+
+
+class TransferCounter:
+    """
+    Number of files a backend copied to or from the servers, from any thread.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+
+    # Backends are pickled along with their servers by `multiprocessing.Pool`, the lock is not
+    def __getstate__(self):
+        return {"count": self.count}
+
+    def __setstate__(self, state):
+        self.count = state["count"]
+        self._lock = threading.Lock()
+
+
+BACKENDS = {"azure": AzureBackend, "local": LocalBackend}
+
+
+def azure_deploy(args, backend):
     if args.delete:
         resources = azure_resources_by_tag(args)
         if resources:
             azure_delete(resources, args.container)
+        invalidate_inventory(args)
 
     virtual_network_name = azure_create_virtual_network(args)
 
@@ -312,45 +591,101 @@ def deploy_main(args):
             ["az", "vm", "wait", "-g", args.group, "--created", "--name", name],
             args.container,
         )
-    vms = get_vms(args, start=False)
+    invalidate_inventory(args)
+    vms = azure_get_vms(args, backend, start=False)
 
     with Pool(args.count) as p:
         for res in p.imap_unordered(azure_install_server, vms):
             info(res)
 
 
-def start_main(args):
+def start_main(args, backend):
     require_requests()
 
-    vms = get_vms(args)
+    vms = backend.vms()
     n = len(vms)
+    REPORT.params["servers"] = n
+
+    checkpoints = Checkpoints(args, fresh=args.fresh)
+    checkpoints.load(vms)
 
+    # Protocol info files are redone where they are missing or were made with other parameters, e.g. a new IP. Once
+    # any server went further, the others hold state of the old files, so then all of them start over.
+    redo = []
     for idx, vm in enumerate(vms):
-        setup_vm(idx, n, vm)
-    for vm in vms:
-        vm.send_prot_info(n)
-    prots = " ".join(f"{idx}-protInfo.xml" for idx in range(n))
-    for vm in vms:
-        vm.ssh_call(["cd ~/election", f"vmni -merge {prots} merged.xml"])
-    for vm in vms:
-        vm.ssh_call(
-            [
-                "cd ~/election",
-                'export _JAVA_OPTIONS="-Djava.net.preferIPv4Stack=true"',
-                f"vmn -keygen privInfo.xml merged.xml publicKey",
-            ]
+        key = input_key(prot_command(n), vm.party(idx))
+        if not (checkpoints.done(vm, "protInfo", key) and os.path.exists(f"{idx}-protInfo.xml")):
+            redo.append((idx, vm, key))
+    if redo and any(checkpoints.get(vm, "merged") for vm in vms):
+        redo = [(idx, vm, input_key(prot_command(n), vm.party())) for idx, vm in enumerate(vms)]
+
+    # Decided by `merge` once all protocol info files are there, for the tasks after it
+    state = {}
+
+    def protInfo(idx, vm, key):
+        setup_vm(idx, n, vm, mark=checkpoints.mark("protInfo", key))
+        checkpoints.record(vm, "protInfo", key)
+
+    def merge():
+        key = state["key"] = input_key(*(sha256_file(f"{idx}-protInfo.xml") for idx in range(n)))
+        state["receivers"] = [vm for vm in vms[1:] if not checkpoints.done(vm, "merged", key)]
+        state["keygen"] = not checkpoints.all_done(vms, "keygen", key)
+        if state["receivers"] or not checkpoints.done(vms[0], "merged", key):
+            state["digest"] = vms[0].merge_prot_info(n, mark=checkpoints.mark("merged", key))
+            checkpoints.record(vms[0], "merged", key)
+
+    def bundle(vm):
+        if vm in state["receivers"]:
+            vm.receive_prot_info(state["digest"], mark=checkpoints.mark("merged", state["key"]))
+            checkpoints.record(vm, "merged", state["key"])
+
+    def keygen(vm):
+        if state["keygen"]:
+            vm.run(
+                [
+                    "cd ~/election",
+                    'export _JAVA_OPTIONS="-Djava.net.preferIPv4Stack=true"',
+                    "vmn -keygen privInfo.xml merged.xml publicKey",
+                    *checkpoints.mark("keygen", state["key"]),
+                ]
+            )
+            checkpoints.record(vm, "keygen", state["key"])
+
+    def publicKey():
+        if not state["keygen"] and checkpoints.local_done("publicKey", state["key"], "publicKey"):
+            return
+        backend.download(vms[0], "election/publicKey", "publicKey")
+        checkpoints.record_local("publicKey", state["key"])
+
+    # Every server generates its protocol info file. The first one merges them all, and the others receive the result
+    # in a single bundle, so that the number of transfers grows linearly with the number of servers. Key generation is
+    # a joint protocol that needs all servers at once, so it is not limited by --parallelism.
+    tasks = []
+    for idx, vm, key in redo:
+        tasks.append(Task(f"protInfo{idx}", protInfo, idx, vm, key, phase="protInfo"))
+    tasks.append(Task("merge", merge, deps=[f"protInfo{idx}" for idx, _, _ in redo]))
+    for idx, vm in enumerate(vms[1:], 1):
+        tasks.append(Task(f"bundle{idx}", bundle, vm, deps=["merge"], phase="bundle"))
+    for idx, vm in enumerate(vms):
+        tasks.append(
+            Task(
+                f"keygen{idx}",
+                keygen,
+                vm,
+                deps=[f"bundle{i}" for i in range(1, n)] or ["merge"],
+                phase="keygen",
+            )
         )
-    for vm in vms:
-        vm.communicate()
-
-    scp(
-        f"{args.username}@{vms[0].ip}:~/election/publicKey",
-        "publicKey",
-        args,
-        override=True,
-    )
-
-    with open("publicKey", "rb") as f:
+    tasks.append(Task("publicKey", publicKey, deps=[f"keygen{i}" for i in range(n)]))
+    try:
+        run_tasks(tasks, args.parallelism, unlimited=("keygen",))
+    finally:
+        report_tasks(tasks)
+        for fname in (PROT_INFO_BUNDLE, PROT_INFO_BUNDLE + ".gz"):
+            if os.path.exists(fname):
+                os.unlink(fname)
+
+    with REPORT.phase("publish"), open("publicKey", "rb") as f:
         requests.post(
             urljoin(args.server, "publicKey"), files={"publicKey": f}
         ).raise_for_status()
@@ -359,6 +694,234 @@ def start_main(args):
     )
 
 
+class Task:
+    """
+    Step of a phase that can run as soon as the tasks named in `deps` are done. Calls `func(*args, **kwargs)` and keeps
+    what it returns in `result`.
+    """
+
+    def __init__(self, name, func, *args, deps=(), phase=None, **kwargs):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = list(deps)
+        self.phase = phase or name
+        self.result = None
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+def run_tasks(tasks, parallelism=None, unlimited=()):
+    """
+    Run `tasks` in threads, each one as soon as its dependencies are done. At most `parallelism` tasks of the same
+    phase run at once, except for the phases in `unlimited`.
+
+    Once a task fails, no further tasks are started; the first error is raised when the running ones are done. Sets
+    `start` and `end` of every task that ran, in seconds since the first one started.
+    """
+    names = {task.name for task in tasks}
+    for task in tasks:
+        missing = set(task.deps) - names
+        if missing:
+            raise ValueError(f"{task.name} depends on unknown tasks {missing}")
+
+    pending = list(tasks)
+    running = {}
+    done = set()
+    failure = None
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(tasks) or 1) as pool:
+        while True:
+            busy = Counter(task.phase for task in running.values())
+            startable = list(pending) if failure is None else []
+            for task in startable:
+                if not done.issuperset(task.deps):
+                    continue
+                if (
+                    parallelism is not None
+                    and task.phase not in unlimited
+                    and busy[task.phase] >= parallelism
+                ):
+                    continue
+                pending.remove(task)
+                busy[task.phase] += 1
+                task.start = time.monotonic() - t0
+                running[pool.submit(_run_task, task)] = task
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                task.end = time.monotonic() - t0
+                if future.exception() is not None:
+                    error(f"{task.name} failed after {task.duration:.1f}s:", future.exception())
+                    failure = failure or future.exception()
+                else:
+                    task.result = future.result()
+                    done.add(task.name)
+    REPORT.add_tasks(tasks, t0)
+
+    if failure is not None:
+        raise failure
+    if pending:
+        raise ValueError(f"Tasks {[task.name for task in pending]} depend on each other")
+
+
+def _run_task(task):
+    with REPORT.label(task.phase, task.name):
+        return task.func(*task.args, **task.kwargs)
+
+
+def critical_path(tasks):
+    """
+    The chain of tasks that determined the total time: the last one to finish, the dependency of it that finished
+    last, and so on.
+    """
+    by_name = {task.name: task for task in tasks if task.end is not None}
+    if not by_name:
+        return []
+    path = [max(by_name.values(), key=lambda task: task.end)]
+    while True:
+        deps = [by_name[dep] for dep in path[-1].deps if dep in by_name]
+        if not deps:
+            return path[::-1]
+        path.append(max(deps, key=lambda task: task.end))
+
+
+def report_tasks(tasks):
+    info(f"{'task':<16} {'phase':<10} {'start':>8} {'duration':>9}")
+    for task in sorted(tasks, key=lambda task: (task.start is None, task.start or 0)):
+        if task.start is None:
+            info(f"{task.name:<16} {task.phase:<10} {'-':>8} {'-':>9}")
+        elif task.end is None:
+            info(f"{task.name:<16} {task.phase:<10} {task.start:>7.1f}s {'-':>9}")
+        else:
+            info(f"{task.name:<16} {task.phase:<10} {task.start:>7.1f}s {task.duration:>8.1f}s")
+
+    path = critical_path(tasks)
+    if path:
+        info(
+            f"Critical path ({path[-1].end:.1f}s):",
+            " -> ".join(f"{task.name} ({task.duration:.1f}s)" for task in path),
+        )
+
+
+def input_key(*inputs):
+    """
+    Key of the checkpoint of a phase: SHA-256 of its inputs, e.g. the digests of the files it reads and the commands it
+    runs.
+    """
+    h = hashlib.sha256()
+    for value in inputs:
+        h.update(str(value).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class Checkpoints:
+    """
+    Phases of the election that are done, with the `input_key` of what they were done with, so that running `start` or
+    `tally` again skips them and only redoes what failed or changed.
+
+    Every server records the phases it completed in a file per phase under ~/election/.checkpoints, written by the same
+    command as the phase itself (see `mark`), so a failed phase is never recorded and wiping ~/election forgets them.
+    `load` reads them with one command per server. This machine keeps a copy in `.<name>-checkpoints.json`, along with
+    the phases which only produce files here. With `fresh`, nothing is considered done.
+    """
+
+    DIR = "election/.checkpoints"
+
+    def __init__(self, args, fresh=False):
+        self.path = f".{args.name}-checkpoints.json"
+        self.fresh = fresh
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.saved = {}
+        self.saved.setdefault("local", {})
+        self.saved.setdefault("servers", {})
+
+    def load(self, vms):
+        def read(vm):
+            p = vm.backend.run(
+                vm,
+                [f"mkdir -p ~/{self.DIR}", f"cd ~/{self.DIR}", 'for f in *; do [ -f "$f" ] && echo "$f $(cat "$f")"; done; true'],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            out, _ = p.communicate()
+            if p.returncode != 0:
+                raise subprocess.CalledProcessError(p.returncode, "read checkpoints")
+            return dict(line.split(" ", 1) for line in out.splitlines() if " " in line)
+
+        with ThreadPoolExecutor(max_workers=len(vms) or 1) as pool:
+            for vm, phases in zip(vms, pool.map(read, vms)):
+                self.saved["servers"][vm.name] = phases
+        self._save()
+
+    def get(self, vm, phase):
+        return self.saved["servers"].get(vm.name, {}).get(phase)
+
+    def done(self, vm, phase, key):
+        done = not self.fresh and self.get(vm, phase) == key
+        if done:
+            info(f"{phase} already done on {vm.name}, skipping")
+        return done
+
+    def all_done(self, vms, phase, key):
+        """
+        Whether all `vms` did `phase`, for the joint protocols which have to run on all servers or none.
+        """
+        done = not self.fresh and all(self.get(vm, phase) == key for vm in vms)
+        if done:
+            info(f"{phase} already done on all servers, skipping")
+        return done
+
+    def mark(self, phase, key):
+        """
+        Commands to run on a server after those of `phase`, to record it as done there.
+        """
+        return [f"mkdir -p ~/{self.DIR}", f"echo {key} > ~/{self.DIR}/{phase}"]
+
+    def record(self, vm, phase, key):
+        """
+        Note here that `phase` was recorded as done on `vm` with `mark`.
+        """
+        with self._lock:
+            self.saved["servers"].setdefault(vm.name, {})[phase] = key
+            self._save()
+
+    def local_done(self, phase, key, *files):
+        done = (
+            not self.fresh
+            and self.saved["local"].get(phase) == key
+            and all(os.path.exists(f) for f in files)
+        )
+        if done:
+            info(f"{phase} already done, skipping")
+        return done
+
+    def record_local(self, phase, key):
+        with self._lock:
+            self.saved["local"][phase] = key
+            self._save()
+
+    def _save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.saved, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+
 def retry_subprocess(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -374,84 +937,227 @@ def retry_subprocess(func):
     return wrapper
 
 
+def prot_command(n):
+    return f"vmni -prot -sid Session1 -name myElection -nopart {n} -thres {n} stub.xml"
+
+
 @retry_subprocess
-def setup_vm(idx, n, vm):
+def setup_vm(idx, n, vm, mark=()):
     vm.idx = idx
-    prot = f"vmni -prot -sid Session1 -name myElection -nopart {n} -thres {n} stub.xml"
 
-    vm.ssh_call(
-        [
-            "killall java || true",
-            "rm -rf ~/election",
-            "mkdir -p ~/election",
-            "cd ~/election",
-            prot,
-            vm.party(),
-        ]
-    )
+    vm.backend.reset(vm)
+    vm.run(["cd ~/election", prot_command(n), vm.party(), *mark])
     vm.get_prot_info()
 
 
-def tally_main(args):
+def tally_main(args, backend):
     require_requests()
     vbt_call = determine_vbt(args)
 
-    with open("ciphertexts", "wb") as f:
-        r = requests.get(urljoin(args.server, "ciphertexts"))
-        r.raise_for_status()
-        f.write(r.content)
+    with REPORT.phase("ciphertexts"):
+        download(urljoin(args.server, "ciphertexts"), "ciphertexts")
+    REPORT.params["ciphertexts_bytes"] = os.path.getsize("ciphertexts")
 
     # Or, generate the ciphertexts with vmnd:
     # subprocess.run(["vmnd", "-ciphs", "publicKey", "130", "ciphertexts"], check=True)
 
-    vms = get_vms(args, start=False)
-    vmn_delete = ["vmn -delete -f privInfo.xml merged.xml"] if args.delete else []
-    for vm in vms:
-        scp("ciphertexts", f"{args.username}@{vm.ip}:~/election/ciphertexts", args)
-        vm.ssh_call(
-            [
-                "cd ~/election",
-                'export _JAVA_OPTIONS="-Djava.net.preferIPv4Stack=true"',
-                *vmn_delete,
-                "vmn -mix privInfo.xml merged.xml ciphertexts plaintexts",
-            ]
-        )
-    for vm in vms:
-        vm.communicate()
-    scp(
-        f"{args.username}@{vms[0].ip}:~/election/plaintexts",
-        "plaintexts",
-        args,
-        override=True,
-    )
-    assert os.path.exists("plaintexts")
-
-    if vbt_call is not None:
-        vbt_json = vbt_count("plaintexts", vbt_call)
-        print(vbt_json)
-        r = requests.post(urljoin(args.server, "results"), json=vbt_json)
-        r.raise_for_status()
-
-    # Verify
-    for vm in vms:
-        vm.ssh_call(
-            [
-                "cd ~/election",
-                'export _JAVA_OPTIONS="-Djava.net.preferIPv4Stack=true"',
-                "rm -rf /tmp/proof",
-                "mkdir /tmp/proof",
-                "vmnv -sloppy -v -v -e -wd /tmp/proof -a file ~/election/merged.xml $HOME/election/dir/nizkp/default",
-            ]
+    vms = backend.vms(start=False)
+    REPORT.params["servers"] = len(vms)
+    checkpoints = Checkpoints(args, fresh=args.fresh)
+    checkpoints.load(vms)
+
+    digest = sha256_file("ciphertexts")
+    receivers = [vm for vm in vms if not checkpoints.done(vm, "ciphertexts", digest)]
+    if receivers:
+        distribute(
+            receivers, "ciphertexts", "election/ciphertexts", mark=checkpoints.mark("ciphertexts", digest)
         )
-    ret = 0
-    for vm in vms:
-        code, _, _ = vm.communicate()
-        if code != 0:
-            error(vm.ip, "proof failed")
-            ret = code
+        for vm in receivers:
+            checkpoints.record(vm, "ciphertexts", digest)
+
+    # The same ciphertexts mixed with the same key give the same plaintexts and proofs
+    key = input_key(checkpoints.get(vms[0], "keygen"), digest)
+    mix = args.delete or not checkpoints.all_done(vms, "mix", key)
+    if mix:
+        # Servers that mixed before have a session to delete first. The mix is a joint protocol, so if it failed on
+        # one of them, it starts over on all of them.
+        delete = args.delete or any(checkpoints.get(vm, "mix") for vm in vms)
+        vmn_delete = ["vmn -delete -f privInfo.xml merged.xml"] if delete else []
+        with REPORT.phase("mix"):
+            for vm in vms:
+                vm.ssh_call(
+                    [
+                        "cd ~/election",
+                        'export _JAVA_OPTIONS="-Djava.net.preferIPv4Stack=true"',
+                        *vmn_delete,
+                        "vmn -mix privInfo.xml merged.xml ciphertexts plaintexts",
+                        *checkpoints.mark("mix", key),
+                    ]
+                )
+            ret = 0
+            for vm in vms:
+                code, _, _ = vm.communicate()
+                if code != 0:
+                    error(vm.name, "mix failed")
+                    ret = code
+                else:
+                    checkpoints.record(vm, "mix", key)
+        if ret != 0:
+            return ret
+
+    with REPORT.phase("plaintexts"):
+        if mix or not checkpoints.local_done("plaintexts", key, "plaintexts"):
+            backend.download(vms[0], "election/plaintexts", "plaintexts")
+            assert os.path.exists("plaintexts")
+            checkpoints.record_local("plaintexts", key)
+
+        if vbt_call is not None:
+            vbt_json = vbt_count("plaintexts", vbt_call)
+            REPORT.params["votes"] = sum(vbt_json.values())
+            print(vbt_json)
+            r = requests.post(urljoin(args.server, "results"), json=vbt_json)
+            r.raise_for_status()
+
+    # Verify, again only where it failed unless there are new proofs
+    verifiers = vms if mix else [vm for vm in vms if not checkpoints.done(vm, "verify", key)]
+    with REPORT.phase("verify"):
+        for vm in verifiers:
+            vm.ssh_call(
+                [
+                    "cd ~/election",
+                    'export _JAVA_OPTIONS="-Djava.net.preferIPv4Stack=true"',
+                    "rm -rf ~/proof",
+                    "mkdir ~/proof",
+                    "vmnv -sloppy -v -v -e -wd ~/proof -a file ~/election/merged.xml $HOME/election/dir/nizkp/default",
+                    *checkpoints.mark("verify", key),
+                ]
+            )
+        ret = 0
+        for vm in verifiers:
+            code, _, _ = vm.communicate()
+            if code != 0:
+                error(vm.name, "proof failed")
+                ret = code
+            else:
+                checkpoints.record(vm, "verify", key)
     return ret
 
 
+def sha256_file(fname):
+    h = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def pack(src):
+    """
+    Gzip local file `src` next to it, to be sent with `send_checked`. Returns the SHA-256 of `src`.
+    """
+    digest = sha256_file(src)
+    with open(src, "rb") as f, gzip.open(src + ".gz", "wb") as gz:
+        shutil.copyfileobj(f, gz, 1024 * 1024)
+    info(
+        f"Sending {src} ({os.path.getsize(src)} bytes, {os.path.getsize(src + '.gz')} gzipped, sha256 {digest})"
+    )
+    return digest
+
+
+def send_checked(vm, src, dest, digest, mark=()):
+    """
+    Copy local file `src`, packed with `pack`, to `dest` on `vm` and check that it arrived unchanged, then run `mark`.
+    """
+    vm.backend.upload(vm, src + ".gz", dest + ".gz")
+    vm.run(
+        [
+            f"gunzip -f {shlex.quote(dest)}.gz",
+            f"echo {shlex.quote(f'{digest}  {dest}')} | sha256sum --check --quiet",
+            *mark,
+        ]
+    )
+
+
+def distribute(vms, src, dest, mark=()):
+    """
+    Copy local file `src` to `dest` on all `vms` at once. The file is sent gzipped, and its SHA-256 is checked on every
+    server before it is used. Reports the time taken per server.
+    """
+    digest = pack(src)
+    tasks = [
+        Task(f"{os.path.basename(src)}:{vm.name}", send_checked, vm, src, dest, digest, mark, phase="distribute")
+        for vm in vms
+    ]
+    try:
+        run_tasks(tasks)
+    finally:
+        report_tasks(tasks)
+        os.unlink(src + ".gz")
+
+
+def download(url, fname, attempts=5):
+    """
+    Download `url` to `fname`. Interrupted downloads are resumed with HTTP Range requests, the file is only moved in
+    place once complete.
+
+    The ETag of the download is kept next to the file. If `fname` is still current, the server answers with
+    `304 Not Modified` and the existing file is reused.
+    """
+    part = fname + ".part"
+    etag_file = fname + ".etag"
+    if os.path.exists(part):
+        os.unlink(part)
+
+    etag = None
+    if os.path.exists(fname) and os.path.exists(etag_file):
+        with open(etag_file) as f:
+            etag = f.read().strip()
+
+    for _ in range(attempts):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        # Ranges are only meaningful for the identity encoding
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = etag
+        elif etag:
+            headers["If-None-Match"] = etag
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                if r.status_code == 304:
+                    info(f"{fname} is up to date")
+                    return
+                etag = r.headers.get("ETag")
+                if r.status_code == 206:
+                    total = int(r.headers["Content-Range"].rsplit("/", 1)[1])
+                else:
+                    total = int(r.headers.get("Content-Length", -1))
+                    offset = 0
+                with open(part, "ab" if offset else "wb") as f:
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            if total < 0 or os.path.getsize(part) >= total:
+                break
+            info(f"Download of {url} stopped at {os.path.getsize(part)}/{total} bytes, resuming")
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            info(f"Download of {url} interrupted, resuming", e)
+        time.sleep(1)
+    else:
+        raise RuntimeError(f"Could not download {url} in {attempts} attempts")
+
+    os.replace(part, fname)
+    if etag:
+        with open(etag_file, "w") as f:
+            f.write(etag)
+    elif os.path.exists(etag_file):
+        os.unlink(etag_file)
+
+
 def require_requests():
     if not requests:
         error("This command is not supported because `requests` is not installed.")
@@ -496,27 +1202,26 @@ def import_bytetree():
         raise e
 
 
-def get_vms(args, start=True):
-    vms = azure_vms_by_tag(args)
+def azure_get_vms(args, backend, start=True):
+    vms = azure_inventory(args)
     if not vms:
         raise RuntimeError(
             f"No VMs found with tag `{args.tag}`, did you forget to deploy?"
         )
     if start:
-        azure_start(vms, args.container)
-    return [
-        VirtualMachine(
-            vm_id,
-            args,
-        )
-        for vm_id in vms
-    ]
+        stopped = [vm["id"] for vm in vms if vm["power"] != "VM running"]
+        if stopped:
+            azure_start(stopped, args.container)
+            # Servers get a new public IP when they are started again
+            vms = azure_inventory(args, refresh=True)
+    return [VirtualMachine(vm["name"], vm["ip"], args, backend) for vm in vms]
 
 
-def stop_main(args):
+def azure_stop(args):
     if not args.delete:
-        vms = azure_vms_by_tag(args)
-        azure_deallocate(vms, args.container)
+        vms = azure_inventory(args)
+        azure_deallocate([vm["id"] for vm in vms], args.container)
+        invalidate_inventory(args)
         return 0
 
     while True:
@@ -524,23 +1229,105 @@ def stop_main(args):
         if not resources:
             break
         azure_delete(resources, args.container)
-
-
-def ssh_call(ip, cmds, args, **kwargs):
+    invalidate_inventory(args)
+
+
+class SSHConnections:
+    """
+    One multiplexed ssh connection per server for the whole run, shared by all `ssh_call` and `scp` calls to it
+    (OpenSSH's ControlMaster), so that only the first of them pays for the handshake. `close` ends the connections and
+    reports how much time that saved.
+    """
+
+    # Idle connections left behind, e.g. by the worker processes of `deploy`, end on their own after this long
+    PERSIST = "60s"
+
+    def __init__(self):
+        self.dir = None
+        self.handshakes = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._host_locks = {}
+
+    def options(self, host, args):
+        """
+        ssh options to reach `host` through its shared connection, which is opened first if needed.
+        """
+        with self._lock:
+            if self.dir is None:
+                # Short, unix sockets are limited to about 100 characters
+                self.dir = tempfile.mkdtemp(prefix="vmn-ssh-")
+            self.calls += 1
+            host_lock = self._host_locks.setdefault(host, threading.Lock())
+
+        options = [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={os.path.join(self.dir, '%C')}",
+            "-o",
+            f"ControlPersist={self.PERSIST}",
+        ]
+        with host_lock:
+            if host not in self.handshakes:
+                start = time.monotonic()
+                ret = subprocess.call(
+                    ["ssh", "-o", "StrictHostKeyChecking no", *identity(args), *options, "-N", "-f", host]
+                )
+                if ret != 0:
+                    # Not fatal, the command itself will try again and report the error
+                    error(f"Could not open a shared ssh connection to {host}")
+                self.handshakes[host] = time.monotonic() - start if ret == 0 else None
+        return options
+
+    def close(self):
+        with self._lock:
+            if self.dir is None:
+                return
+            for host in self.handshakes:
+                subprocess.call(
+                    ["ssh", "-o", f"ControlPath={os.path.join(self.dir, '%C')}", "-O", "exit", host],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+            opened = [seconds for seconds in self.handshakes.values() if seconds is not None]
+            if opened:
+                average = sum(opened) / len(opened)
+                info(
+                    f"{self.calls} ssh/scp calls over {len(opened)} connections,",
+                    f"{average:.1f}s per handshake: saved about {(self.calls - len(opened)) * average:.0f}s",
+                )
+            self.handshakes.clear()
+            self.calls = 0
+
+
+SSH = SSHConnections()
+
+
+def identity(args):
+    return ["-i", args.identity_file] if args.identity_file else []
+
+
+def ssh_call(ip, cmds, args, node=None, **kwargs):
     if isinstance(cmds, str):
         cmds = [cmds]
     # kwargs.setdefault("stdout", subprocess.PIPE)
     info("Running ssh commands", cmds)
+    if node is not None:
+        cmds = REPORT.wrap(node, cmds)
 
-    identity_file = ["-i", args.identity_file] if args.identity_file else []
-
+    host = f"{args.username}@{ip}"
     return subprocess.Popen(
         [
             "ssh",
             "-o",
             "StrictHostKeyChecking no",
-            *identity_file,
-            f"{args.username}@{ip}",
+            *identity(args),
+            *SSH.options(host, args),
+            host,
             " && ".join(cmds),
         ],
         **kwargs,
@@ -548,14 +1335,17 @@ def ssh_call(ip, cmds, args, **kwargs):
 
 
 def scp(src, dest, args, override=False):
-    identity_file = ["-i", args.identity_file] if args.identity_file else []
-
     if override:
         try:
             os.unlink(dest)
         except FileNotFoundError:
             pass
-    return subprocess.run(["scp", *identity_file, src, dest], check=True)
+    # The remote side is the one with a `host:` prefix
+    remote = next(path for path in (src, dest) if ":" in path)
+    host = remote.split(":", 1)[0]
+    return subprocess.run(
+        ["scp", *identity(args), *SSH.options(host, args), src, dest], check=True
+    )
 
 
 def start_docker(args):
@@ -721,7 +1511,7 @@ def azure_create_webapp(args, service_plan_name, virtual_network_name):
     )
 
 def azure_create_auth(args, service_plan_name, virtual_network_name):
-    name = f'aman-auth'
+    name = 'aman-auth'
 
     azure_call(
         [
@@ -741,7 +1531,7 @@ def azure_create_auth(args, service_plan_name, virtual_network_name):
             "--plan",
             service_plan_name,
             "--startup-file",
-            "gunicorn auth.frejaeid.app:app > /tmp/gunicorn.mylogs",
+            "gunicorn auth.frejaeid.app:app --threads 16 > /tmp/gunicorn.mylogs",
             "--verbose",
         ],
         args.container,
@@ -886,12 +1676,59 @@ def azure_deallocate(to_stop, container):
     )
 
 
-def azure_vms_by_tag(args):
-    return [
-        x
-        for x in azure_resources_by_tag(args)
-        if ".compute/virtualmachines/" in x.lower()
-    ]
+def inventory_cache(args):
+    return f".{args.name}-inventory.json"
+
+
+def azure_inventory(args, refresh=False):
+    """
+    Id, name, public IP and power state of every VM with the tag of this election, with a single `az` call. The result
+    is cached on disk for `--inventory-ttl` seconds, until `invalidate_inventory` is called or with `refresh`.
+    """
+    path = inventory_cache(args)
+    if not refresh and args.inventory_ttl > 0:
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            if cached["tag"] == args.tag and time.time() - cached["time"] < args.inventory_ttl:
+                return cached["vms"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    key, _, value = args.tag.strip().partition("=")
+    if not key:
+        raise ValueError("Empty tag")
+    vms = json.loads(
+        azure_call(
+            [
+                "az",
+                "vm",
+                "list",
+                "--show-details",
+                "--query",
+                f"[?tags.\"{key}\" == '{value}'].{{id: id, name: name, ip: publicIps, power: powerState}}",
+                "-ojson",
+            ],
+            args.container,
+        )
+    )
+    # Sorted, so that every server keeps its party index from one command to the next
+    vms.sort(key=lambda vm: vm["name"])
+
+    with open(path + ".tmp", "w") as f:
+        json.dump({"tag": args.tag, "time": time.time(), "vms": vms}, f)
+    os.replace(path + ".tmp", path)
+    return vms
+
+
+def invalidate_inventory(args):
+    """
+    Forget the cached inventory, after servers were created, started, stopped or deleted.
+    """
+    try:
+        os.unlink(inventory_cache(args))
+    except FileNotFoundError:
+        pass
 
 
 def azure_resources_by_tag(args):
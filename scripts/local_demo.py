@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
 import json
 import logging
 import os
+import shutil
 import string
-from collections import Counter
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
 from itertools import chain
 from pathlib import Path
 from subprocess import Popen
-from subprocess import call as subprocess_call
+
+import phase_report
 
 logging.basicConfig(level=logging.INFO, filemode="w", filename="local_demo.log", format="%(asctime)s;%(levelname)s;%(name)s;%(message)s")
 
@@ -17,15 +23,31 @@ logger = logging.getLogger('admin')
 
 DEMO_ELECTION = Path(os.path.dirname(__file__)).parent.joinpath('demoElection')
 
+# Time, CPU and memory used by the phases of this run and by every vmni / vmn process
+REPORT = phase_report.Report("local_demo")
+# Seconds between two looks at whether one of the processes waited for has ended
+REAP_INTERVAL = 0.05
+
 def main(args):
     print(args)
 
-    if args.vmni:
-        vmni(args)
-    if args.vmn:
-        vmn(args)
-    if args.vbt and not args.dry_run:
-        print(vbt(args))
+    if args.sweep:
+        return sweep(args)
+
+    REPORT.params.update(parties=args.num_parties, threshold=args.threshold)
+    try:
+        if args.vmni:
+            vmni(args)
+        if args.vmn:
+            vmn(args)
+        if args.vbt and not args.dry_run:
+            with REPORT.phase("tally"):
+                print(vbt(args))
+    finally:
+        if not args.dry_run:
+            path = os.path.join(args.report_dir, f"local_demo-{time.strftime('%Y%m%d-%H%M%S')}.json")
+            REPORT.save(path)
+            print(f"Report written to {path}, compare reports with `scripts/demo.py compare`")
 
     return 0
 
@@ -35,19 +57,23 @@ def vmni(args):
     2 - Info File Generator
     2.1 - Basic Usage
     """
-    vmni_common_parameters(args)
-    vmni_individual_protocol_info_files(args)
-    vmni_merge_protocol_info_files(args)
+    with REPORT.phase("prot"):
+        vmni_common_parameters(args)
+    with REPORT.phase("party"):
+        vmni_individual_protocol_info_files(args)
+    with REPORT.phase("merge"):
+        vmni_merge_protocol_info_files(args)
 
 
 def vmni_common_parameters(args):
     """See:
     1. Agree on common parameters
     """
+    calls = []
     for idx,_ in enumerate(args.ips):
         if not args.dry_run:
             os.makedirs(os.path.join(DEMO_ELECTION, str(idx)), exist_ok=True)
-        args.call(
+        calls.append((
             [
                 "vmni",
                 "-prot",
@@ -60,14 +86,16 @@ def vmni_common_parameters(args):
                 "-thres",
                 args.threshold,
                 "stub.xml",
-            ], cwd=os.path.join(DEMO_ELECTION, str(idx))
-        )
+            ], dict(cwd=os.path.join(DEMO_ELECTION, str(idx)))
+        ))
+    run_parallel(args, calls)
 
 
 def vmni_individual_protocol_info_files(args):
     """See:
     2. Generate individual info files
     """
+    calls = []
     for idx, ip in enumerate(args.ips):
         name = args.party_format.format(idx=idx)
         priv = "privInfo.xml"
@@ -76,7 +104,7 @@ def vmni_individual_protocol_info_files(args):
         hint = args.hint_format.format(ip=ip, idx=idx, port=args.hint_port + idx)
         if not args.dry_run:
             os.makedirs(os.path.join(DEMO_ELECTION, str(idx)), exist_ok=True)
-        args.call(
+        calls.append((
             [
                 "vmni",
                 "-party",
@@ -89,8 +117,9 @@ def vmni_individual_protocol_info_files(args):
                 "stub.xml",
                 priv,
                 prot,
-            ], cwd=os.path.join(DEMO_ELECTION, str(idx))
-        )
+            ], dict(cwd=os.path.join(DEMO_ELECTION, str(idx)))
+        ))
+    run_parallel(args, calls)
 
 
 def vmni_merge_protocol_info_files(args):
@@ -108,23 +137,55 @@ def vmn(args):
     """See:
     3.Mix-Net
     """
-    processes = [
-        # add logging script to vmn
-        args.call(
-            ["vmn", "-keygen", "privInfo.xml", "../merged.xml", "publicKey"],
-            popen=True,
-            cwd=os.path.join(DEMO_ELECTION, str(idx)),
-        )
-        for idx in range(args.num_parties)
-    ]
-
-    logger.info(f'3 -> (receive) Public key received by mix-net')
-
-    for p in processes:
-        p.communicate()
-
+    keygen(args)
+
+    with REPORT.phase("ciphertexts"):
+        collect_ciphertexts(args)
+
+    mix(args)
+
+
+def keygen(args):
+    with REPORT.phase("keygen"):
+        processes = [
+            # add logging script to vmn
+            args.call(
+                ["vmn", "-keygen", "privInfo.xml", "../merged.xml", "publicKey"],
+                popen=True,
+                cwd=os.path.join(DEMO_ELECTION, str(idx)),
+            )
+            for idx in range(args.num_parties)
+        ]
+
+        follow(args, processes)
+        logger.info('3 -> (receive) Public key received by mix-net')
+
+
+def mix(args):
+    with REPORT.phase("mix"):
+        logger.info('27 -> (send) Start shuffle for party')
+        processes = [
+            args.call(
+                [
+                    "vmn",
+                    "-mix",
+                    "privInfo.xml",
+                    "../merged.xml",
+                    "../ciphertexts",
+                    "plaintexts",
+                ],
+                popen=True,
+                cwd=os.path.join(DEMO_ELECTION, str(idx)),
+            )
+            for idx in range(args.num_parties)
+        ]
+        follow(args, processes)
+        logger.info('27 -> (receive) End shuffle for party')
+
+
+def collect_ciphertexts(args):
     if args.demo:
-        args.call(["vmnd", "-ciphs", "0/publicKey", 100, "ciphertexts"])
+        args.call(["vmnd", "-ciphs", "0/publicKey", args.ciphertexts, "ciphertexts"], cwd=DEMO_ELECTION)
     elif args.dry_run:
         pass
     elif args.post:
@@ -133,33 +194,11 @@ def vmn(args):
             logger.info('3 -> (send) Public key sent')
         input("Vote and press Enter ")
         logger.info('25 -> (send) End of voting')
-        with open(os.path.join(DEMO_ELECTION, "ciphertexts"), "wb") as f:
-            r = request("GET", f"{args.post}/ciphertexts")
-            f.write(r.content)
+        fetch(f"{args.post}/ciphertexts", os.path.join(DEMO_ELECTION, "ciphertexts"))
     else:
         while not os.path.exists("ciphertexts"):
             input("Please collect ciphertexts and press Enter ")
 
-    logger.info(f'27 -> (send) Start shuffle for party')
-    processes = [
-        args.call(
-            [
-                "vmn",
-                "-mix",
-                "privInfo.xml",
-                "../merged.xml",
-                "../ciphertexts",
-                "plaintexts",
-            ],
-            popen=True,
-            cwd=os.path.join(DEMO_ELECTION, str(idx)),
-        )
-        for idx in range(args.num_parties)
-    ]
-    logger.info(f'27 -> (receive) End shuffle for party')
-    for p in processes:
-        p.communicate()
-
 
 def request(method, *args, **kwargs):
     import requests
@@ -172,6 +211,27 @@ def request(method, *args, **kwargs):
     return r
 
 
+def fetch(url, fname):
+    """
+    GET `url` into `fname`. The ETag is kept next to the file so that an unchanged file is not downloaded again.
+    """
+    etag_file = fname + ".etag"
+    headers = {}
+    if os.path.exists(fname) and os.path.exists(etag_file):
+        with open(etag_file) as f:
+            headers["If-None-Match"] = f.read().strip()
+
+    r = request("GET", url, headers=headers)
+    if r.status_code == 304:
+        return
+
+    with open(fname, "wb") as f:
+        f.write(r.content)
+    if "ETag" in r.headers:
+        with open(etag_file, "w") as f:
+            f.write(r.headers["ETag"])
+
+
 VALID_CHARS = " -_.,()" + string.ascii_letters + string.digits
 
 def import_bytetree():
@@ -195,7 +255,17 @@ def vbt(args):
     """
 
     logging.info('28 -> (send) Signal from mix-net to decrypt votes')
-    vbt_json = Counter(
+    vbt_json = count_votes(os.path.join(DEMO_ELECTION, "1", "plaintexts"))
+    logging.info(f'28 -> (receive) Decrypted votes {vbt_json}')
+
+    # Post results to GUI
+    request("POST", f"{args.post}/results", json=vbt_json)
+
+    return vbt_json
+
+
+def count_votes(fname):
+    return Counter(
         map(
             lambda x: "".join(
                 # Plaintexts is a byte tree with N children where each child is
@@ -206,15 +276,168 @@ def vbt(args):
                 if c in VALID_CHARS
             ),
             # vbt converts the RAW plaintexts to JSON.
-            import_bytetree()(os.path.join(DEMO_ELECTION, "1", "plaintexts")),
+            import_bytetree()(fname),
         )
     )
-    logging.info(f'28 -> (receive) Decrypted votes {vbt_json}')
 
-    # Post results to GUI
-    request("POST", f"{args.post}/results", json=vbt_json)
 
-    return vbt_json
+# Columns of the results of `sweep`, one row per configuration, number of ciphertexts and repetition. Key generation
+# does not depend on the ciphertexts, its columns are the same for all of them.
+SWEEP_COLUMNS = [
+    "parties",
+    "threshold",
+    "ciphertexts",
+    "repetition",
+    "keygen_s",
+    "keygen_cpu_s",
+    "mix_s",
+    "mix_cpu_s",
+    "mix_peak_rss_kb",
+    "tally_s",
+]
+
+
+def sweep(args):
+    """
+    Benchmark local elections: for every number of parties in --sweep-parties and threshold in --sweep-thresholds,
+    --repetitions times, generate the keys, then mix and tally each number of ciphertexts in --sweep-ciphertexts made up
+    with `vmnd`. The times are written to results.csv and results.json in --sweep-dir after every mix, so that an
+    interrupted sweep keeps what it measured, and plotted once it is done.
+    """
+    global REPORT
+
+    if args.dry_run:
+        print("--sweep cannot be combined with --dry-run")
+        return 1
+    if os.path.exists(DEMO_ELECTION):
+        print(f"Delete {DEMO_ELECTION} before running a sweep, it is used for every election of the sweep")
+        return 1
+
+    directory = args.sweep_dir or f"sweep-{time.strftime('%Y%m%d-%H%M%S')}"
+    os.makedirs(directory, exist_ok=True)
+    rows = []
+    for parties in args.sweep_parties:
+        # 0 stands for all parties
+        for threshold in sorted({t or parties for t in args.sweep_thresholds if (t or parties) <= parties}):
+            config = argparse.Namespace(**vars(args))
+            config.num_parties = config.num_part = parties
+            config.threshold = threshold
+            config.ips = ["localhost"] * parties
+            config.demo = True
+            for repetition in range(args.repetitions):
+                print(f"Sweep: {parties} parties, threshold {threshold}, repetition {repetition + 1}/{args.repetitions}")
+                REPORT = phase_report.Report("local_demo", parties=parties, threshold=threshold)
+                try:
+                    vmni(config)
+                    keygen(config)
+                    keys = _last_phase("keygen")
+                    for count in args.sweep_ciphertexts:
+                        config.ciphertexts = count
+                        with REPORT.phase("ciphertexts"):
+                            collect_ciphertexts(config)
+                        first = len(REPORT.commands)
+                        mix(config)
+                        mixed = _last_phase("mix")
+                        with REPORT.phase("tally") as tally:
+                            count_votes(os.path.join(DEMO_ELECTION, "0", "plaintexts"))
+                        rows.append(
+                            {
+                                "parties": parties,
+                                "threshold": threshold,
+                                "ciphertexts": count,
+                                "repetition": repetition,
+                                "keygen_s": keys["wall"],
+                                "keygen_cpu_s": keys["cpu"],
+                                "mix_s": mixed["wall"],
+                                "mix_cpu_s": mixed["cpu"],
+                                "mix_peak_rss_kb": max(c["peak_rss_kb"] for c in REPORT.commands[first:]),
+                                "tally_s": tally["wall"],
+                            }
+                        )
+                        save_sweep(rows, directory)
+                        # Keep the keys, but make room for the next mix
+                        run_parallel(
+                            config,
+                            [
+                                (
+                                    ["vmn", "-delete", "-f", "privInfo.xml", "../merged.xml"],
+                                    dict(cwd=os.path.join(DEMO_ELECTION, str(idx))),
+                                )
+                                for idx in range(parties)
+                            ],
+                        )
+                finally:
+                    shutil.rmtree(DEMO_ELECTION, ignore_errors=True)
+
+    plot_sweep(rows, directory)
+    print(f"Sweep results written to {directory}")
+    return 0
+
+
+def _last_phase(name):
+    return next(record for record in reversed(REPORT.phases) if record["name"] == name)
+
+
+def save_sweep(rows, directory):
+    with open(os.path.join(directory, "results.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, SWEEP_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(directory, "results.json"), "w") as f:
+        json.dump(rows, f, indent=2)
+
+
+def plot_sweep(rows, directory):
+    """
+    Plot the mean over the repetitions of the mix and tally times against the number of ciphertexts, and of the key
+    generation time against the number of parties, with the range of the repetitions as error bars.
+    """
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping the plots")
+        return
+
+    def mean_range(values):
+        mean = sum(values) / len(values)
+        return mean, mean - min(values), max(values) - mean
+
+    configs = sorted({(row["parties"], row["threshold"]) for row in rows})
+    for column, title in (("mix_s", "Mixing"), ("tally_s", "Tallying")):
+        fig, ax = plt.subplots()
+        for parties, threshold in configs:
+            times = defaultdict(list)
+            for row in rows:
+                if (row["parties"], row["threshold"]) == (parties, threshold):
+                    times[row["ciphertexts"]].append(row[column])
+            counts = sorted(times)
+            means, below, above = zip(*(mean_range(times[count]) for count in counts))
+            ax.errorbar(counts, means, yerr=[below, above], marker="o", capsize=3, label=f"{parties} parties, threshold {threshold}")
+        ax.set(xscale="log", yscale="log", xlabel="ciphertexts", ylabel="seconds", title=f"{title} time")
+        ax.legend()
+        fig.savefig(os.path.join(directory, f"{column[:-2]}.png"), bbox_inches="tight")
+        plt.close(fig)
+
+    fig, ax = plt.subplots()
+    for threshold_is_all in (True, False):
+        times = defaultdict(list)
+        for row in rows:
+            # Once per repetition, key generation does not depend on the ciphertexts
+            if (row["threshold"] == row["parties"]) == threshold_is_all and row["ciphertexts"] == rows[0]["ciphertexts"]:
+                times[row["parties"]].append(row["keygen_s"])
+        if not times:
+            continue
+        parties = sorted(times)
+        means, below, above = zip(*(mean_range(times[n]) for n in parties))
+        label = "threshold = parties" if threshold_is_all else "threshold < parties"
+        ax.errorbar(parties, means, yerr=[below, above], marker="o", capsize=3, label=label)
+    ax.set(xlabel="parties", ylabel="seconds", title="Key generation time")
+    ax.legend()
+    fig.savefig(os.path.join(directory, "keygen.png"), bbox_inches="tight")
+    plt.close(fig)
 
 
 def call(cmd, popen=False, **kwargs):
@@ -230,10 +453,217 @@ def call(cmd, popen=False, **kwargs):
         kwargs.setdefault("stdout", out)
         kwargs.setdefault("stderr", err)
 
-        if popen:
-            return Popen(cmd_strings, **kwargs)
-        assert subprocess_call(cmd_strings, **kwargs) == 0, "subprocess.call failed"
-        return None
+        started = time.monotonic()
+        p = Popen(cmd_strings, **kwargs)
+    p.node = Path(kwargs.get("cwd", ".")).resolve().name
+    p.command = " ".join(cmd_strings)
+    p.output = (out_basename + "-stdout.txt", out_basename + "-stderr.txt")
+    p.started = started
+    p.ended = None
+    if popen:
+        return p
+    wait([p])
+    assert p.returncode == 0, "subprocess.call failed"
+    return None
+
+
+def wait(processes):
+    """
+    Wait for `processes` started by `call` and record the time, CPU and peak memory of each one in REPORT, as it ends.
+    """
+    pending = {p.pid: p for p in processes if isinstance(p, Popen)}
+    while pending:
+        _reap(pending)
+
+
+def run_parallel(args, calls):
+    """
+    Run `calls`, `(cmd, kwargs)` pairs for `call`, with at most `args.jobs` processes at once. Fails like `call` does
+    once one of them fails.
+    """
+    pending = list(calls)
+    running = {}
+    while pending or running:
+        while pending and len(running) < args.jobs:
+            cmd, kwargs = pending.pop(0)
+            p = args.call(cmd, popen=True, **kwargs)
+            if isinstance(p, Popen):
+                running[p.pid] = p
+        if running:
+            p = _reap(running)
+            assert p.returncode == 0, f"{p.command} failed in {p.node}"
+
+
+def _reap(pending):
+    """
+    Wait for the first of the processes in `pending`, by pid, to end and remove it. Returns it. Only these processes are
+    waited for, the exit status of any other child is left to whoever started it.
+    """
+    while True:
+        for pid in list(pending):
+            reaped, status, usage = os.wait4(pid, os.WNOHANG)
+            if reaped:
+                break
+        else:
+            time.sleep(REAP_INTERVAL)
+            continue
+        break
+    p = pending.pop(pid)
+    p.ended = time.monotonic()
+    p.returncode = os.waitstatus_to_exitcode(status)
+    p.cpu = usage.ru_utime + usage.ru_stime
+    # Largest resident set of the process or any of its children, in KiB
+    p.peak_rss_kb = usage.ru_maxrss
+    REPORT.add_command(
+        p.node,
+        p.command,
+        wall=p.ended - p.started,
+        cpu=p.cpu,
+        peak_rss_kb=p.peak_rss_kb,
+        returncode=p.returncode,
+    )
+    return p
+
+
+def follow(args, processes):
+    """
+    Wait for `processes` like `wait`. Unless --monitor-interval is 0, show their output and resource use while they run,
+    and a summary of them at the end.
+    """
+    processes = [p for p in processes if isinstance(p, Popen)]
+    if args.monitor_interval <= 0 or not processes:
+        wait(processes)
+        return
+
+    with Monitor(processes, args.monitor_interval) as monitor:
+        wait(processes)
+    for line in monitor.summary():
+        print(line)
+        logger.info(line)
+
+
+class Monitor:
+    """
+    Follows processes started by `call` while they run: prints the new lines of their stdout and stderr files as they
+    are written, prefixed with the party, and samples the CPU time and resident memory of the process tree of each one
+    from /proc every `interval` seconds.
+    """
+
+    def __init__(self, processes, interval=1.0):
+        self.processes = processes
+        self.interval = interval
+        self.peak_rss = defaultdict(int)
+        self.last_line = {}
+        self._cpu = {}
+        self._offsets = defaultdict(int)
+        self._partial = defaultdict(bytes)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._tail()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._tail()
+            self._sample()
+
+    def _tail(self):
+        for p in self.processes:
+            for path, stream in zip(p.output, ("out", "err")):
+                try:
+                    with open(path, "rb") as f:
+                        f.seek(self._offsets[path])
+                        data = f.read()
+                except FileNotFoundError:
+                    continue
+                self._offsets[path] += len(data)
+                *lines, self._partial[path] = (self._partial[path] + data).split(b"\n")
+                for line in lines:
+                    line = line.decode(errors="replace").rstrip()
+                    if line:
+                        self.last_line[p.node] = line
+                        print(f"[{p.node} {stream}] {line}", file=sys.stdout if stream == "out" else sys.stderr)
+
+    def _sample(self):
+        table = _proc_table()
+        if not table:
+            return
+        children = defaultdict(list)
+        for pid, (ppid, _, _) in table.items():
+            children[ppid].append(pid)
+        now = time.monotonic()
+        status = []
+        for p in self.processes:
+            if p.returncode is not None or p.pid not in table:
+                status.append(f"{p.node}: done")
+                continue
+            cpu = rss = 0
+            tree = [p.pid]
+            while tree:
+                pid = tree.pop()
+                _, pid_cpu, pid_rss = table[pid]
+                cpu += pid_cpu
+                rss += pid_rss
+                tree.extend(children[pid])
+            # CPU use since the previous sample, in % of a core
+            last_time, last_cpu = self._cpu.get(p.node, (p.started, 0))
+            self._cpu[p.node] = (now, cpu)
+            self.peak_rss[p.node] = max(self.peak_rss[p.node], rss)
+            status.append(f"{p.node}: {100 * (cpu - last_cpu) / (now - last_time):.0f}% {rss / 2 ** 20:.0f}MiB")
+        print("[monitor]", ", ".join(status), file=sys.stderr)
+
+    def summary(self):
+        """
+        Lines of a table with the time, CPU and peak memory of every process once they all ended, in the order they
+        ended. The last one is marked, it is the one the others waited for. The peak memory is the larger of the samples
+        taken while it ran, the total of its process tree, and what the kernel reported for it when it ended, which
+        also covers processes that ended between two samples.
+        """
+        processes = sorted(self.processes, key=lambda p: p.ended)
+        lines = [f"{'party':<8} {'wall':>8} {'cpu':>8} {'cpu%':>6} {'peak MiB':>9} {'exit':>5}   last output"]
+        for p in processes:
+            wall = p.ended - p.started
+            peak = max(self.peak_rss[p.node], p.peak_rss_kb * 1024)
+            lines.append(
+                f"{p.node:<8} {wall:>7.1f}s {p.cpu:>7.1f}s {100 * p.cpu / wall if wall else 0:>5.0f}%"
+                f" {peak / 2 ** 20:>9.1f} {p.returncode:>5} {'*' if p is processes[-1] else ' '} "
+                f"{self.last_line.get(p.node, '')[:60]}"
+            )
+        return lines
+
+
+def _proc_table():
+    """
+    Parent pid, CPU seconds (including reaped children) and resident bytes of every process, from /proc. Empty where
+    there is no /proc.
+    """
+    ticks = os.sysconf("SC_CLK_TCK")
+    page = os.sysconf("SC_PAGE_SIZE")
+    table = {}
+    try:
+        entries = os.listdir("/proc")
+    except FileNotFoundError:
+        return table
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name in parentheses may contain spaces
+        fields = stat[stat.rindex(")") + 2 :].split()
+        cpu = sum(int(x) for x in fields[11:15]) / ticks
+        table[int(entry)] = (int(fields[1]), cpu, int(fields[21]) * page)
+    return table
 
 
 def call_print(cmd, popen=False, **_):
@@ -253,6 +683,10 @@ def str_to_fname(iterable):
     return "".join(c for c in iterable if c in VALID_CHARS)
 
 
+def int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
 
@@ -261,11 +695,35 @@ def parse_args():
     parser.add_argument("--no-vmn", action="store_false", dest="vmn")
     parser.add_argument("--no-vbt", action="store_false", dest="vbt")
     parser.add_argument("--demo", action="store_true")
+    parser.add_argument("--ciphertexts", default=100, type=int, help="Ciphertexts made up by vmnd with --demo")
     parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--report-dir", default="reports", help="Directory of the JSON report of this run")
+    parser.add_argument("-j", "--jobs", default=os.cpu_count() or 1, type=int, help="vmni processes run at once")
+    parser.add_argument(
+        "--monitor-interval",
+        default=5.0,
+        type=float,
+        help="Seconds between samples of the CPU and memory of the vmn processes, 0 to not follow them",
+    )
     parser.add_argument(
         "--post", nargs="?", default=None, const="https://vmn-webapp.azurewebsites.net/"
     )
 
+    # Sweep
+    parser.add_argument("--sweep", action="store_true", help="Benchmark a matrix of local elections, see `sweep`")
+    parser.add_argument("--sweep-parties", default=[2, 3, 4], type=int_list, help="Comma separated numbers of parties")
+    parser.add_argument(
+        "--sweep-thresholds", default=[0], type=int_list, help="Comma separated thresholds, 0 for all parties"
+    )
+    parser.add_argument(
+        "--sweep-ciphertexts",
+        default=[100, 1000, 10000, 100000],
+        type=int_list,
+        help="Comma separated numbers of ciphertexts",
+    )
+    parser.add_argument("--repetitions", default=3, type=int, help="Elections per configuration of the sweep")
+    parser.add_argument("--sweep-dir", default=None, help="Directory of the results, defaults to sweep-<time>")
+
     # 2.1.1 common parameters
     parser.add_argument("-sid", "--session-id", default="Session1")
     parser.add_argument("-name", "--name", default="myElection")
@@ -300,6 +758,4 @@ def parse_args():
 
 
 if __name__ == "__main__":
-    import sys
-
     sys.exit(main(parse_args()))
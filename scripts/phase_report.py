@@ -0,0 +1,265 @@
+"""
+Timing and resource report of an election run, shared by `demo.py` and `local_demo.py`.
+
+A run is made of phases (key generation, mixing, verification, ...), and every phase of commands on the servers. For
+both, the report records the wall-clock time, the CPU time (user + system) and the peak memory (largest resident set
+size, in KiB), and `save` writes them to a JSON file. `compare` diffs two such files, e.g. before and after a change or
+for different numbers of votes or servers.
+
+Phases are measured on this machine, including its child processes. Commands on the servers are measured on the server
+they run on, see `Report.wrap`.
+"""
+import json
+import os
+import resource
+import shlex
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import count
+
+# Directory on the servers, relative to the home directory, where `wrap` leaves the measurements of commands
+STATS_DIR = ".vmn-stats"
+
+# Runs a shell command with bash and writes its measurements to a file, as a single JSON line
+MEASURE = """\
+import json, os, resource, subprocess, sys, time
+start = time.monotonic()
+code = subprocess.call(["bash", "-c", sys.argv[2]])
+usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+with open(sys.argv[1], "w") as f:
+    json.dump({"id": os.path.basename(sys.argv[1])[: -len(".json")], "wall": time.monotonic() - start, "cpu": usage.ru_utime + usage.ru_stime, "peak_rss_kb": usage.ru_maxrss, "returncode": code}, f)
+    f.write("\\n")
+sys.exit(code)
+"""
+
+
+def usage():
+    """
+    CPU time and peak memory of this process and its children so far.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    return cpu, max(own.ru_maxrss, children.ru_maxrss)
+
+
+class Report:
+    """
+    Measurements of one run of `command`. `params` describe the election, e.g. the number of servers, and are compared
+    along with the measurements.
+    """
+
+    def __init__(self, command, **params):
+        self.command = command
+        self.params = params
+        self.started = time.time()
+        self.phases = []
+        self.commands = []
+        self.tasks = []
+        # Prefix of the measurement files of this run on the servers
+        self.run_id = f"{os.getpid()}-{int(self.started)}"
+        self._start = time.monotonic()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ids = count()
+        self._pending = {}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measure the code in the block as phase `name`. Commands started in it belong to that phase.
+        """
+        start = time.monotonic()
+        cpu, _ = usage()
+        record = {"name": name, "start": start - self._start}
+        try:
+            with self.label(name):
+                yield record
+        finally:
+            end_cpu, peak = usage()
+            record.update(wall=time.monotonic() - start, cpu=end_cpu - cpu, peak_rss_kb=peak)
+            with self._lock:
+                self.phases.append(record)
+
+    @contextmanager
+    def label(self, phase, task=None):
+        """
+        Assign the commands started in this thread in the block to `phase` and `task`, without measuring the block.
+        """
+        previous = getattr(self._local, "label", None)
+        self._local.label = (phase, task)
+        try:
+            yield
+        finally:
+            self._local.label = previous
+
+    def current(self):
+        """
+        `(phase, task)` of the commands started in this thread now, or None outside of any phase.
+        """
+        return getattr(self._local, "label", None)
+
+    def add_command(self, node, command, **measurements):
+        """
+        Record a command that was measured by the caller, e.g. a local process reaped with `os.wait4`.
+        """
+        phase, task = self.current() or (None, None)
+        with self._lock:
+            self.commands.append(
+                {"node": node, "phase": phase, "task": task, "command": command, **measurements}
+            )
+
+    def add_tasks(self, tasks, start):
+        """
+        Record the start and duration of the `demo.Task`s that ran, timed from `start` (a `time.monotonic`).
+        """
+        offset = start - self._start
+        with self._lock:
+            self.tasks.extend(
+                {"name": task.name, "phase": task.phase, "start": offset + task.start, "wall": task.duration}
+                for task in tasks
+                if task.start is not None
+            )
+
+    def wrap(self, node, cmds):
+        """
+        Shell command that runs `cmds` on server `node` (joined with `&&`) and leaves its measurements there, to be
+        picked up by `collect`. Commands started outside of a phase are not measured and returned as they are.
+        """
+        label = self.current()
+        if label is None:
+            return cmds
+        if isinstance(cmds, str):
+            cmds = [cmds]
+
+        phase, task = label
+        with self._lock:
+            cmd_id = f"{self.run_id}-{next(self._ids)}"
+            self._pending[cmd_id] = {
+                "node": node,
+                "phase": phase,
+                "task": task,
+                "command": " && ".join(cmds),
+            }
+        stats = f"~/{STATS_DIR}/{cmd_id}.json"
+        return [
+            f"mkdir -p ~/{STATS_DIR}",
+            f"python3 -c {shlex.quote(MEASURE)} {stats} {shlex.quote(' && '.join(cmds))}",
+        ]
+
+    def collect_commands(self):
+        """
+        Shell commands that print and remove the measurements `wrap` left on a server, to be passed to `collect`.
+        """
+        files = f"~/{STATS_DIR}/{self.run_id}-*.json"
+        return [f"cat {files} 2>/dev/null || true", f"rm -f {files}"]
+
+    def nodes(self):
+        """
+        Servers that have measurements waiting to be collected.
+        """
+        with self._lock:
+            return {record["node"] for record in self._pending.values()}
+
+    def collect(self, output):
+        """
+        Add the measurements printed on a server by `collect_commands`.
+        """
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            stats = json.loads(line)
+            with self._lock:
+                record = self._pending.pop(stats.pop("id"), None)
+                if record is not None:
+                    self.commands.append({**record, **stats})
+
+    def to_dict(self):
+        with self._lock:
+            # Commands that were killed or whose server could not be reached
+            commands = self.commands + [{**record, "wall": None} for record in self._pending.values()]
+        phases = {}
+        for record in self.phases:
+            phases[record["name"]] = dict(record)
+        # Phases made of parallel tasks span from the first start to the last end
+        spans = defaultdict(list)
+        for task in self.tasks:
+            if task["wall"] is not None:
+                spans[task["phase"]].append((task["start"], task["start"] + task["wall"]))
+        for name, times in spans.items():
+            if name not in phases:
+                start = min(s for s, _ in times)
+                phases[name] = {"name": name, "start": start, "wall": max(e for _, e in times) - start}
+        for record in phases.values():
+            measured = [c for c in commands if c["phase"] == record["name"] and c.get("cpu") is not None]
+            record["commands"] = len(measured)
+            record["node_cpu"] = sum(c["cpu"] for c in measured) if measured else None
+            record["node_peak_rss_kb"] = max((c["peak_rss_kb"] for c in measured), default=None)
+
+        return {
+            "command": self.command,
+            "params": self.params,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "wall": time.monotonic() - self._start,
+            "phases": sorted(phases.values(), key=lambda record: record["start"]),
+            "tasks": self.tasks,
+            "commands": commands,
+        }
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old, new):
+    """
+    Lines of a table comparing reports `old` and `new`: their parameters, and the wall-clock time, the CPU time here
+    and on the servers and the peak memory of the servers per phase.
+    """
+    lines = []
+    for key in sorted(set(old["params"]) | set(new["params"])):
+        a, b = old["params"].get(key), new["params"].get(key)
+        lines.append(f"{key:<24} {_fmt(a):>12} {_fmt(b):>12}{'' if a == b else '  *'}")
+
+    lines.append("")
+    lines.append(f"{'phase':<24} {'':<16} {'old':>12} {'new':>12} {'change':>8}")
+    old_phases = {record["name"]: record for record in old["phases"]}
+    new_phases = {record["name"]: record for record in new["phases"]}
+    names = list(old_phases) + [name for name in new_phases if name not in old_phases]
+    rows = [(name, old_phases.get(name, {}), new_phases.get(name, {})) for name in names]
+    rows.append(("total", old, new))
+    for name, a, b in rows:
+        for key, unit in (("wall", "s"), ("cpu", "s"), ("node_cpu", "s"), ("node_peak_rss_kb", "KiB")):
+            if a.get(key) is None and b.get(key) is None:
+                continue
+            lines.append(
+                f"{name:<24} {key:<16} {_fmt(a.get(key), unit):>12} {_fmt(b.get(key), unit):>12}"
+                f" {_change(a.get(key), b.get(key)):>8}"
+            )
+            name = ""
+    return lines
+
+
+def _fmt(value, unit=""):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}{unit}"
+    return f"{value}{unit}"
+
+
+def _change(old, new):
+    if not old or new is None:
+        return ""
+    return f"{100 * (new - old) / old:+.0f}%"
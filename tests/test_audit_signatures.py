@@ -0,0 +1,97 @@
+import base64
+import datetime
+import json
+import os
+import sys
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "scripts"))
+
+import audit_signatures  # noqa: E402
+from webdemo.bytetree import ByteTree, encode_vote, vote_hash  # noqa: E402
+
+LEFT = ByteTree([ByteTree(list(b"left"))]).to_byte_array()
+RIGHT = ByteTree([ByteTree(list(b"right"))]).to_byte_array()
+# The same vote as the single byte tree poll.html submits, and as the two components /offline_vote stores
+SINGLE = encode_vote(bytes([ByteTree.NODE]) + (2).to_bytes(4, "big") + LEFT + RIGHT)
+COMPONENTS = json.dumps([list(LEFT), list(RIGHT)])
+
+
+@pytest.fixture(scope="module")
+def signer():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Freja test")])
+    now = datetime.datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    x5t = audit_signatures._b64encode(certificate.fingerprint(hashes.SHA1()))
+
+    def sign(signed_text, status="APPROVED"):
+        user_signature = f"e30.{audit_signatures._b64encode(signed_text.encode())}.c2ln"
+        claims = {"status": status, "signatureData": {"userSignature": user_signature}}
+        header = audit_signatures._b64encode(json.dumps({"alg": "RS256", "x5t": x5t}).encode())
+        payload = audit_signatures._b64encode(json.dumps(claims).encode())
+        sig = key.sign(f"{header}.{payload}".encode(), padding.PKCS1v15(), hashes.SHA256())
+        return f"{header}.{payload}.{audit_signatures._b64encode(sig)}"
+
+    return sign, {x5t: certificate.public_key()}, certificate.public_bytes(serialization.Encoding.PEM)
+
+
+def _vote(n):
+    left = ByteTree([ByteTree(list(f"left {n}".encode()))]).to_byte_array()
+    right = ByteTree([ByteTree(list(f"right {n}".encode()))]).to_byte_array()
+    return bytes([ByteTree.NODE]) + (2).to_bytes(4, "big") + left + right
+
+
+@pytest.mark.parametrize("vote", [SINGLE, COMPONENTS], ids=["single", "components"])
+def test_both_vote_formats_have_the_signed_hash(signer, vote):
+    sign, keys, _ = signer
+    signed_text, problem = audit_signatures.check_signature(sign(vote_hash(base64.b64decode(SINGLE))), keys)
+    assert problem is None
+    assert audit_signatures.check_vote(vote) == (signed_text, None)
+
+
+def test_check_vote_reports_malformed_components():
+    expected, problem = audit_signatures.check_vote(json.dumps([[9, 9], list(RIGHT)]))
+    assert expected is None
+    assert problem.startswith("malformed vote")
+
+
+def test_check_signature_reports_unapproved(signer):
+    sign, keys, _ = signer
+    assert audit_signatures.check_signature(sign("0000", status="REJECTED"), keys) == (
+        None,
+        "signature request not approved: REJECTED",
+    )
+
+
+def test_audit_pairs_out_of_order_lines(signer, tmp_path):
+    sign, _, pem = signer
+    votes = [_vote(n) for n in range(5)]
+    # Signatures in another order than the votes, the last vote unsigned and one signature for no recorded vote
+    signatures = [sign(vote_hash(votes[n])) for n in (3, 0, 2, 1)] + [sign("0000 0000")]
+    (tmp_path / "cert.pem").write_bytes(pem)
+    (tmp_path / "signatures.txt").write_text("".join(f"{s}\n" for s in signatures))
+    (tmp_path / "data.txt").write_text("".join(f"{encode_vote(v)}\n" for v in votes))
+
+    total, problems = audit_signatures.audit(
+        tmp_path / "signatures.txt", tmp_path / "data.txt", tmp_path / "cert.pem", workers=2
+    )
+    assert total == 5
+    assert problems == [
+        ("signatures", 5, "signed hash '0000 0000' is not the hash of any recorded vote"),
+        ("votes", 5, "no signature recorded for this vote"),
+    ]
@@ -0,0 +1,180 @@
+"""
+Admission control for the requests that make the auth server call Freja.
+
+Logging in and casting a vote each start a request at Freja, so bursts of them are held back before they reach the
+auth server. Every client IP and every email has a token bucket, shared by all workers; a client that empties one is
+turned away with `429 Too Many Requests` and a `Retry-After` header. On top of that, the requests of all clients
+together are limited to `SIGN_RATE` per second over all workers and to `SIGN_CONCURRENCY` in flight per worker.
+Requests beyond that are answered with `503 Service Unavailable` and `Retry-After`. In the ASGI variant they first wait
+in line for up to `SIGN_QUEUE_TIMEOUT` seconds, so that a burst is spread out at the rate Freja accepts instead of
+failing there; the Flask app does not wait, that would hold one of its few threads per waiting request.
+
+Behind reverse proxies, e.g. on Azure App Service, the client IP is taken from `X-Forwarded-For` as set by the last
+`PROXY_HOPS` of them. Without it, every client would share the bucket of the proxy.
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from flask import Response
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# Requests per second and burst size per client IP
+IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", 1))
+IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", 10))
+# Per email, enough to log in and vote a few times
+EMAIL_RATE = float(os.getenv("RATE_LIMIT_EMAIL_RATE", 0.1))
+EMAIL_BURST = int(os.getenv("RATE_LIMIT_EMAIL_BURST", 5))
+# All clients together
+SIGN_RATE = float(os.getenv("SIGN_RATE", 20))
+SIGN_BURST = int(os.getenv("SIGN_BURST", 20))
+SIGN_CONCURRENCY = int(os.getenv("SIGN_CONCURRENCY", 16))
+SIGN_QUEUE_TIMEOUT = float(os.getenv("SIGN_QUEUE_TIMEOUT", 5))
+# Reverse proxies in front of the server whose `X-Forwarded-For` is trusted, 0 to use the address of the connection
+PROXY_HOPS = int(os.getenv("PROXY_HOPS", 0))
+
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after, status=429):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status = status
+
+
+def check_client(limits, ip, email):
+    """
+    Take a token from the buckets of `ip` and `email` in `limits`, a `store.RateLimits`.
+    """
+    for scope, key, rate, burst in (("ip", ip, IP_RATE, IP_BURST), ("email", email, EMAIL_RATE, EMAIL_BURST)):
+        if not key:
+            continue
+        wait = limits.take(f"{scope}:{key}", rate, burst)
+        if wait > 0:
+            limits.increment(f"rate_limited.{scope}")
+            raise RateLimited(f"Too many requests from this {scope}, try again later.", wait)
+
+
+class SigningGate:
+    """
+    Limits the calls which make the auth server call Freja, for all clients together: `rate` per second over all
+    workers sharing `limits`, and `concurrency` in flight in this process. `slot` turns away the calls over them right
+    away, `aslot` waits for up to `queue_timeout` seconds first.
+    """
+
+    def __init__(
+        self,
+        limits,
+        rate=SIGN_RATE,
+        burst=SIGN_BURST,
+        concurrency=SIGN_CONCURRENCY,
+        queue_timeout=SIGN_QUEUE_TIMEOUT,
+    ):
+        self.limits = limits
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._async_semaphore = None
+
+    def _take(self, max_wait):
+        wait = self.limits.take("signing", self.rate, self.burst, max_wait)
+        if wait > max_wait:
+            self._reject(wait)
+        if wait > 0:
+            self.queued += 1
+        return wait
+
+    def _reject(self, retry_after):
+        self.rejected += 1
+        raise RateLimited("Too many votes are being cast right now, try again later.", retry_after, status=503)
+
+    @contextmanager
+    def slot(self):
+        self._take(0.0)
+        if not self._semaphore.acquire(blocking=False):
+            self._reject(self.concurrency / self.rate)
+
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """
+        Same as `slot` on the event loop, but waits in line for up to `queue_timeout` seconds.
+        """
+        if self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.concurrency)
+
+        start = time.monotonic()
+        await asyncio.sleep(await asyncio.get_running_loop().run_in_executor(None, self._take, self.queue_timeout))
+        try:
+            await asyncio.wait_for(
+                self._async_semaphore.acquire(), max(self.queue_timeout - (time.monotonic() - start), 0)
+            )
+        except asyncio.TimeoutError:
+            self._reject(self.concurrency / self.rate)
+
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._async_semaphore.release()
+
+    def stats(self):
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+        }
+
+
+def init_app(app):
+    """
+    Answer the requests of Flask `app` that were turned away with a 429 or 503, and take the client IP from the
+    `PROXY_HOPS` proxies in front of it.
+    """
+    app.register_error_handler(RateLimited, rate_limited_response)
+    if PROXY_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+
+class AsgiProxyFix:
+    """
+    The `X-Forwarded-For` part of `werkzeug.middleware.proxy_fix.ProxyFix` for an ASGI app: the client address is the
+    one added by the proxy `hops` steps back.
+    """
+
+    def __init__(self, app, hops=PROXY_HOPS):
+        self.app = app
+        self.hops = hops
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and self.hops:
+            values = [value.decode("latin-1") for name, value in scope["headers"] if name == b"x-forwarded-for"]
+            addresses = [address.strip() for address in ",".join(values).split(",")] if values else []
+            if len(addresses) >= self.hops:
+                scope = dict(scope, client=(addresses[-self.hops], 0))
+        return await self.app(scope, receive, send)
+
+
+def rate_limited_response(e, response_class=Response):
+    response = response_class(json.dumps({"message": str(e)}), status=e.status, mimetype="application/json")
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
@@ -1,20 +1,25 @@
 import base64
-import io
+import fcntl
 import json
 import logging
 import mimetypes
 import os
 import requests
+from contextlib import contextmanager
 from functools import wraps
-from hashlib import sha256
 from itertools import islice
 from operator import itemgetter
 from urllib.parse import urlparse
 
-from flask import Flask, render_template, request, send_file, redirect, flash, url_for, make_response
+from flask import Flask, Response, render_template, request, redirect, flash, url_for, make_response
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.datastructures import ContentRange
 
-from .bytetree import ByteTree
+from common import profiling, resilience
+
+from . import admission, conditional, sign_events
+from .bytetree import BYTEORDER, ByteTree, decode_vote, encode_vote, vote_hash
+from .store import TERMINAL_STATUSES, PendingSignatures, RateLimits, Store
 
 mimetypes.add_type("application/wasm", ".wasm")
 
@@ -22,10 +27,6 @@ logging.basicConfig(level=logging.INFO, filemode="a", filename="local_demo.log",
 
 logger = logging.getLogger('vote_collection_server|web_server')
 
-# Items are tuple
-# (signature reference/signature, vote, is freja online)
-SIGNED_VOTES = []
-
 def get_auth_server_url():
     parsed_url = urlparse(os.getenv('AUTH_SERVER_URL'))
 
@@ -36,12 +37,21 @@ def get_auth_server_url():
 
 
 app = Flask(__name__)
-app.config["SECRET_KEY"] = os.urandom(32)
+# Must be the same in all workers, otherwise sessions and CSRF tokens only validate on the worker that issued them
+app.config["SECRET_KEY"] = os.getenv("SECRET_KEY") or os.urandom(32)
 app.debug = True
 csrf = CSRFProtect(app)
+profiling.init_app(app, csrf)
+resilience.init_app(app)
+admission.init_app(app)
+
+# Seconds a call to the auth server may take at most, the deadline of the request may leave less
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", 30))
+# The auth server answers 500 when Freja turns down what the voter sent, only 502-504 mean that it is in trouble
+AUTH_BREAKER = resilience.breaker("auth", failure_statuses=(502, 503, 504))
 
 FILENAME = "data.txt"
-PUBLIC_KEY = os.path.join(os.path.abspath(os.path.dirname(__file__)), "publicKey")
+PUBLIC_KEY = os.getenv("PUBLIC_KEY", os.path.join(os.path.abspath(os.path.dirname(__file__)), "publicKey"))
 POLL_DATA = {
     "question": "Who do you vote for?",
     "fields": ("Blue Candidate", "Green Candidate", "Yellow Candidate"),
@@ -50,6 +60,16 @@ POLL_DATA = {
 STATS = {}
 RESULTS = "results.json"
 SIGNATURES = "signatures.txt"
+# Lock file serializing the writes to FILENAME and SIGNATURES over all workers and threads
+VOTE_LOG_LOCK = "votes.lock"
+STORE_DB = os.getenv("STORE_DB", "store.db")
+# Counters shared between all workers. The generation counters of the artifacts are used as ETags
+STORE = Store(STORE_DB)
+# Votes waiting to be signed, shared between all workers
+PENDING = PendingSignatures(STORE_DB)
+# Token buckets of the clients and of the calls that reach Freja, shared between all workers
+LIMITS = RateLimits(STORE_DB)
+SIGNING = admission.SigningGate(LIMITS)
 
 
 def init_stats():
@@ -81,40 +101,38 @@ def login_required(f):
 
 
 def _check_for_signed_votes():
-    it = len(SIGNED_VOTES) - 1
     votes_for_verified_backend = []
-    while (it >= 0):
-        signed_vote = SIGNED_VOTES[it]
-        signature_reference, encrypted_vote, freja_online, user_email = signed_vote
-        if freja_online:
-            signature, has_signed = _confirm_if_user_has_signed(signature_reference)
-            logger.info(f'14 -> (recieve) successful vote signing: {user_email},{signature_reference}')
-
-            if signature is not None and has_signed:
-                modified_response_object = {
-                    'vote': encrypted_vote,
-                    'signature': signature,
-                }
-                votes_for_verified_backend.append(modified_response_object)
-                logger.info(f'15 -> (send) forward signature')
-                if _mock_user_forward():
-                    logger.info(f'17 -> (receive) receive submission request {encrypted_vote})')
-                    _record_signature(signature, encrypted_vote)
-                del SIGNED_VOTES[it]
+    # Signatures are pushed by the auth server while subscribed, the votes it missed are polled a bit later
+    for entry in PENDING.lease(online_grace=sign_events.poll_grace()):
+        if entry.freja_online:
+            signature, status = _confirm_if_user_has_signed(entry.sign_ref)
+            logger.info(f'14 -> (recieve) successful vote signing: {entry.email},{entry.sign_ref}')
+
+            if status in TERMINAL_STATUSES:
+                logger.info(f'14 -> (recieve) signing ended with {status}: {entry.email},{entry.sign_ref}')
+                PENDING.evict(entry, status)
+                continue
+            if signature is None:
+                PENDING.release(entry)
+                continue
         else:
-            # `signature_reference` is signature in case of offline votes
-            modified_response_object = {
-                'vote': encrypted_vote,
-                'signature': signature_reference,
-            }
-            votes_for_verified_backend.append(modified_response_object)
-            logger.info(f'15 -> (send) forward signature')
-            if _mock_user_forward():
-                logger.info(f'17 -> (receive) receive submission request {encrypted_vote})')
-                _record_signature(signature_reference, encrypted_vote)
-            del SIGNED_VOTES[it]
-
-        it -= 1
+            # `sign_ref` is signature in case of offline votes
+            signature = entry.sign_ref
+
+        if not PENDING.complete(entry):
+            # The lease expired and another worker took over this vote
+            continue
+
+        modified_response_object = {
+            'vote': entry.vote,
+            'signature': signature,
+        }
+        votes_for_verified_backend.append(modified_response_object)
+        logger.info(f'15 -> (send) forward signature')
+        if _mock_user_forward():
+            logger.info(f'17 -> (receive) receive submission request {entry.vote})')
+            _record_signature(signature, entry.vote)
+
     if len(votes_for_verified_backend) == 0:
         return render_template("poll.html", data=POLL_DATA, stats=STATS, vote=None)
     
@@ -122,6 +140,32 @@ def _check_for_signed_votes():
     return render_template("poll.html", data=POLL_DATA, stats=STATS, show_success=True, vote=json.dumps(votes_for_verified_backend))
 
 
+def _on_sign_event(event):
+    entry = PENDING.lease_ref(event["signRef"])
+    if entry is None:
+        # Not a vote of this election, or a worker is polling for it right now
+        return
+
+    status = event["status"]
+    logger.info(f'14 -> (recieve) pushed signing outcome {status}: {entry.email},{entry.sign_ref}')
+    if status in TERMINAL_STATUSES:
+        PENDING.evict(entry, status)
+        return
+    if status != "APPROVED" or not PENDING.complete(entry):
+        PENDING.release(entry)
+        return
+
+    logger.info(f'15 -> (send) forward signature')
+    if _mock_user_forward():
+        logger.info(f'17 -> (receive) receive submission request {entry.vote})')
+        _record_signature(event["signature"], entry.vote)
+
+
+@app.before_request
+def _subscribe_to_sign_events():
+    sign_events.start(f"{get_auth_server_url()}/sign_events", _on_sign_event)
+
+
 def _mock_user_forward():
     return True
 
@@ -130,19 +174,41 @@ def _append_vote_to_ciphertexts(vote):
     with open(FILENAME, "a") as f:
         print(vote, file=f)
         STATS["nvotes"] += 1
+    # Only after the vote is written, so that a tag never describes less than what was sent with it
+    STORE.increment("generation.votes")
         
 
 
+@contextmanager
+def _vote_log_locked(shared=False):
+    """
+    Hold the exclusive lock over the vote log, or a shared one to read it. Every open of the lock file takes its own
+    lock, so this also excludes the other threads of this worker.
+    """
+    with open(VOTE_LOG_LOCK, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
 def _record_signature(signature, vote):
+    """
+    Record a signed vote unless its voter has voted already. The check and both appends are done under the lock, so
+    that a voter is counted once and line i of SIGNATURES stays the signature of line i of FILENAME, whichever worker
+    or thread records the vote.
+    """
     logger.info(f'18 -> (send) check if user has already voted {signature}')
-    if not _has_user_already_voted(signature):
+    with _vote_log_locked():
+        if _has_user_already_voted(signature):
+            logger.info(f'18 -> (recieve) user has already voted')
+            return
         logger.info(f'18 -> (recieve) user has not voted')
         with open(SIGNATURES, "a") as f:
             f.write(f"{signature}\n")
         _append_vote_to_ciphertexts(vote)
-    else:
-        logger.info(f'18 -> (recieve) user has already voted')
-    
+
 
 
 def _has_user_already_voted(candidate_signature):
@@ -170,17 +236,27 @@ def _get_userInfo_from_signature(signature):
     payload_json = json.loads(jws_payload_decoded)
     return payload_json["userInfo"]
 
+def _post_auth(path, payload):
+    # Bounded by the deadline of the current request, and not attempted at all while the auth server is failing
+    return AUTH_BREAKER.call(
+        requests.post, f'{get_auth_server_url()}{path}', json=payload, **resilience.outbound(AUTH_TIMEOUT)
+    )
+
+
 def _confirm_if_user_has_signed(sign_ref):
     logger.info(f'13 -> (send) ask id_server if user signed')
-    r = requests.post(
-        f'{get_auth_server_url()}/confirm_sign',
-        json={
-            'signRef': sign_ref,
-        }
-    )
+    try:
+        r = _post_auth('/confirm_sign', {'signRef': sign_ref})
+    except (requests.RequestException, resilience.CircuitOpen, resilience.DeadlineExceeded) as e:
+        # Try again at the next poll, the poll page is served regardless
+        logger.info(f'13 -> (recieve) could not ask id_server: {e}')
+        return (None, None)
 
     if r.status_code == 200:
-        return (r.json()['signature'], True)
+        return (r.json()['signature'], 'APPROVED')
+
+    if r.status_code == 400:
+        return (None, r.json().get('status'))
     
     return (None, None)
 
@@ -201,30 +277,31 @@ def root():
     if error:
         return error    
 
-    encrypted_vote = ByteTree(json.loads(vote)).to_byte_array()
-    hashed_encryption = sha256()
-    hashed_encryption.update(encrypted_vote)
-    hex_string = hashed_encryption.digest().hex()
-    beautified_hex_string = ' '.join([hex_string[i:i+4] for i in range(0, len(hex_string), 4)])
+    ciphertext = decode_vote(vote)
+    beautified_hex_string = vote_hash(ciphertext)
 
     # add a step information in log
     logger.info(f'10 -> (receive) Request signing of vote: {beautified_hex_string},{user_email},{session_id}')
 
-    sign_request = requests.post(
-        f'{get_auth_server_url()}/init_sign',
-        json={
-            'email': user_email,
-            'text': '',
-            'vote': beautified_hex_string,
-        }
-    )
+    admission.check_client(LIMITS, request.remote_addr, user_email)
+    with SIGNING.slot():
+        sign_request = _post_auth(
+            '/init_sign',
+            {
+                'email': user_email,
+                'text': '',
+                'vote': beautified_hex_string,
+            }
+        )
 
     logger.info(f'11 -> (send) Vote signing request forwarded   : {beautified_hex_string}')
 
     if sign_request.status_code == 200:
         response_object = sign_request.json()
         signature_reference = response_object['signRef']
-        SIGNED_VOTES.append((signature_reference, eval(vote), True, user_email))
+        # Freja's expiry is in milliseconds
+        expiry = response_object.get('expiry')
+        PENDING.add(signature_reference, encode_vote(ciphertext), True, user_email, expiry and expiry / 1000)
         
         return render_template("poll.html", data=POLL_DATA, stats=STATS, show_success=True, hash=beautified_hex_string)
     
@@ -237,14 +314,27 @@ def root():
 
 
 def _validate_vote(vote):
+    """
+    Check a vote as submitted by poll.html, see `decode_vote`.
+    """
+    if vote is None:
+        return "Missing vote"
     try:
-        x = json.loads(vote)
-        ByteTree(x)
+        ciphertext = decode_vote(vote)
     except json.JSONDecodeError:
         return "JSON Decode Error"
-    except TypeError:
-        return "Vote could not be parsed into a valid ByteTree"
+    except (ValueError, TypeError):
+        return "Vote is neither base64 nor an array of bytes"
+    if not isinstance(ciphertext, bytes):
+        return "Vote should be a single byte tree"
 
+    try:
+        _vote_components(ciphertext)
+        _, length = ByteTree._from_byte_array(ciphertext, 0)
+    except (ValueError, IndexError, AssertionError):
+        return "Vote could not be parsed into a valid ByteTree"
+    if length != len(ciphertext):
+        return "Vote could not be parsed into a valid ByteTree"
 
     return None
 
@@ -259,16 +349,21 @@ def _delete_file(file):
 
 def _reset():
     STATS["nvotes"] = 0
+    PENDING.clear()
     
     response_text = ""
-    if _delete_file(FILENAME):
-        response_text += "Successfully deleted {FILENAME}:<br/><pre>{stat}</pre>\n"
-    
+    with _vote_log_locked():
+        if _delete_file(FILENAME):
+            response_text += "Successfully deleted {FILENAME}:<br/><pre>{stat}</pre>\n"
+
+        if _delete_file(SIGNATURES):
+            response_text += "Successfully deleted {SIGNATURES}:<br/><pre>{stat}</pre>\n"
+        STORE.increment("generation.votes")
+
     if _delete_file(RESULTS):
         response_text += "Successfully deleted {RESULTS}:<br/><pre>{stat}</pre>\n"
 
-    if _delete_file(SIGNATURES):
-        response_text += "Successfully deleted {SIGNATURES}:<br/><pre>{stat}</pre>\n"
+    STORE.increment("generation.results")
 
     if response_text:
         return response_text
@@ -286,10 +381,9 @@ def login():
         return render_template("login.html")
     
     email = request.form.get("email")
-    r = requests.post(
-        f'{get_auth_server_url()}/init_auth',
-        json={'email': email},
-    )
+    admission.check_client(LIMITS, request.remote_addr, email)
+    with SIGNING.slot():
+        r = _post_auth('/init_auth', {'email': email})
 
     if r.status_code == 200:
         auth_ref = r.json()['authRef']
@@ -302,10 +396,7 @@ def login():
 
 
 def _is_authenticated(user_identification):
-    r = requests.post(
-        f'{get_auth_server_url()}/authentication_validity',
-        json={'authRef': user_identification}
-    )
+    r = _post_auth('/authentication_validity', {'authRef': user_identification})
 
     if r.status_code == 200:
         return True
@@ -325,7 +416,7 @@ def offline_vote():
     signature = sample_signed_vote['signature']
     user_email = _get_email_from_jws_payload(signature)
     
-    SIGNED_VOTES.append((signature, encrypted_vote, False, user_email))
+    PENDING.add(signature, encrypted_vote, False, user_email)
     
     return redirect(url_for('root'))
 
@@ -346,7 +437,7 @@ def publickey():
     POST: Receive the public key from the admin after the mix network generates it. Currently, no authentication is
         done. The key should be provided as an attachment in the POST request, the file name should be `publicKey`.
         Example curl call: `curl -i -X POST -F publicKey=@./publicKey <root URL>/publicKey`.
-    GET: Return the current public key as an octet stream.
+    GET: Return the current public key as an octet stream. Supports `If-None-Match` and compression.
 
     This function is exempt from CSRF since it is not meant to be accessed from the web interface.
     """
@@ -354,12 +445,10 @@ def publickey():
         if not os.path.isfile(PUBLIC_KEY):
             return "Missing public key!", 404
 
-        return send_file(
-            PUBLIC_KEY,
-            mimetype="application/octet-stream",
-            as_attachment=True,
-            attachment_filename="publicKey",
-        )
+        tag = conditional.etag(STORE, "publicKey")
+        with open(PUBLIC_KEY, "rb") as f:
+            data = f.read()
+        return conditional.artifact_response(data, tag, "application/octet-stream", filename="publicKey")
 
     new_pk = request.files.get("publicKey")
     if new_pk is None:
@@ -368,42 +457,186 @@ def publickey():
     # Time not logged for this statmenet
     logger.info(f'3 -> (receive) Received public key from admin')
     new_pk.save(PUBLIC_KEY)
+    STORE.increment("generation.publicKey")
     init_pk()
     _reset()
 
     return "OK"
 
 
+@app.route("/metrics")
+def metrics():
+    """
+    Endpoint for monitoring, returns counters shared by all workers and the circuit breakers and admission control of
+    this worker as JSON.
+    """
+    counters = STORE.counters()
+    evictions = {k.split(".", 1)[1]: v for k, v in counters.items() if k.startswith("evicted.")}
+    rate_limited = {k.split(".", 1)[1]: v for k, v in counters.items() if k.startswith("rate_limited.")}
+    return {
+        "pending_signatures": len(PENDING),
+        "evictions": dict(evictions, total=sum(evictions.values())),
+        "breakers": resilience.states(),
+        "admission": dict(SIGNING.stats(), rate_limited=rate_limited),
+    }
+
+
 @app.route("/ciphertexts")
 def ciphertexts():
     """
     Endpoint for the encrypted cipher votes.
 
-    Returns the current votes as a byte tree encoded as an octet stream.
+    Returns the current votes as a byte tree encoded as an octet stream. The byte tree is streamed while it is being
+    serialized, and single byte ranges can be requested to resume an interrupted download. Supports `If-None-Match`,
+    `If-Range` and compression of full responses.
     """
-    if not os.path.exists(FILENAME):
+    snapshot = _ciphertexts_snapshot()
+    if snapshot is None:
         return "No ciphertexts found", 404
 
-    with open(FILENAME) as f:
-        # Read votes as received by encrypt(s) from poll.html
-        vote_list = [
-            (
-                ByteTree.from_byte_array(x[0]),  # encrypted0
-                ByteTree.from_byte_array(x[1]),  # encrypted1
-            )
-            for x in map(json.loads, f)
-        ]
-        # Convert N x 2 -> 2 x N
-        left, right = tuple(zip(*vote_list))
-        # Single ByteTree to hold all encrypted votes
-        byte_tree = ByteTree([ByteTree(left), ByteTree(right)])
-
-        return send_file(
-            io.BytesIO(byte_tree.to_byte_array()),
-            mimetype="application/octet-stream",
-            download_name="ciphertexts",
-            as_attachment=True,
-        )
+    tag, f, size = snapshot
+    if request.if_range.etag is not None and request.if_range.etag != tag:
+        # Resuming a download of a different version, the whole file has to be sent again
+        byte_ranges = None
+    else:
+        byte_ranges = request.range
+    encoding = None if byte_ranges else conditional.negotiate_encoding()
+
+    response = conditional.not_modified(conditional.variant_etag(tag, encoding))
+    if response is not None:
+        f.close()
+        return response
+
+    try:
+        layout = _ciphertexts_layout(f, size)
+    except BaseException:
+        f.close()
+        raise
+    # Root node header, two inner node headers and the votes
+    total = 3 * 5 + sum(left + right for left, right in layout)
+
+    start, stop = 0, total
+    if byte_ranges is not None:
+        byte_range = byte_ranges.range_for_length(total)
+        if byte_range is None:
+            f.close()
+            response = Response("Requested range not satisfiable", status=416)
+            response.content_range = ContentRange("bytes", None, None, total)
+            return response
+        start, stop = byte_range
+
+    response = Response(
+        conditional.compress_stream(_stream_segments(f, _ciphertexts_segments(f, layout), start, stop), encoding),
+        status=206 if (start, stop) != (0, total) else 200,
+        mimetype="application/octet-stream",
+        direct_passthrough=True,
+    )
+    if encoding is None:
+        response.content_length = stop - start
+    response.accept_ranges = "bytes"
+    conditional.set_headers(response, conditional.variant_etag(tag, encoding), encoding, filename="ciphertexts")
+    if response.status_code == 206:
+        response.content_range = ContentRange("bytes", start, stop, total)
+    return response
+
+
+# Size of the chunks /ciphertexts is sent in
+CHUNK_SIZE = 64 * 1024
+
+
+def _vote_components(vote):
+    """
+    Split a vote, as decoded from a line of FILENAME, into the serialized byte trees of its two ciphertext components.
+
+    Votes are stored either as a list of the two serialized components, or as the single serialized byte tree holding
+    both of them that `encrypt()` in poll.html returns.
+    """
+    if isinstance(vote[0], int):
+        tpe = vote[0]
+        nchildren = int.from_bytes(bytes(vote[1:5]), BYTEORDER)
+        if tpe != ByteTree.NODE or nchildren != 2:
+            raise ValueError("Vote should be a byte tree node with 2 children")
+        _, length = ByteTree._from_byte_array(vote, 5)
+        return bytes(vote[5 : 5 + length]), bytes(vote[5 + length :])
+
+    left, right = vote
+    # Drop anything after the end of each byte tree, like ByteTree.from_byte_array does
+    _, left_length = ByteTree._from_byte_array(left, 0)
+    _, right_length = ByteTree._from_byte_array(right, 0)
+    return bytes(left[:left_length]), bytes(right[:right_length])
+
+
+def _ciphertexts_snapshot():
+    """
+    The tag of the current votes, FILENAME opened and its size, or None if there are no votes. Votes are appended and
+    tagged under the exclusive lock, so the first `size` bytes of the file are the votes tagged `tag`, whatever is
+    appended while they are sent.
+    """
+    with _vote_log_locked(shared=True):
+        tag = conditional.etag(STORE, "votes")
+        try:
+            f = open(FILENAME)
+        except FileNotFoundError:
+            return None
+        return tag, f, os.fstat(f.fileno()).st_size
+
+
+def _ciphertexts_layout(f, size):
+    """
+    Read the votes in the first `size` bytes of `f` once and return the lengths of their two components, needed to
+    compute the size of the response up front.
+    """
+    layout = []
+    # Votes are base64 or JSON, one character is one byte
+    for line in f:
+        if size <= 0:
+            break
+        size -= len(line)
+        layout.append(tuple(map(len, _vote_components(decode_vote(line)))))
+    return layout
+
+
+def _node_header(nchildren):
+    return ByteTree.NODE.to_bytes(1, BYTEORDER) + nchildren.to_bytes(4, BYTEORDER)
+
+
+def _ciphertexts_segments(f, layout):
+    """
+    Yield the `(length, produce)` pieces that make up the ciphertexts byte tree, in order. Calling `produce()` returns the
+    bytes of the piece.
+
+    The byte tree is the transpose of the votes: a node with all first components, followed by a node with all second
+    components. Only the votes covered by `layout` are read, so votes appended in the meantime are ignored.
+    """
+    yield 5, lambda: _node_header(2)
+    for side in (0, 1):
+        yield 5, lambda: _node_header(len(layout))
+        f.seek(0)
+        for line, lengths in zip(f, layout):
+            yield lengths[side], lambda line=line, side=side: _vote_components(decode_vote(line))[side]
+
+
+def _stream_segments(f, segments, start, stop):
+    """
+    Yield the bytes in [start, stop) of the concatenated segments in chunks of about CHUNK_SIZE. Pieces outside of the
+    range are skipped without being produced. Closes `f` when done.
+    """
+    try:
+        chunk = bytearray()
+        offset = 0
+        for length, produce in segments:
+            if offset >= stop:
+                break
+            if offset + length > start:
+                chunk += produce()[max(start - offset, 0) : stop - offset]
+                if len(chunk) >= CHUNK_SIZE:
+                    yield bytes(chunk)
+                    chunk.clear()
+            offset += length
+        if chunk:
+            yield bytes(chunk)
+    finally:
+        f.close()
 
 
 @csrf.exempt
@@ -422,11 +655,17 @@ def results():
     if request.method == "POST":
         with open(RESULTS, 'w+') as result:
             result.write(json.dumps(request.get_json()))
+        STORE.increment("generation.results")
         return "OK"
 
     if not os.path.exists(RESULTS):
         return "Result file does not exist", 404
 
+    tag = conditional.etag(STORE, "results")
+    response = conditional.not_modified(conditional.variant_etag(tag, conditional.negotiate_encoding()))
+    if response is not None:
+        return response
+
     content = None
     with open(RESULTS, 'r+') as result:
         content = json.loads(result.read())
@@ -452,7 +691,8 @@ def results():
     )
     bars = sorted(content.items(), key=itemgetter(1))
     bars = [(k, 100 * v / largest, v, color) for (k, v), color in zip(bars, palette)]
-    return render_template("results.html", meta=meta, bars=bars)
+    page = render_template("results.html", meta=meta, bars=bars)
+    return conditional.artifact_response(page.encode(), tag, "text/html")
 
 
 init_stats()
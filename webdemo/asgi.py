@@ -0,0 +1,496 @@
+"""
+ASGI variant of the vote collecting server.
+
+Serves the same routes and templates as `webdemo.app`, but on an event loop: calls to the auth server are made with
+`httpx.AsyncClient` and files are read and written with `aiofiles`, so a voter waiting on Freja does not pin a worker.
+The state (pending signatures, counters, vote log) is shared with `webdemo.app`, both can serve the same election.
+Votes are recorded by `webdemo.app._record_signature` in a thread, under the same lock as all other workers.
+
+Run with e.g. `hypercorn webdemo.asgi:app -b 127.0.0.1:8000`.
+
+The request profiler of `common.profiling` is not available here, cProfile cannot attribute time to a single request
+on an event loop.
+"""
+import asyncio
+import json
+import os
+import secrets
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+
+import aiofiles
+import httpx
+from quart import Quart, Response, flash, g, redirect, render_template, request, session, url_for
+from quart.utils import run_sync_iterable
+from werkzeug.datastructures import ContentRange
+
+from common import resilience
+
+from . import admission, conditional, sign_events
+from .app import (
+    AUTH_BREAKER,
+    AUTH_TIMEOUT,
+    LIMITS,
+    PENDING,
+    POLL_DATA,
+    PUBLIC_KEY,
+    RESULTS,
+    SIGNING,
+    STATS,
+    STORE,
+    TERMINAL_STATUSES,
+    _ciphertexts_layout,
+    _ciphertexts_segments,
+    _ciphertexts_snapshot,
+    _get_email_from_jws_payload,
+    _mock_user_forward,
+    _record_signature,
+    _reset,
+    _stream_segments,
+    _validate_vote,
+    get_auth_server_url,
+    init_pk,
+    logger,
+)
+from .bytetree import decode_vote, encode_vote, vote_hash
+
+app = Quart(__name__)
+# Must be the same in all workers, otherwise sessions and CSRF tokens only validate on the worker that issued them
+app.config["SECRET_KEY"] = os.getenv("SECRET_KEY") or os.urandom(32)
+app.asgi_app = admission.AsgiProxyFix(app.asgi_app)
+
+
+
+async def _to_thread(func, *args, **kwargs):
+    # asyncio.to_thread is only available from Python 3.9
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+
+@app.before_serving
+async def _open_client():
+    app.auth_client = httpx.AsyncClient(timeout=httpx.Timeout(AUTH_TIMEOUT, connect=5.0))
+    app.sign_events_task = asyncio.ensure_future(_subscribe_to_sign_events())
+
+
+@app.after_serving
+async def _close_client():
+    app.sign_events_task.cancel()
+    await app.auth_client.aclose()
+
+
+async def _subscribe_to_sign_events():
+    # Same as `sign_events.start`, on the event loop
+    url = f"{get_auth_server_url()}/sign_events"
+    timeout = httpx.Timeout(sign_events.READ_TIMEOUT, connect=5.0)
+    delay = sign_events.RECONNECT_DELAY
+    while True:
+        try:
+            async with app.auth_client.stream("GET", url, timeout=timeout) as r:
+                r.raise_for_status()
+                logger.info(f"Subscribed to {url}")
+                sign_events.set_connected(True)
+                delay = sign_events.RECONNECT_DELAY
+
+                parser = sign_events.EventParser()
+                async for line in r.aiter_lines():
+                    event = parser.feed(line.rstrip("\r\n"))
+                    if event is not None:
+                        try:
+                            await _on_sign_event(event)
+                        except Exception:
+                            logger.exception(f"Could not handle {event}")
+            # Ended by the auth server, not an error
+            continue
+        except httpx.HTTPError as e:
+            logger.info(f"Not subscribed to {url}, polling instead: {e}")
+        finally:
+            sign_events.set_connected(False)
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, sign_events.MAX_RECONNECT_DELAY)
+
+
+async def _on_sign_event(event):
+    entry = await _to_thread(PENDING.lease_ref, event["signRef"])
+    if entry is None:
+        return
+
+    status = event["status"]
+    logger.info(f'14 -> (recieve) pushed signing outcome {status}: {entry.email},{entry.sign_ref}')
+    if status in TERMINAL_STATUSES:
+        await _to_thread(PENDING.evict, entry, status)
+        return
+    if status != "APPROVED" or not await _to_thread(PENDING.complete, entry):
+        await _to_thread(PENDING.release, entry)
+        return
+
+    logger.info('15 -> (send) forward signature')
+    if _mock_user_forward():
+        logger.info(f'17 -> (receive) receive submission request {entry.vote})')
+        await _to_thread(_record_signature, event["signature"], entry.vote)
+
+
+@app.before_request
+async def _start_deadline():
+    g.deadline = resilience.deadline_from(request.headers)
+
+
+@app.errorhandler(resilience.CircuitOpen)
+async def _circuit_open(e):
+    return resilience.circuit_open_response(e, Response)
+
+
+@app.errorhandler(resilience.DeadlineExceeded)
+async def _deadline_exceeded(e):
+    return resilience.deadline_exceeded_response(e, Response)
+
+
+@app.errorhandler(httpx.TimeoutException)
+async def _auth_timed_out(e):
+    return resilience.timed_out_response(e, Response)
+
+
+@app.errorhandler(httpx.TransportError)
+async def _auth_unreachable(e):
+    return resilience.unreachable_response(e, Response)
+
+
+@app.errorhandler(admission.RateLimited)
+async def _rate_limited(e):
+    return admission.rate_limited_response(e, Response)
+
+
+async def _post_auth(path, payload):
+    return await AUTH_BREAKER.acall(
+        app.auth_client.post,
+        f"{get_auth_server_url()}{path}",
+        json=payload,
+        **resilience.outbound(AUTH_TIMEOUT, g.deadline),
+    )
+
+
+# Minimal replacement of Flask-WTF's CSRF protection, the templates only need `csrf_token()`
+def _csrf_token():
+    if "csrf_token" not in session:
+        session["csrf_token"] = secrets.token_hex(32)
+    return session["csrf_token"]
+
+
+@app.context_processor
+def _inject_csrf_token():
+    return {"csrf_token": _csrf_token}
+
+
+def _valid_csrf_token(form):
+    expected = session.get("csrf_token")
+    return expected is not None and secrets.compare_digest(expected, form.get("csrf_token", ""))
+
+
+async def _check_for_signed_votes():
+    votes_for_verified_backend = []
+    entries = await _to_thread(PENDING.lease, online_grace=sign_events.poll_grace())
+    # Poll the auth server for all leased sign refs at once instead of one after the other
+    polls = await asyncio.gather(*(
+        _confirm_if_user_has_signed(entry.sign_ref) if entry.freja_online else _no_poll()
+        for entry in entries
+    ))
+    for entry, (signature, status) in zip(entries, polls):
+        if entry.freja_online:
+            logger.info(f'14 -> (recieve) successful vote signing: {entry.email},{entry.sign_ref}')
+
+            if status in TERMINAL_STATUSES:
+                logger.info(f'14 -> (recieve) signing ended with {status}: {entry.email},{entry.sign_ref}')
+                await _to_thread(PENDING.evict, entry, status)
+                continue
+            if signature is None:
+                await _to_thread(PENDING.release, entry)
+                continue
+        else:
+            # `sign_ref` is signature in case of offline votes
+            signature = entry.sign_ref
+
+        if not await _to_thread(PENDING.complete, entry):
+            # The lease expired and another worker took over this vote
+            continue
+
+        votes_for_verified_backend.append({'vote': entry.vote, 'signature': signature})
+        logger.info('15 -> (send) forward signature')
+        if _mock_user_forward():
+            logger.info(f'17 -> (receive) receive submission request {entry.vote})')
+            await _to_thread(_record_signature, signature, entry.vote)
+
+    if len(votes_for_verified_backend) == 0:
+        return await render_template("poll.html", data=POLL_DATA, stats=STATS, vote=None)
+
+    return await render_template(
+        "poll.html", data=POLL_DATA, stats=STATS, show_success=True, vote=json.dumps(votes_for_verified_backend)
+    )
+
+
+async def _no_poll():
+    return (None, None)
+
+
+async def _confirm_if_user_has_signed(sign_ref):
+    logger.info('13 -> (send) ask id_server if user signed')
+    try:
+        r = await _post_auth('/confirm_sign', {'signRef': sign_ref})
+    except (httpx.HTTPError, resilience.CircuitOpen, resilience.DeadlineExceeded) as e:
+        logger.info(f'13 -> (recieve) could not ask id_server: {e}')
+        return (None, None)
+
+    if r.status_code == 200:
+        return (r.json()['signature'], 'APPROVED')
+
+    if r.status_code == 400:
+        return (None, r.json().get('status'))
+
+    return (None, None)
+
+
+@app.route("/", methods=("GET", "POST"))
+async def root():
+    session_id = request.cookies.get('session')
+    if POLL_DATA["publicKey"] is None:
+        return "Missing public key!"
+
+    if request.method == "GET":
+        logger.info(f'6 -> (receive) receive request from client {session_id}')
+        logger.info('6 -> (send) send the UI to client')
+        return await _check_for_signed_votes()
+
+    form = await request.form
+    if not _valid_csrf_token(form):
+        return "The CSRF token is missing or invalid.", 400
+
+    vote = form.get("field")
+    user_email = form.get('email-for-signing')
+    error = _validate_vote(vote)
+    if error:
+        return error
+
+    ciphertext = decode_vote(vote)
+    beautified_hex_string = vote_hash(ciphertext)
+    logger.info(f'10 -> (receive) Request signing of vote: {beautified_hex_string},{user_email},{session_id}')
+
+    await _to_thread(admission.check_client, LIMITS, request.remote_addr, user_email)
+    async with SIGNING.aslot():
+        sign_request = await _post_auth('/init_sign', {
+            'email': user_email,
+            'text': '',
+            'vote': beautified_hex_string,
+        })
+
+    logger.info(f'11 -> (send) Vote signing request forwarded   : {beautified_hex_string}')
+
+    if sign_request.status_code == 200:
+        response_object = sign_request.json()
+        # Freja's expiry is in milliseconds
+        expiry = response_object.get('expiry')
+        await _to_thread(
+            PENDING.add, response_object['signRef'], encode_vote(ciphertext), True, user_email, expiry and expiry / 1000
+        )
+
+        return await render_template(
+            "poll.html", data=POLL_DATA, stats=STATS, show_success=True, hash=beautified_hex_string
+        )
+
+    if sign_request.status_code == 418:
+        await flash(sign_request.json()['message'])
+        return redirect(url_for('root'))
+
+    await flash('Could not cast your vote.')
+    return redirect(url_for('root'))
+
+
+@app.route('/login', methods=('GET', 'POST'))
+async def login():
+    if request.method == 'GET':
+        if request.cookies.get('user') is not None:
+            if await _is_authenticated(request.cookies.get('user')):
+                return redirect("/")
+        return await render_template("login.html")
+
+    email = (await request.form).get("email")
+    await _to_thread(admission.check_client, LIMITS, request.remote_addr, email)
+    async with SIGNING.aslot():
+        r = await _post_auth('/init_auth', {'email': email})
+
+    if r.status_code == 200:
+        res = redirect('/')
+        res.set_cookie('user', str(r.json()['authRef']))
+        return res
+
+    await flash(r.text)
+    return redirect(url_for("login"))
+
+
+async def _is_authenticated(user_identification):
+    r = await _post_auth('/authentication_validity', {'authRef': user_identification})
+    return r.status_code == 200
+
+
+@app.route("/offline_vote")
+async def offline_vote():
+    """
+    Endpoint for casting a vote when FrejaEID is offline.
+    """
+    async with aiofiles.open(os.path.join(app.static_folder, 'sample-signed-vote.json')) as f:
+        sample_signed_vote = json.loads(await f.read())
+
+    signature = sample_signed_vote['signature']
+    user_email = _get_email_from_jws_payload(signature)
+    await _to_thread(PENDING.add, signature, sample_signed_vote['vote'], False, user_email)
+
+    return redirect(url_for('root'))
+
+
+@app.route("/publicKey", methods=("GET", "POST"))
+async def publickey():
+    """
+    Endpoint for the public key, see `webdemo.app.publickey`.
+    """
+    if request.method == "GET":
+        if not os.path.isfile(PUBLIC_KEY):
+            return "Missing public key!", 404
+
+        tag = await _to_thread(conditional.etag, STORE, "publicKey")
+        async with aiofiles.open(PUBLIC_KEY, "rb") as f:
+            data = await f.read()
+        return conditional.artifact_response(
+            data, tag, "application/octet-stream", filename="publicKey", req=request, response_class=Response
+        )
+
+    new_pk = (await request.files).get("publicKey")
+    if new_pk is None:
+        return "publicKey missing", 400
+
+    logger.info('3 -> (receive) Received public key from admin')
+    await new_pk.save(PUBLIC_KEY)
+    await _to_thread(STORE.increment, "generation.publicKey")
+    init_pk()
+    await _to_thread(_reset)
+
+    return "OK"
+
+
+@app.route("/metrics")
+async def metrics():
+    """
+    Endpoint for monitoring, see `webdemo.app.metrics`.
+    """
+    counters = await _to_thread(STORE.counters)
+    evictions = {k.split(".", 1)[1]: v for k, v in counters.items() if k.startswith("evicted.")}
+    rate_limited = {k.split(".", 1)[1]: v for k, v in counters.items() if k.startswith("rate_limited.")}
+    return {
+        "pending_signatures": await _to_thread(len, PENDING),
+        "evictions": dict(evictions, total=sum(evictions.values())),
+        "breakers": resilience.states(),
+        "admission": dict(SIGNING.stats(), rate_limited=rate_limited),
+    }
+
+
+@app.route("/ciphertexts")
+async def ciphertexts():
+    """
+    Endpoint for the encrypted cipher votes, see `webdemo.app.ciphertexts`.
+
+    The vote log is read and serialized in a worker thread while the chunks are sent from the event loop.
+    """
+    snapshot = await _to_thread(_ciphertexts_snapshot)
+    if snapshot is None:
+        return "No ciphertexts found", 404
+
+    tag, f, size = snapshot
+    if request.if_range.etag is not None and request.if_range.etag != tag:
+        byte_ranges = None
+    else:
+        byte_ranges = request.range
+    encoding = None if byte_ranges else conditional.negotiate_encoding(request)
+
+    response = conditional.not_modified(conditional.variant_etag(tag, encoding), request, Response)
+    if response is not None:
+        f.close()
+        return response
+
+    try:
+        layout = await _to_thread(_ciphertexts_layout, f, size)
+    except BaseException:
+        f.close()
+        raise
+    total = 3 * 5 + sum(left + right for left, right in layout)
+
+    start, stop = 0, total
+    if byte_ranges is not None:
+        byte_range = byte_ranges.range_for_length(total)
+        if byte_range is None:
+            f.close()
+            response = Response("Requested range not satisfiable", status=416)
+            response.content_range = ContentRange("bytes", None, None, total)
+            return response
+        start, stop = byte_range
+
+    chunks = conditional.compress_stream(_stream_segments(f, _ciphertexts_segments(f, layout), start, stop), encoding)
+    response = Response(
+        run_sync_iterable(chunks),
+        status=206 if (start, stop) != (0, total) else 200,
+        mimetype="application/octet-stream",
+    )
+    if encoding is None:
+        response.content_length = stop - start
+    response.accept_ranges = "bytes"
+    conditional.set_headers(response, conditional.variant_etag(tag, encoding), encoding, filename="ciphertexts")
+    if response.status_code == 206:
+        response.content_range = ContentRange("bytes", start, stop, total)
+    return response
+
+
+@app.route("/results", methods=("GET", "POST"))
+async def results():
+    """
+    Endpoint for the results page, see `webdemo.app.results`.
+    """
+    if request.method == "POST":
+        content = await request.get_json()
+        async with aiofiles.open(RESULTS, 'w+') as result:
+            await result.write(json.dumps(content))
+        await _to_thread(STORE.increment, "generation.results")
+        return "OK"
+
+    if not os.path.exists(RESULTS):
+        return "Result file does not exist", 404
+
+    tag = await _to_thread(conditional.etag, STORE, "results")
+    response = conditional.not_modified(
+        conditional.variant_etag(tag, conditional.negotiate_encoding(request)), request, Response
+    )
+    if response is not None:
+        return response
+
+    async with aiofiles.open(RESULTS, 'r+') as result:
+        content = json.loads(await result.read())
+
+    if content is None:
+        return "Result file is empty", 404
+
+    largest = max(content.values())
+    palette = [
+        "#332288",
+        "#88CCEE",
+        "#44AA99",
+        "#117733",
+        "#999933",
+        "#DDCC77",
+        "#CC6677",
+        "#882255",
+        "#AA4499",
+    ]
+    palette = islice(palette, len(content))
+    meta = dict(
+        question=POLL_DATA["question"], nvotes=sum(content.values()), largest=largest
+    )
+    bars = sorted(content.items(), key=itemgetter(1))
+    bars = [(k, 100 * v / largest, v, color) for (k, v), color in zip(bars, palette)]
+    page = await render_template("results.html", meta=meta, bars=bars)
+    return conditional.artifact_response(page.encode(), tag, "text/html", req=request, response_class=Response)
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
+import base64
+import json
 from collections.abc import Sequence
+from hashlib import sha256
 from typing import ByteString, Iterator, List, Tuple, Union
 
 BYTEORDER = "big"
@@ -137,6 +140,37 @@ def _main(args: List[str]) -> int:
     return 0
 
 
+def vote_hash(vote) -> str:
+    """
+    SHA-256 of the byte tree of a vote, in groups of 4 hex digits. This is the text the voter signs in the Freja app.
+    """
+    hex_string = sha256(ByteTree(vote).to_byte_array()).hexdigest()
+    return " ".join(hex_string[i : i + 4] for i in range(0, len(hex_string), 4))
+
+
+def encode_vote(vote: ByteString) -> str:
+    """
+    Text form of a serialized vote, base64 as submitted by poll.html.
+    """
+    return base64.b64encode(vote).decode("ascii")
+
+
+def decode_vote(text: str):
+    """
+    Serialized vote from its text form. Also accepts the JSON array of its bytes that poll.html used to submit, and
+    returns votes stored as a JSON array of their two serialized components as such.
+    """
+    text = text.strip()
+    if text.startswith("["):
+        vote = json.loads(text)
+        if not vote or not isinstance(vote[0], int):
+            return vote
+        if not all(isinstance(x, int) and 0 <= x <= 255 for x in vote):
+            raise ValueError("Vote should be an array of integers from 0 to 255")
+        return bytes(vote)
+    return base64.b64decode(text, validate=True)
+
+
 def byte_array_byte_tree_to_json(ba: ByteString):
     return ByteTree.from_byte_array(ba).pretty_str()
 
@@ -0,0 +1,118 @@
+"""
+Conditional GET and compressed transfer for the election artifacts.
+
+Every artifact has a generation counter in the shared store which is incremented after the artifact changes. Its
+strong ETag is derived from that counter, so all workers agree on it without hashing the payload, and a client that
+already holds the current version gets a `304 Not Modified` after a single header exchange.
+
+Bodies are compressed with zstd (if the `zstandard` package is installed) or gzip when the client asks for it. Each
+encoding is a separate representation with its own ETag.
+
+The helpers default to Flask's request and response classes. The ASGI variant of the server passes Quart's instead.
+"""
+import gzip
+import zlib
+
+from flask import Response, request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# In order of preference
+ENCODINGS = ("zstd", "gzip") if zstandard else ("gzip",)
+# Smaller bodies are not worth compressing
+MIN_SIZE = 256
+
+
+def etag(store, name):
+    """
+    ETag of the current version of artifact `name`.
+    """
+    counters = store.counters()
+    return "{:x}-{}".format(counters["epoch"], counters.get(f"generation.{name}", 0))
+
+
+def variant_etag(tag, encoding):
+    return f"{tag}-{encoding}" if encoding else tag
+
+
+def negotiate_encoding(req=request):
+    """
+    Pick the content encoding for the current request, None means identity.
+    """
+    accepted = [(req.accept_encodings.quality(e), -idx, e) for idx, e in enumerate(ENCODINGS)]
+    quality, _, encoding = max(accepted)
+    return encoding if quality > 0 else None
+
+
+def not_modified(tag, req=request, response_class=Response):
+    """
+    Return a `304 Not Modified` response if the client already has the representation tagged `tag`, None otherwise.
+    """
+    if not req.if_none_match.contains_weak(tag):
+        return None
+
+    response = response_class("", status=304)
+    _set_validators(response, tag)
+    return response
+
+
+def compress(data, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == "gzip":
+        # Fixed mtime so that the same input always yields the same bytes, as required by a strong ETag
+        return gzip.compress(data, mtime=0)
+    return data
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compress an iterable of byte chunks on the fly.
+    """
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor().compressobj()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        yield from chunks
+        return
+
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def artifact_response(data, tag, mimetype, filename=None, req=request, response_class=Response):
+    """
+    Response for an artifact that is held in memory, honoring `If-None-Match` and `Accept-Encoding`.
+    """
+    encoding = negotiate_encoding(req) if len(data) >= MIN_SIZE else None
+    tag = variant_etag(tag, encoding)
+
+    response = not_modified(tag, req, response_class)
+    if response is not None:
+        return response
+
+    response = response_class(compress(data, encoding), mimetype=mimetype)
+    set_headers(response, tag, encoding, filename)
+    return response
+
+
+def set_headers(response, tag, encoding, filename=None):
+    _set_validators(response, tag)
+    if encoding:
+        response.content_encoding = encoding
+    if filename:
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+
+
+def _set_validators(response, tag):
+    response.set_etag(tag)
+    response.vary.add("Accept-Encoding")
+    # Caches may keep the artifact but must revalidate it on every use
+    response.cache_control.no_cache = True
@@ -0,0 +1,120 @@
+"""
+Subscription to the outcome of signature requests, pushed by the auth server.
+
+The auth server streams an event at `/sign_events` (server-sent events) as soon as it sees a signature request end,
+so that a vote can be recorded right after the voter signed instead of at the next poll. While the stream is
+connected, the workers only poll for the votes whose event is overdue (see `poll_grace`); if it drops, polling takes
+over until it reconnects. On every connect, the auth server replays the outcomes of the last ten minutes, so that
+nothing is lost in between. The auth server ends the stream every few minutes, it is then reopened right away.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger("vote_collection_server|sign_events")
+
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+# The auth server sends a comment at least every few seconds, a longer silence means the connection is dead
+READ_TIMEOUT = 30.0
+# Seconds past its next poll after which a vote is polled even while subscribed, in case its event was missed, e.g.
+# because another worker held the vote when it arrived or the auth server could not reach Freja for a while
+FALLBACK_POLL_DELAY = float(os.getenv("SIGN_EVENTS_FALLBACK_DELAY", 30))
+
+_connected = threading.Event()
+_started_in = None
+
+
+class EventParser:
+    """
+    Incremental parser of a `text/event-stream`. Only the data of events is of interest, as JSON.
+    """
+
+    def __init__(self):
+        self._data = []
+
+    def feed(self, line):
+        """
+        Parse one line without its line break. Returns the data of the event it completes, if any.
+        """
+        if line == "":
+            data, self._data = self._data, []
+            return json.loads("\n".join(data)) if data else None
+        if line.startswith(":"):
+            return None
+
+        field, _, value = line.partition(":")
+        if field == "data":
+            self._data.append(value[1:] if value.startswith(" ") else value)
+        return None
+
+
+def connected():
+    """
+    Whether this process currently receives the events.
+    """
+    return _connected.is_set()
+
+
+def poll_grace():
+    """
+    Seconds a vote waiting in the Freja app may be overdue before it is polled, see `store.PendingSignatures.lease`.
+    """
+    return FALLBACK_POLL_DELAY if connected() else 0.0
+
+
+def set_connected(value):
+    if value:
+        _connected.set()
+    else:
+        _connected.clear()
+
+
+def start(url, handle):
+    """
+    Subscribe to `url` in a background thread and call `handle` with every event. Once per process.
+    """
+    global _started_in
+    # The thread does not survive a fork, hence the pid rather than a flag
+    if _started_in == os.getpid():
+        return
+    _started_in = os.getpid()
+    threading.Thread(target=_subscribe, args=(url, handle), name="sign-events", daemon=True).start()
+
+
+def _subscribe(url, handle):
+    delay = RECONNECT_DELAY
+    while True:
+        try:
+            with requests.get(url, stream=True, timeout=(5, READ_TIMEOUT)) as r:
+                r.raise_for_status()
+                logger.info(f"Subscribed to {url}")
+                set_connected(True)
+                delay = RECONNECT_DELAY
+
+                parser = EventParser()
+                for line in r.iter_lines(decode_unicode=True):
+                    event = parser.feed(line)
+                    if event is not None:
+                        _handle(handle, event)
+            # Ended by the auth server, not an error
+            continue
+        except requests.RequestException as e:
+            logger.info(f"Not subscribed to {url}, polling instead: {e}")
+        finally:
+            set_connected(False)
+
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+def _handle(handle, event):
+    try:
+        handle(event)
+    except Exception:
+        # The entry stays queued and is picked up by polling
+        logger.exception(f"Could not handle {event}")
@@ -0,0 +1,284 @@
+"""
+State shared between the workers of the vote collecting server.
+
+gunicorn runs several worker processes which do not share memory, so everything that has to be seen by all of them is
+kept in a local SQLite database in WAL mode. SQLite serializes writers, which is all the coordination needed here.
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
+from contextlib import closing, contextmanager
+
+# How long a worker may hold an entry before other workers consider it abandoned
+LEASE_SECONDS = 30.0
+# Minimum time between two polls of the same sign ref, regardless of the number of workers. The interval doubles after
+# every unsuccessful poll, up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 2.0
+MAX_POLL_INTERVAL = 60.0
+# Freja keeps a signature request open for two days unless told otherwise
+SIGN_TTL = 2 * 24 * 60 * 60
+
+# Freja statuses after which a sign ref will never become APPROVED
+TERMINAL_STATUSES = ("CANCELED", "RP_CANCELED", "EXPIRED", "REJECTED")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_signatures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sign_ref TEXT NOT NULL UNIQUE,
+    vote TEXT NOT NULL,
+    freja_online INTEGER NOT NULL,
+    email TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_poll REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS pending_signatures_next_poll ON pending_signatures (next_poll);
+CREATE INDEX IF NOT EXISTS pending_signatures_expires_at ON pending_signatures (expires_at);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    full_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rate_limits_full_at ON rate_limits (full_at);
+"""
+
+# `sign_ref` is the signature itself for votes cast while Freja is offline
+PendingSignature = namedtuple("PendingSignature", "id sign_ref vote freja_online email attempts lease_owner")
+
+
+class Store:
+    """
+    Connection to the shared database. Also holds named counters, which all workers can increment atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Random value identifying this database, so that counters are never reused after the file is deleted
+            conn.execute(
+                "INSERT OR IGNORE INTO counters (name, value) VALUES ('epoch', ?)",
+                (int.from_bytes(os.urandom(4), "big"),),
+            )
+
+    def _connect(self):
+        # Autocommit mode, transactions are started explicitly where needed
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def counters(self):
+        with closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT name, value FROM counters ORDER BY name"))
+
+    def counter(self, name):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+            return row[0] if row else 0
+
+    def increment(self, name, amount=1):
+        with closing(self._connect()) as conn:
+            self._increment(conn, name, amount)
+
+    @staticmethod
+    def _increment(conn, name, amount=1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + ?",
+            (name, amount, amount),
+        )
+
+
+class PendingSignatures(Store):
+    """
+    Queue of votes waiting for the voter to sign them in the Freja app.
+
+    Workers `lease` the entries that are due for a poll. A leased entry is not handed out again before its poll
+    interval has passed, and not before its lease expires either, so every sign ref is polled at most once per interval
+    no matter how many workers are running. The interval grows exponentially with the number of polls. Once done, the
+    worker either `complete`s, `evict`s or `release`s the entry.
+
+    Entries are evicted without further polling once they expire, and every eviction is counted under
+    `evicted.<reason>` in `counters()`.
+    """
+
+    def __init__(
+        self,
+        path,
+        lease_seconds=LEASE_SECONDS,
+        poll_interval=POLL_INTERVAL,
+        max_poll_interval=MAX_POLL_INTERVAL,
+        ttl=SIGN_TTL,
+    ):
+        super().__init__(path)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.ttl = ttl
+
+    def add(self, sign_ref, vote, freja_online, email, expires_at=None):
+        """
+        Queue a vote. `expires_at` is the UNIX time after which the signature request is dead, defaults to `ttl` seconds
+        from now. Returns False if `sign_ref` is already queued.
+        """
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + self.ttl
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO pending_signatures"
+                " (sign_ref, vote, freja_online, email, created_at, expires_at, next_poll)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sign_ref, json.dumps(vote), int(freja_online), email, now, expires_at, now),
+            )
+            return cursor.rowcount == 1
+
+    def lease(self, limit=100, online_grace=0.0):
+        """
+        Take the entries that are due for a poll and hold them for `lease_seconds`. Expired entries are evicted first.
+        Entries waiting for a signature in the Freja app are only taken once they are `online_grace` seconds overdue.
+        """
+        now = time.time()
+        owner = uuid.uuid4().hex
+        with self._transaction() as conn:
+            expired = conn.execute("DELETE FROM pending_signatures WHERE expires_at <= ?", (now,)).rowcount
+            if expired:
+                self._increment(conn, "evicted.EXPIRED", expired)
+
+            rows = conn.execute(
+                "SELECT id, sign_ref, vote, freja_online, email, attempts FROM pending_signatures"
+                " WHERE next_poll <= ? AND lease_until <= ? AND (freja_online = 0 OR next_poll <= ?)"
+                " ORDER BY next_poll, id LIMIT ?",
+                (now, now, now - online_grace, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE pending_signatures SET lease_owner = ?, lease_until = ?, next_poll = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                [(owner, now + self.lease_seconds, now + self._backoff(row[5]), row[0]) for row in rows],
+            )
+
+        return [
+            PendingSignature(id_, sign_ref, json.loads(vote), bool(freja_online), email, attempts + 1, owner)
+            for id_, sign_ref, vote, freja_online, email, attempts in rows
+        ]
+
+    def lease_ref(self, sign_ref):
+        """
+        Take the entry of `sign_ref` regardless of when it is due, e.g. because the auth server pushed its outcome.
+        Returns None if it is not queued or held by another worker.
+        """
+        now = time.time()
+        owner = uuid.uuid4().hex
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, vote, freja_online, email, attempts FROM pending_signatures"
+                " WHERE sign_ref = ? AND freja_online = 1 AND lease_until <= ?",
+                (sign_ref, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE pending_signatures SET lease_owner = ?, lease_until = ? WHERE id = ?",
+                (owner, now + self.lease_seconds, row[0]),
+            )
+
+        id_, vote, freja_online, email, attempts = row
+        return PendingSignature(id_, sign_ref, json.loads(vote), bool(freja_online), email, attempts, owner)
+
+    def _backoff(self, attempts):
+        return min(self.poll_interval * 2 ** min(attempts, 32), self.max_poll_interval)
+
+    def complete(self, entry):
+        """
+        Remove a leased entry. Returns False if the lease was lost to another worker in the meantime, in which case the
+        caller must not act on the entry.
+        """
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "DELETE FROM pending_signatures WHERE id = ? AND lease_owner = ?",
+                (entry.id, entry.lease_owner),
+            )
+            return cursor.rowcount == 1
+
+    def evict(self, entry, reason):
+        """
+        Remove a leased entry that will never be signed, e.g. because the voter canceled the request.
+        """
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM pending_signatures WHERE id = ? AND lease_owner = ?",
+                (entry.id, entry.lease_owner),
+            ).rowcount
+            if deleted:
+                self._increment(conn, f"evicted.{reason}", deleted)
+        return bool(deleted)
+
+    def release(self, entry):
+        """
+        Give a leased entry back to the queue. It is polled again once its backoff interval has passed since it was
+        leased.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE pending_signatures SET lease_owner = NULL, lease_until = 0 WHERE id = ? AND lease_owner = ?",
+                (entry.id, entry.lease_owner),
+            )
+
+    def clear(self):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM pending_signatures")
+
+    def __len__(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM pending_signatures").fetchone()[0]
+
+
+class RateLimits(Store):
+    """
+    Token buckets shared by all workers, one per key.
+
+    The bucket of a key holds up to `burst` tokens and refills at `rate` tokens per second. It is stored as the time
+    at which it is full again, and keys whose bucket is full have no row at all, so the table only holds the keys that
+    were active recently.
+    """
+
+    def take(self, key, rate, burst, max_wait=0.0):
+        """
+        Take a token from the bucket of `key`. Returns the seconds until the token is available; it is only taken if
+        that is at most `max_wait`, and the caller then has to wait that long before going ahead.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rate_limits WHERE full_at <= ?", (now,))
+            row = conn.execute("SELECT full_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            full_at = (row[0] if row else now) + 1 / rate
+            # The token is available once the bucket would be less than `burst` tokens short of full
+            wait = max(full_at - burst / rate - now, 0.0)
+            if wait <= max_wait:
+                conn.execute(
+                    "INSERT INTO rate_limits (key, full_at) VALUES (?, ?)"
+                    " ON CONFLICT (key) DO UPDATE SET full_at = excluded.full_at",
+                    (key, full_at),
+                )
+        return wait